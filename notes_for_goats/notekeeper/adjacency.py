@@ -0,0 +1,192 @@
+"""
+In-memory adjacency of each workspace's relationships.
+
+The entity list's relationship filter, entity detail, the entity graph and
+the AI context builders all ask "which relationships touch these entities?".
+Rather than filter Relationship on its generic foreign keys for every
+entity, they look the answer up in a WorkspaceAdjacency: the workspace's
+entity-to-entity relationships as parallel integer arrays (relationship id,
+source, target, type), in relationship id order. Entity ids are numbered
+densely in sorted order, and CSR-style offsets index the arrays by node:
+out_order[out_offsets[n]:out_offsets[n + 1]] are the positions of the
+relationships leaving node n, and in_order/in_offsets those arriving at it.
+A neighbour lookup is a binary search and two slices.
+
+Each process keeps the adjacency of the ADJACENCY_CACHE_SIZE most recently
+used workspaces. Workspace.relationship_version is bumped whenever one of a
+workspace's relationships is saved or deleted (signals.py) or bulk created
+(inference.py). Lookups read it with one small query and rebuild the
+adjacency when it has moved on, so every process sees changes at once.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.db.models import F
+
+from .models import Entity, Relationship, Workspace
+from .utils.relationships import resolve_relationship_endpoints
+
+_adjacencies = OrderedDict()  # workspace id -> WorkspaceAdjacency, least recently used first
+_lock = threading.Lock()
+
+_NO_POSITIONS = np.zeros(0, dtype=np.int32)
+
+
+def bump_relationship_version(workspace_ids):
+    """Record that the relationships of workspace_ids changed"""
+    Workspace.objects.filter(pk__in=list(workspace_ids)).update(
+        relationship_version=F('relationship_version') + 1
+    )
+
+
+class WorkspaceAdjacency:
+    """The entity-to-entity relationships of a workspace at one relationship_version"""
+
+    def __init__(self, workspace_id, version, rows):
+        self.workspace_id = workspace_id
+        self.version = version
+
+        table = np.array(rows, dtype=np.int64).reshape(-1, 4)
+        self.relationship_ids = np.ascontiguousarray(table[:, 0])
+        self.sources = np.ascontiguousarray(table[:, 1])
+        self.targets = np.ascontiguousarray(table[:, 2])
+        self.type_ids = table[:, 3].astype(np.int32)
+
+        self.node_ids = np.unique(np.concatenate((self.sources, self.targets)))
+        self.out_offsets, self.out_order = self._index(np.searchsorted(self.node_ids, self.sources))
+        self.in_offsets, self.in_order = self._index(np.searchsorted(self.node_ids, self.targets))
+
+    def _index(self, nodes):
+        # A stable sort keeps each node's relationships in id order
+        order = np.argsort(nodes, kind='stable').astype(np.int32)
+        offsets = np.zeros(len(self.node_ids) + 1, dtype=np.int32)
+        np.cumsum(np.bincount(nodes, minlength=len(self.node_ids)), out=offsets[1:])
+        return offsets, order
+
+    def __len__(self):
+        return len(self.relationship_ids)
+
+    def _node(self, entity_id):
+        node = int(np.searchsorted(self.node_ids, entity_id))
+        if node < len(self.node_ids) and self.node_ids[node] == entity_id:
+            return node
+        return None
+
+    def outgoing(self, entity_id):
+        """Positions of the relationships from entity_id, in id order"""
+        node = self._node(entity_id)
+        if node is None:
+            return _NO_POSITIONS
+        return self.out_order[self.out_offsets[node]:self.out_offsets[node + 1]]
+
+    def incoming(self, entity_id):
+        """Positions of the relationships to entity_id, in id order"""
+        node = self._node(entity_id)
+        if node is None:
+            return _NO_POSITIONS
+        return self.in_order[self.in_offsets[node]:self.in_offsets[node + 1]]
+
+    def touching(self, entity_ids, relationship_type_ids=None):
+        """
+        Positions of the relationships from or to any of entity_ids, once
+        each and in id order, optionally only those of relationship_type_ids
+        """
+        parts = [_NO_POSITIONS]
+        for entity_id in entity_ids:
+            parts.append(self.outgoing(entity_id))
+            parts.append(self.incoming(entity_id))
+        positions = np.unique(np.concatenate(parts))
+        if relationship_type_ids:
+            positions = positions[np.isin(self.type_ids[positions], list(relationship_type_ids))]
+        return positions
+
+    def related_ids(self, entity_id, relationship_type_id, either_direction=False):
+        """
+        Ids of the entities with a relationship_type_id relationship to
+        entity_id, and with either_direction also those it has one to
+        """
+        positions = self.incoming(entity_id)
+        ids = [self.sources[positions[self.type_ids[positions] == relationship_type_id]]]
+        if either_direction:
+            positions = self.outgoing(entity_id)
+            ids.append(self.targets[positions[self.type_ids[positions] == relationship_type_id]])
+        return np.unique(np.concatenate(ids)).tolist()
+
+    def endpoint_ids(self, relationship_type_id, sources=False):
+        """Ids of the targets, and with sources also the sources, of relationship_type_id relationships"""
+        of_type = self.type_ids == relationship_type_id
+        ids = [self.targets[of_type]]
+        if sources:
+            ids.append(self.sources[of_type])
+        return np.unique(np.concatenate(ids)).tolist()
+
+
+def _build(workspace_id, version):
+    entity_content_type = ContentType.objects.get_for_model(Entity)
+    rows = Relationship.objects.filter(
+        workspace_id=workspace_id,
+        source_content_type=entity_content_type,
+        target_content_type=entity_content_type
+    ).order_by('id').values_list('id', 'source_object_id', 'target_object_id', 'relationship_type_id')
+    return WorkspaceAdjacency(workspace_id, version, list(rows))
+
+
+def workspace_adjacency(workspace_id):
+    """The current WorkspaceAdjacency of a workspace, from the cache if it is up to date"""
+    # Read the version before the relationships: a change committed in
+    # between then only makes the cached copy newer than its version
+    version = Workspace.objects.filter(pk=workspace_id).values_list('relationship_version', flat=True).first()
+    with _lock:
+        adjacency = _adjacencies.get(workspace_id)
+        if adjacency is not None and adjacency.version == version:
+            _adjacencies.move_to_end(workspace_id)
+            return adjacency
+
+    adjacency = _build(workspace_id, version)
+
+    # A transaction that rolls back hands its version number out again, for
+    # other relationships, so only cache what has been committed
+    if not connection.in_atomic_block:
+        with _lock:
+            _adjacencies[workspace_id] = adjacency
+            _adjacencies.move_to_end(workspace_id)
+            while len(_adjacencies) > settings.ADJACENCY_CACHE_SIZE:
+                _adjacencies.popitem(last=False)
+    return adjacency
+
+
+def relationships_of(workspace_id, entity_ids):
+    """
+    {entity id: (outgoing, incoming)} for entity_ids, each a list of the
+    entity's entity-to-entity Relationships in id order, with their
+    relationship types and both endpoints loaded. Takes one query for the
+    relationships and one for the entities at their ends.
+    """
+    adjacency = workspace_adjacency(workspace_id)
+    positions = {
+        entity_id: (adjacency.outgoing(entity_id), adjacency.incoming(entity_id))
+        for entity_id in entity_ids
+    }
+    wanted = set()
+    for outgoing, incoming in positions.values():
+        wanted.update(adjacency.relationship_ids[outgoing].tolist())
+        wanted.update(adjacency.relationship_ids[incoming].tolist())
+
+    relationships = Relationship.objects.select_related('relationship_type').in_bulk(wanted) if wanted else {}
+    resolve_relationship_endpoints(relationships.values())
+
+    def _load(found):
+        return [
+            relationships[relationship_id]
+            for relationship_id in adjacency.relationship_ids[found].tolist()
+            if relationship_id in relationships
+        ]
+
+    return {
+        entity_id: (_load(outgoing), _load(incoming))
+        for entity_id, (outgoing, incoming) in positions.items()
+    }
@@ -1,7 +1,9 @@
 from django.contrib import admin
-from .models import Workspace, Entity, Note, RelationshipType, Relationship, Tag, NoteEmbedding, EntityEmbedding
+from django.contrib.admin.views.main import ChangeList
+from django.contrib.contenttypes.models import ContentType
+from .models import Workspace, Entity, Note, RelationshipType, Relationship, Tag, NoteEmbedding, EntityEmbedding, EmbeddingJob
+from .utils.relationships import resolve_relationship_endpoints
 from django.utils.safestring import mark_safe
-import json
 import numpy as np
 from django.conf import settings
 
@@ -106,10 +108,18 @@ class EntityAdmin(admin.ModelAdmin):
 
     def get_relationships(self, obj):
         relationships = []
+        entity_content_type = ContentType.objects.get_for_model(Entity)
         # Get relationships where this entity is either source or target
-        for rel in Relationship.objects.filter(source_object_id=obj.id):
+        outgoing = list(Relationship.objects.filter(
+            source_content_type=entity_content_type, source_object_id=obj.id
+        ).select_related('relationship_type'))
+        incoming = list(Relationship.objects.filter(
+            target_content_type=entity_content_type, target_object_id=obj.id
+        ).select_related('relationship_type'))
+        resolve_relationship_endpoints(outgoing + incoming)
+        for rel in outgoing:
             relationships.append(f"{rel.target}: {rel.relationship_type}")
-        for rel in Relationship.objects.filter(target_object_id=obj.id):
+        for rel in incoming:
             relationships.append(f"{rel.source}: {rel.relationship_type}")
         return ", ".join(relationships) if relationships else "-"
     get_relationships.short_description = "Relationships"
@@ -129,10 +139,21 @@ class RelationshipTypeAdmin(admin.ModelAdmin):
     list_display = ('display_name', 'workspace', 'is_directional')
     list_filter = ('workspace',)
 
+class RelationshipChangeList(ChangeList):
+    """Loads the sources and targets of a page of relationships in bulk"""
+    
+    def get_results(self, request):
+        super().get_results(request)
+        self.result_list = resolve_relationship_endpoints(self.result_list)
+
 @admin.register(Relationship)
 class RelationshipAdmin(admin.ModelAdmin):
     list_display = ('source_str', 'relationship_type', 'target_str', 'workspace', 'details')
     list_filter = ('workspace', 'relationship_type')
+    list_select_related = ('relationship_type', 'workspace')
+    
+    def get_changelist(self, request, **kwargs):
+        return RelationshipChangeList
     
     def source_str(self, obj):
         return str(obj.source) if obj.source else f"ID: {obj.source_object_id}"
@@ -167,7 +188,7 @@ class NoteEmbeddingAdmin(admin.ModelAdmin):
     list_display = ('get_note_title', 'get_note_workspace', 'generated_at', 'get_embedding_length', 'get_embedding_preview')
     list_filter = ('note__workspace', 'generated_at')
     search_fields = ('note__title', 'note__content')
-    readonly_fields = ('note', 'embedding', 'generated_at', 'get_embedding_details', 'get_similar_notes')
+    readonly_fields = ('note', 'model_name', 'dimensions', 'generated_at', 'get_embedding_details', 'get_similar_notes')
     
     def get_note_title(self, obj):
         """Return the title of the associated note with a link"""
@@ -186,20 +207,18 @@ class NoteEmbeddingAdmin(admin.ModelAdmin):
     
     def get_embedding_length(self, obj):
         """Return the length of the embedding vector"""
-        if obj.embedding:
-            return len(obj.embedding)
-        return 0
+        return obj.dimensions
     get_embedding_length.short_description = "Vector Dimensions"
     
     def get_embedding_preview(self, obj):
         """Return a preview of the embedding vector"""
         if obj.embedding:
             # Calculate the magnitude of the vector
-            embedding_array = np.array(obj.embedding)
+            embedding_array = obj.vector
             magnitude = np.linalg.norm(embedding_array)
             
             # Get first few values
-            preview = [f"{x:.4f}" for x in obj.embedding[:3]]
+            preview = [f"{x:.4f}" for x in embedding_array[:3]]
             return f"[{', '.join(preview)}, ...] (mag: {magnitude:.2f})"
         return "-"
     get_embedding_preview.short_description = "Embedding Preview"
@@ -209,7 +228,7 @@ class NoteEmbeddingAdmin(admin.ModelAdmin):
         if not obj.embedding:
             return "No embedding data"
             
-        embedding_array = np.array(obj.embedding)
+        embedding_array = obj.vector
         stats = {
             "Dimensions": len(embedding_array),
             "Magnitude": np.linalg.norm(embedding_array),
@@ -263,8 +282,8 @@ class NoteEmbeddingAdmin(admin.ModelAdmin):
                 return "No other embeddings to compare"
                 
             # Prepare for similarity search
-            embedding_array = np.array(obj.embedding)
-            other_arrays = [np.array(oe.embedding) for oe in other_embeddings]
+            embedding_array = obj.vector
+            other_arrays = [oe.vector for oe in other_embeddings]
             notes = [oe.note for oe in other_embeddings]
             
             # Calculate similarities
@@ -316,7 +335,7 @@ class EntityEmbeddingAdmin(admin.ModelAdmin):
     list_display = ('get_entity_name', 'get_entity_type', 'get_entity_workspace', 'generated_at', 'get_embedding_length', 'get_embedding_preview')
     list_filter = ('entity__workspace', 'entity__type', 'generated_at')
     search_fields = ('entity__name', 'entity__details')
-    readonly_fields = ('entity', 'embedding', 'generated_at', 'get_embedding_details', 'get_similar_entities')
+    readonly_fields = ('entity', 'model_name', 'dimensions', 'generated_at', 'get_embedding_details', 'get_similar_entities')
     
     def get_entity_name(self, obj):
         """Return the name of the associated entity with a link"""
@@ -342,20 +361,18 @@ class EntityEmbeddingAdmin(admin.ModelAdmin):
     
     def get_embedding_length(self, obj):
         """Return the length of the embedding vector"""
-        if obj.embedding:
-            return len(obj.embedding)
-        return 0
+        return obj.dimensions
     get_embedding_length.short_description = "Vector Dimensions"
     
     def get_embedding_preview(self, obj):
         """Return a preview of the embedding vector"""
         if obj.embedding:
             # Calculate the magnitude of the vector
-            embedding_array = np.array(obj.embedding)
+            embedding_array = obj.vector
             magnitude = np.linalg.norm(embedding_array)
             
             # Get first few values
-            preview = [f"{x:.4f}" for x in obj.embedding[:3]]
+            preview = [f"{x:.4f}" for x in embedding_array[:3]]
             return f"[{', '.join(preview)}, ...] (mag: {magnitude:.2f})"
         return "-"
     get_embedding_preview.short_description = "Embedding Preview"
@@ -365,7 +382,7 @@ class EntityEmbeddingAdmin(admin.ModelAdmin):
         if not obj.embedding:
             return "No embedding data"
             
-        embedding_array = np.array(obj.embedding)
+        embedding_array = obj.vector
         stats = {
             "Dimensions": len(embedding_array),
             "Magnitude": np.linalg.norm(embedding_array),
@@ -431,8 +448,8 @@ class EntityEmbeddingAdmin(admin.ModelAdmin):
                 return "No other embeddings to compare"
                 
             # Prepare for similarity search
-            embedding_array = np.array(obj.embedding)
-            other_arrays = [np.array(oe.embedding) for oe in other_embeddings]
+            embedding_array = obj.vector
+            other_arrays = [oe.vector for oe in other_embeddings]
             entities = [oe.entity for oe in other_embeddings]
             
             # Calculate similarities
@@ -474,3 +491,9 @@ class EntityEmbeddingAdmin(admin.ModelAdmin):
     def has_change_permission(self, request, obj=None):
         """Disable direct editing of embeddings - they should be updated by the system"""
         return False
+
+@admin.register(EmbeddingJob)
+class EmbeddingJobAdmin(admin.ModelAdmin):
+    list_display = ('object_type', 'object_id', 'status', 'attempts', 'next_attempt_at', 'requested_at')
+    list_filter = ('status', 'object_type')
+    readonly_fields = ('started_at', 'last_error', 'created_at')
@@ -0,0 +1,83 @@
+"""
+Batch mode for bulk writes.
+
+Saving a note or entity normally sets off a chain of side effects: hashtag
+parsing and tag relinking, the note tag m2m handler, embedding jobs, vector
+index updates and a database backup. Inside a deferred_side_effects() block
+these are only recorded. When the block exits they run once for everything
+written in it: one relink pass, one bulk embedding enqueue, one index
+rebuild per workspace, one relationship version bump per workspace and at
+most one backup.
+
+    with deferred_side_effects(), transaction.atomic():
+        for row in rows:
+            Note(workspace=workspace, title=row['title'], content=row['content']).save()
+
+Batches are per thread and nest (the outermost block does the work). If the
+block raises, the recorded side effects are dropped.
+"""
+import threading
+from contextlib import contextmanager
+
+from django.dispatch import Signal
+
+# Largest id list put into a single IN (...) while running a batch
+BATCH_CHUNK_SIZE = 500
+
+# Sent with batch=<SideEffectBatch> when the outermost block exits without
+# an error; signals.py runs the deferred work
+batch_finished = Signal()
+
+_local = threading.local()
+
+
+class SideEffectBatch:
+    """The side effects recorded while a batch is open"""
+
+    def __init__(self):
+        self.hashtag_note_ids = set()  # Notes whose hashtags need resolving
+        self.name_tag_entity_ids = set()  # Entities that need their name tag
+        self.relink_note_ids = set()  # Notes given new tags
+        self.embedding_note_ids = set()
+        self.embedding_entity_ids = set()
+        self.index_workspace_ids = set()  # Workspaces whose vector index changed
+        self.relationship_workspace_ids = set()  # Workspaces whose relationships changed
+        self.backup_reason = None
+
+    def __bool__(self):
+        return any((
+            self.hashtag_note_ids, self.name_tag_entity_ids, self.relink_note_ids,
+            self.embedding_note_ids, self.embedding_entity_ids, self.index_workspace_ids,
+            self.relationship_workspace_ids, self.backup_reason,
+        ))
+
+
+def current_batch():
+    """The open SideEffectBatch of this thread, or None"""
+    return getattr(_local, 'batch', None)
+
+
+@contextmanager
+def deferred_side_effects():
+    """Defer the side effects of saves in the block until it exits (see module docstring)"""
+    batch = current_batch()
+    if batch is not None:
+        yield batch
+        return
+
+    batch = SideEffectBatch()
+    _local.batch = batch
+    try:
+        yield batch
+    finally:
+        _local.batch = None
+
+    if batch:
+        batch_finished.send(sender=SideEffectBatch, batch=batch)
+
+
+def chunked(ids, size=BATCH_CHUNK_SIZE):
+    """Split ids into sorted lists of at most size ids"""
+    ids = sorted(ids)
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
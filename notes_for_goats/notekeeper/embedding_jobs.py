@@ -0,0 +1,285 @@
+"""
+Background embedding jobs.
+
+Saving a note or entity only records an EmbeddingJob row; the
+run_embedding_worker command claims pending jobs, calls the embedding API
+and stores the vectors, retrying failures with exponential backoff.
+"""
+import logging
+import threading
+import time
+from contextlib import nullcontext
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.utils import timezone
+
+from .batching import chunked
+from .models import EmbeddingJob, Entity, EntityEmbedding, Note, NoteEmbedding
+from .utils.embedding import (
+    chunk_text, current_model, generate_embeddings_batch, text_hash
+)
+
+logger = logging.getLogger(__name__)
+
+# Notes above this many estimated tokens are split into chunks
+NOTE_CHUNK_THRESHOLD = 8000
+
+# SQLite fails a write that races another connection's commit ("database is
+# locked") instead of waiting, so worker threads take turns writing there.
+# Reads and API calls still run concurrently.
+_sqlite_write_lock = threading.Lock()
+
+
+def _write_lock():
+    return _sqlite_write_lock if connection.vendor == 'sqlite' else nullcontext()
+
+
+def enqueue_embedding(object_type, object_id):
+    """
+    Ask for an object's embedding to be (re)generated.
+    Coalesces with any existing job for the same object. A job that is
+    already running is left alone but marked as requested again, so the
+    worker runs it once more when it finishes.
+    """
+    now = timezone.now()
+    jobs = EmbeddingJob.objects.filter(object_type=object_type, object_id=object_id)
+
+    if not jobs.update(requested_at=now, attempts=0, last_error=''):
+        try:
+            with transaction.atomic():
+                EmbeddingJob.objects.create(object_type=object_type, object_id=object_id, requested_at=now)
+            return
+        except IntegrityError:
+            # Another process created it first; fall through and coalesce
+            jobs.update(requested_at=now, attempts=0, last_error='')
+
+    jobs.exclude(status=EmbeddingJob.STATUS_RUNNING).update(
+        status=EmbeddingJob.STATUS_PENDING,
+        next_attempt_at=now
+    )
+
+
+def enqueue_embeddings(object_type, object_ids):
+    """enqueue_embedding for many objects of one type, a few statements per chunk of ids"""
+    for ids in chunked(object_ids):
+        now = timezone.now()
+        jobs = EmbeddingJob.objects.filter(object_type=object_type, object_id__in=ids)
+        jobs.update(requested_at=now, attempts=0, last_error='')
+        jobs.exclude(status=EmbeddingJob.STATUS_RUNNING).update(
+            status=EmbeddingJob.STATUS_PENDING,
+            next_attempt_at=now
+        )
+        existing = set(jobs.values_list('object_id', flat=True))
+        EmbeddingJob.objects.bulk_create(
+            [
+                EmbeddingJob(object_type=object_type, object_id=object_id, requested_at=now, next_attempt_at=now)
+                for object_id in ids if object_id not in existing
+            ],
+            ignore_conflicts=True
+        )
+
+
+def enqueue_note_embedding(note_id):
+    enqueue_embedding(EmbeddingJob.OBJECT_NOTE, note_id)
+
+
+def enqueue_entity_embedding(entity_id):
+    enqueue_embedding(EmbeddingJob.OBJECT_ENTITY, entity_id)
+
+
+def note_embedding_chunks(note):
+    """The pieces of text a note is embedded as (a single piece unless it is long)"""
+    # Combine title and content for better semantic representation
+    text_to_embed = f"{note.title}\n\n{note.content}"
+    return chunk_text(text_to_embed, max_tokens=NOTE_CHUNK_THRESHOLD)
+
+
+def note_embedding_is_current(note):
+    """True if every stored chunk of the note matches its current text and model"""
+    stored = list(NoteEmbedding.objects.filter(note=note).order_by('section_index').values_list(
+        'section_index', 'content_hash', 'model_name'
+    ))
+    model_name = current_model()
+    expected = [
+        (i, text_hash(chunk), model_name)
+        for i, chunk in enumerate(note_embedding_chunks(note))
+    ]
+    return stored == expected
+
+
+def embed_note(note):
+    """
+    Bring the stored embeddings of a note up to date with its text.
+    Chunks whose text and model are unchanged keep their rows, chunks that
+    only moved reuse their old vector, and only new text is sent to the API.
+    Returns the number of chunks that were embedded.
+    """
+    chunks = note_embedding_chunks(note)
+    stored = list(NoteEmbedding.objects.filter(note=note))
+    by_index = {row.section_index: row for row in stored}
+    by_hash = {
+        row.content_hash: row for row in stored
+        if row.content_hash and row.model_name == current_model()
+    }
+
+    keep_ids = set()
+    pending = []  # (section_index, chunk, vector or None)
+    for i, chunk in enumerate(chunks):
+        row = by_index.get(i)
+        if row is not None and row.is_current(chunk):
+            keep_ids.add(row.id)
+            continue
+        reused = by_hash.get(text_hash(chunk))
+        pending.append((i, chunk, reused.vector if reused is not None else None))
+
+    to_embed = [chunk for _, chunk, vector in pending if vector is None]
+    if len(chunks) > 1:
+        logger.info(f"Note {note.id}: {len(chunks)} chunks, {len(to_embed)} changed")
+    new_vectors = iter(generate_embeddings_batch(to_embed))
+
+    # Swap the embeddings in one transaction so readers never see a half-written set
+    with _write_lock(), transaction.atomic():
+        NoteEmbedding.objects.filter(note=note).exclude(id__in=keep_ids).delete()
+        for i, chunk, vector in pending:
+            note_embedding = NoteEmbedding(
+                note=note,
+                section_index=i,
+                section_text=chunk[:1000] if len(chunk) > 1000 else chunk
+            )
+            note_embedding.set_vector(next(new_vectors) if vector is None else vector, text=chunk)
+            note_embedding.save()
+
+    return len(to_embed)
+
+
+def entity_embedding_text(entity):
+    """Text used to embed an entity: name, type, details and tags"""
+    text_to_embed = f"{entity.name} - {entity.get_type_display()}"
+
+    if entity.details:
+        text_to_embed += f"\n\n{entity.details}"
+
+    tag_names = [tag.name for tag in entity.tags.all()]
+    if tag_names:
+        text_to_embed += f"\n\nTags: {', '.join(tag_names)}"
+
+    return text_to_embed
+
+
+def entity_embedding_is_current(entity):
+    """True if the stored entity embedding matches its current text and model"""
+    entity_embedding = EntityEmbedding.objects.filter(entity=entity).only('content_hash', 'model_name').first()
+    return entity_embedding is not None and entity_embedding.is_current(entity_embedding_text(entity))
+
+
+def embed_entity(entity):
+    """Generate and store the embedding of an entity unless its text is unchanged"""
+    text_to_embed = entity_embedding_text(entity)
+    entity_embedding = EntityEmbedding.objects.filter(entity=entity).first() or EntityEmbedding(entity=entity)
+    if entity_embedding.pk and entity_embedding.is_current(text_to_embed):
+        return 0
+
+    # Bypasses the embedding cache, which is kept for query texts
+    entity_embedding.set_vector(generate_embeddings_batch([text_to_embed])[0], text=text_to_embed)
+    with _write_lock():
+        entity_embedding.save()
+    return 1
+
+
+def _run_job(job):
+    """Embed the object a job points at; returns the number of vectors generated"""
+    if job.object_type == EmbeddingJob.OBJECT_NOTE:
+        note = Note.objects.filter(id=job.object_id).first()
+        return embed_note(note) if note else 0
+    if job.object_type == EmbeddingJob.OBJECT_ENTITY:
+        entity = Entity.objects.filter(id=job.object_id).first()
+        return embed_entity(entity) if entity else 0
+    raise ValueError(f"Unknown embedding job type: {job.object_type}")
+
+
+def retry_delay(attempts):
+    """Exponential backoff before the next attempt, capped at EMBEDDING_JOB_MAX_BACKOFF seconds"""
+    seconds = settings.EMBEDDING_JOB_BACKOFF * (2 ** max(0, attempts - 1))
+    return timedelta(seconds=min(seconds, settings.EMBEDDING_JOB_MAX_BACKOFF))
+
+
+def claim_jobs(limit):
+    """Mark up to `limit` due jobs as running and return them"""
+    now = timezone.now()
+    due = EmbeddingJob.objects.filter(
+        status=EmbeddingJob.STATUS_PENDING,
+        next_attempt_at__lte=now
+    ).order_by('next_attempt_at').values_list('id', flat=True)[:limit]
+
+    claimed = []
+    with _write_lock():
+        for job_id in list(due):
+            # Conditional update, so two workers never claim the same job
+            if EmbeddingJob.objects.filter(id=job_id, status=EmbeddingJob.STATUS_PENDING).update(
+                status=EmbeddingJob.STATUS_RUNNING,
+                started_at=now
+            ):
+                claimed.append(job_id)
+
+    return list(EmbeddingJob.objects.filter(id__in=claimed))
+
+
+def release_stale_jobs(timeout):
+    """Put jobs back in the queue whose worker died mid-run (running longer than `timeout` seconds)"""
+    cutoff = timezone.now() - timedelta(seconds=timeout)
+    with _write_lock():
+        return EmbeddingJob.objects.filter(
+            status=EmbeddingJob.STATUS_RUNNING,
+            started_at__lt=cutoff
+        ).update(status=EmbeddingJob.STATUS_PENDING, next_attempt_at=timezone.now())
+
+
+def process_job(job):
+    """
+    Run one claimed job and record the outcome.
+    Returns True if the job succeeded.
+    """
+    try:
+        start_time = time.time()
+        count = _run_job(job)
+        logger.info(f"Embedded {job.object_type} {job.object_id} ({count} new vectors) in {time.time() - start_time:.2f}s")
+    except Exception as e:
+        attempts = job.attempts + 1
+        if attempts >= settings.EMBEDDING_JOB_MAX_ATTEMPTS:
+            status = EmbeddingJob.STATUS_FAILED
+            logger.error(f"Giving up on embedding {job.object_type} {job.object_id} after {attempts} attempts: {e}")
+        else:
+            status = EmbeddingJob.STATUS_PENDING
+            logger.warning(f"Embedding {job.object_type} {job.object_id} failed (attempt {attempts}): {e}")
+
+        # A re-enqueue while running already reset attempts and requested a fresh run
+        jobs = EmbeddingJob.objects.filter(id=job.id)
+        with _write_lock():
+            if not jobs.filter(requested_at=job.requested_at).update(
+                status=status,
+                attempts=attempts,
+                next_attempt_at=timezone.now() + retry_delay(attempts),
+                last_error=str(e)[:2000]
+            ):
+                jobs.update(status=EmbeddingJob.STATUS_PENDING, next_attempt_at=timezone.now())
+        return False
+
+    # Done, unless the object was saved again while we were embedding it
+    with _write_lock():
+        if not EmbeddingJob.objects.filter(id=job.id, requested_at=job.requested_at).delete()[0]:
+            EmbeddingJob.objects.filter(id=job.id).update(
+                status=EmbeddingJob.STATUS_PENDING,
+                next_attempt_at=timezone.now()
+            )
+    return True
+
+
+def process_job_in_thread(job):
+    """process_job for worker threads, which each hold their own DB connection"""
+    close_old_connections()
+    try:
+        return process_job(job)
+    finally:
+        close_old_connections()
@@ -175,13 +175,17 @@ class RelationshipForm(forms.ModelForm):
 class RelationshipInferenceRuleForm(forms.ModelForm):
     class Meta:
         model = RelationshipInferenceRule
-        fields = ['name', 'description', 'source_relationship_type', 'inferred_relationship_type', 
-                 'is_active', 'auto_update']
+        fields = ['name', 'description', 'pattern', 'source_relationship_type', 'second_relationship_type',
+                 'inferred_relationship_type', 'is_active', 'auto_update', 'max_depth', 'max_inferred']
         widgets = {
             'name': forms.TextInput(attrs={'class': 'form-control'}),
             'description': forms.Textarea(attrs={'rows': 3, 'class': 'form-control'}),
+            'pattern': forms.Select(attrs={'class': 'form-control'}),
             'source_relationship_type': forms.Select(attrs={'class': 'form-control'}),
+            'second_relationship_type': forms.Select(attrs={'class': 'form-control'}),
             'inferred_relationship_type': forms.Select(attrs={'class': 'form-control'}),
+            'max_depth': forms.NumberInput(attrs={'class': 'form-control', 'min': 2}),
+            'max_inferred': forms.NumberInput(attrs={'class': 'form-control', 'min': 1}),
         }
     
     def __init__(self, *args, **kwargs):
@@ -191,6 +195,7 @@ class RelationshipInferenceRuleForm(forms.ModelForm):
         if workspace:
             # Filter relationship types by workspace
             self.fields['source_relationship_type'].queryset = RelationshipType.objects.filter(workspace=workspace)
+            self.fields['second_relationship_type'].queryset = RelationshipType.objects.filter(workspace=workspace)
             self.fields['inferred_relationship_type'].queryset = RelationshipType.objects.filter(workspace=workspace)
             
         # Add a help text for the inferred relationship type field
@@ -198,6 +203,30 @@ class RelationshipInferenceRuleForm(forms.ModelForm):
             "For best results with relationships like 'Teammate' or 'Housemate', create a "
             "non-directional relationship type to represent mutual connections."
         )
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        pattern = cleaned_data.get('pattern')
+        source_type = cleaned_data.get('source_relationship_type')
+        second_type = cleaned_data.get('second_relationship_type')
+        inferred_type = cleaned_data.get('inferred_relationship_type')
+        
+        if pattern == RelationshipInferenceRule.PATTERN_COMPOSITION:
+            if not second_type:
+                self.add_error('second_relationship_type', "Composition rules need a second relationship type.")
+        else:
+            cleaned_data['second_relationship_type'] = None
+        
+        # Inferred relationships feeding back into their own rule would never settle
+        if inferred_type and inferred_type in (source_type, cleaned_data.get('second_relationship_type')):
+            self.add_error('inferred_relationship_type', "The inferred type must differ from the types the rule looks for.")
+        
+        if pattern == RelationshipInferenceRule.PATTERN_TRANSITIVE and (cleaned_data.get('max_depth') or 0) < 2:
+            self.add_error('max_depth', "A chain needs at least two relationships.")
+        if cleaned_data.get('max_inferred') == 0:
+            self.add_error('max_inferred', "Allow at least one inferred relationship.")
+        
+        return cleaned_data
 
 class TagForm(forms.ModelForm):
     """Form for creating and editing Tag objects"""
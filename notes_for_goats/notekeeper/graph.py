@@ -0,0 +1,147 @@
+"""
+Relationship graphs around an entity.
+
+entity_graph() expands breadth first from an entity, one hop per round.
+Each round looks up the relationships of the whole frontier in the
+workspace's cached adjacency (adjacency.py), then fetches the entities it
+reached in one query. Nodes and links are deduplicated by id. The graph is
+cut at max_nodes entities, and a node is marked truncated when it has
+relationships the graph does not show.
+
+A graph only changes when an entity, relationship or relationship type of
+its workspace does. graph_version() fingerprints those, and
+cached_entity_graph() keys its cache on that fingerprint, so cached graphs
+are never stale and need no explicit invalidation. It doubles as the
+endpoint's ETag.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max
+
+from .adjacency import workspace_adjacency
+from .batching import chunked
+from .models import Entity, RelationshipType, Workspace
+
+
+def graph_version(workspace_id):
+    """
+    A fingerprint of the workspace's entities, relationships and
+    relationship types. Any create, save or delete changes it: the
+    relationship version is bumped on every change, and for the others
+    counts catch deletes, the highest id catches a delete plus a create, and
+    the latest updated_at catches edits.
+    """
+    parts = [
+        workspace_id,
+        Workspace.objects.filter(pk=workspace_id).values_list('relationship_version', flat=True).first(),
+    ]
+    for model in (Entity, RelationshipType):
+        stats = model.objects.filter(workspace_id=workspace_id).aggregate(
+            count=Count('id'), last_id=Max('id'), last_update=Max('updated_at')
+        )
+        parts.extend((stats['count'], stats['last_id'], stats['last_update'] and stats['last_update'].isoformat()))
+    return hashlib.md5(repr(parts).encode('utf-8')).hexdigest()
+
+
+def _node(entity_id, name, entity_type, depth, central=False):
+    return {
+        'id': f'e{entity_id}',
+        'name': name,
+        'type': entity_type,
+        'central': central,
+        'depth': depth,
+        'truncated': False,
+    }
+
+
+def entity_graph(entity, depth=1, max_nodes=None, relationship_type_ids=None):
+    """
+    The entities within depth hops of entity and the relationships between
+    them, as {'nodes': [...], 'links': [...], 'truncated': bool}.
+    Only relationships of relationship_type_ids are followed, if given.
+    'truncated' is true when the max_nodes limit left entities out.
+    """
+    max_nodes = max_nodes or settings.GRAPH_NODES
+    adjacency = workspace_adjacency(entity.workspace_id)
+    type_names = dict(RelationshipType.objects.filter(
+        workspace_id=entity.workspace_id
+    ).values_list('id', 'display_name'))
+
+    nodes = {entity.id: _node(entity.id, entity.name, entity.type, 0, central=True)}
+    links = {}
+    truncated = False
+    frontier = [entity.id]
+
+    # Rounds 0 to depth - 1 grow the graph; the last only adds the links
+    # among the outermost nodes and finds out which of them have more
+    for level in range(depth + 1):
+        positions = adjacency.touching(frontier, relationship_type_ids)
+        edges = zip(
+            adjacency.relationship_ids[positions].tolist(),
+            adjacency.sources[positions].tolist(),
+            adjacency.targets[positions].tolist(),
+            adjacency.type_ids[positions].tolist(),
+        )
+
+        reached = []
+        for edge_id, source_id, target_id, type_id in edges:
+            if edge_id in links:
+                continue
+            missing = [entity_id for entity_id in (source_id, target_id) if entity_id not in nodes]
+            if missing:
+                if level == depth or len(nodes) >= max_nodes:
+                    truncated = truncated or level < depth
+                    for entity_id in (source_id, target_id):
+                        if entity_id in nodes:
+                            nodes[entity_id]['truncated'] = True
+                    continue
+                # At most one end is new: the other is on the frontier
+                nodes[missing[0]] = _node(missing[0], '', '', level + 1)
+                reached.append(missing[0])
+            links[edge_id] = {
+                'id': edge_id,
+                'source': f'e{source_id}',
+                'target': f'e{target_id}',
+                'type': type_names.get(type_id, ''),
+            }
+
+        # Fill in the entities reached; relationships can outlive their entities
+        found = set()
+        for chunk in chunked(reached):
+            for entity_id, name, entity_type in Entity.objects.filter(
+                workspace_id=entity.workspace_id, id__in=chunk
+            ).values_list('id', 'name', 'type'):
+                nodes[entity_id].update(name=name, type=entity_type)
+                found.add(entity_id)
+        gone = {f'e{entity_id}' for entity_id in reached if entity_id not in found}
+        if gone:
+            for entity_id in set(reached) - found:
+                del nodes[entity_id]
+            links = {
+                edge_id: link for edge_id, link in links.items()
+                if link['source'] not in gone and link['target'] not in gone
+            }
+
+        frontier = sorted(found)
+        if not frontier:
+            break
+
+    return {
+        'nodes': list(nodes.values()),
+        'links': list(links.values()),
+        'truncated': truncated,
+    }
+
+
+def cached_entity_graph(entity, version, depth=1, max_nodes=None, relationship_type_ids=None):
+    """entity_graph through the cache, for a graph_version() of the entity's workspace"""
+    max_nodes = max_nodes or settings.GRAPH_NODES
+    type_key = ','.join(str(type_id) for type_id in sorted(relationship_type_ids or ()))
+    key = f'notekeeper:graph:{entity.id}:{depth}:{max_nodes}:{type_key}:{version}'
+    graph = cache.get(key)
+    if graph is None:
+        graph = entity_graph(entity, depth, max_nodes, relationship_type_ids)
+        cache.set(key, graph, settings.GRAPH_CACHE_TIMEOUT)
+    return graph
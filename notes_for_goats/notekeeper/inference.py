@@ -1,298 +1,612 @@
+"""
+Relationship inference.
+
+A RelationshipInferenceRule gives entities a relationship of its inferred
+type when a pattern of relationships connects them:
+
+- shared target: both have a relationship of the source type with the same
+  common entity (Alice and Bob are both members of Team Alpha)
+- transitive: a chain of two to max_depth relationships of the source type
+  leads from one to the other (Alice reports to Bob, who reports to Carol)
+- composition: a relationship of the source type, then one of the second
+  type from the entity it reaches (Alice is a member of Team Alpha, which
+  owns Project X)
+- inverse: the other has a relationship of the source type with the first
+
+An inferred relationship never replaces a relationship created by hand.
+Shared-target pairs, and any pair of a non-directional inferred type, point
+from the lower entity id to the higher one. Its RelationshipProvenance rows
+record the rules that inferred it and the source relationships supporting
+it; they are what marks it as inferred (the "Auto-inferred:" details are
+for people). A chain keeps the relationships of one path supporting it.
+
+A rule is applied in memory. The workspace's relationships of the types it
+uses are loaded once into adjacency maps and the inferred pairs are
+computed from them; chains are followed by semi-naive iteration, extending
+only the paths found in the previous round. The result is then diffed
+against the rule's own outputs and written with bulk writes. A rule stops
+once it has inferred max_inferred relationships.
+
+Changing a relationship does not re-run shared-target rules. A new
+relationship can only add pairs through its common entity
+(relationship_added). A deleted one can only break the inferred
+relationships whose provenance names it (relationship_removed), which are
+found through the provenance index. Either way the cost follows the size of
+that neighbourhood. Since one relationship can lengthen or cut any number of
+chains, the other patterns are re-run in full, in memory, when a
+relationship they use is added or one they depend on is removed.
+"""
+import logging
+
+from collections import defaultdict, namedtuple
+from itertools import combinations
+
 from django.contrib.contenttypes.models import ContentType
 from django.db import transaction
 from django.db.models import Q
+from django.utils import timezone
+
+from .adjacency import bump_relationship_version
+from .batching import chunked
+from .models import Relationship, RelationshipInferenceRule, RelationshipProvenance, Entity
+
+logger = logging.getLogger(__name__)
+
+AUTO_INFERRED_PREFIX = 'Auto-inferred:'
+
+# Loaded along with each rule
+RULE_RELATED = ('workspace', 'source_relationship_type', 'second_relationship_type', 'inferred_relationship_type')
+
+# Counts of relationships written by applying rules, and of the rules that
+# stopped at their max_inferred cap
+InferenceResult = namedtuple('InferenceResult', ['created', 'updated', 'deleted', 'capped'])
+
+NO_CHANGES = InferenceResult(0, 0, 0, 0)
+
+
+def _combine(results):
+    total = NO_CHANGES
+    for result in results:
+        total = InferenceResult(*(a + b for a, b in zip(total, result)))
+    return total
 
-from .models import Relationship, RelationshipInferenceRule, Entity
+
+def _uses_type(relationship_type):
+    """Rules matching relationships of relationship_type"""
+    return Q(source_relationship_type=relationship_type) | Q(second_relationship_type=relationship_type)
+
+
+def _is_shared_target(rule):
+    return rule.pattern == RelationshipInferenceRule.PATTERN_SHARED_TARGET
+
+
+def _is_directed(rule):
+    """Whether the rule's pairs keep their direction (else they run from the lower entity id)"""
+    return not _is_shared_target(rule) and rule.inferred_relationship_type.is_directional
 
 
 def apply_inference_rules(workspace, entity=None, relationship_type=None):
-    """Apply all active inference rules for a given entity after a relationship change."""
+    """
+    Apply the active inference rules of a workspace, optionally only those
+    using relationship_type and only the pairs involving
+    entity. Returns an InferenceResult.
+    """
     # Get all active rules that apply to this relationship type
     rules = RelationshipInferenceRule.objects.filter(
         workspace=workspace,
         is_active=True
-    )
-    
+    ).select_related(*RULE_RELATED)
+
     if relationship_type:
-        rules = rules.filter(source_relationship_type=relationship_type)
-    
-    # If no rules match, return early
-    if not rules.exists():
-        return
-    
-    # Apply each matching rule
-    for rule in rules:
-        _apply_rule(rule, entity)
+        rules = rules.filter(_uses_type(relationship_type))
 
+    return _combine(apply_rule(rule, entity) for rule in rules)
 
-def _apply_rule(rule, specific_entity=None):
-    """Apply a single inference rule, optionally for a specific entity only."""
-    workspace = rule.workspace
+
+def apply_rule(rule, entity=None):
+    """
+    Apply one rule to the whole workspace, or (for shared-target rules)
+    only to the pairs involving entity. A whole-workspace run also removes
+    this rule's inferred relationships that are no longer supported.
+    Returns an InferenceResult.
+    """
     entity_content_type = ContentType.objects.get_for_model(Entity)
-    
-    # If we have a specific entity, only process that one
-    if specific_entity:
-        entities_to_process = [specific_entity]
+    capped = False
+    if not _is_shared_target(rule):
+        pairs, capped = _chain_pairs(rule, entity_content_type)
+        entity_ids = None
+    elif entity is None:
+        members = _members_by_common(rule, entity_content_type)
+        pairs, capped = _cap(infer_pairs(members), rule.max_inferred)
+        entity_ids = None
     else:
-        entities_to_process = Entity.objects.filter(workspace=workspace)
-    
-    # Set to track processed entity pairs to avoid duplication
-    processed_pairs = set()
-    
-    # Get the source relationship type
-    relationship_type = rule.source_relationship_type
-    is_directional = relationship_type.is_directional
-    
+        commons = _commons_by_member(rule, entity_content_type, [entity.id])
+        members = _members_by_common(rule, entity_content_type, commons.get(entity.id, {}))
+        pairs = infer_pairs(members, entity.id)
+        entity_ids = [entity.id]
+    if capped:
+        logger.warning(f"Inference rule '{rule.name}' stopped at its limit of {rule.max_inferred} relationships")
     with transaction.atomic():
-        for entity in entities_to_process:
-            # Find common entities that this entity is related to
-            common_entity_ids = set()
-            
-            if is_directional:
-                # For directional relationships (like Reports To), only consider one direction
-                # Example: For "Reports To" - find managers this person reports to
-                outgoing_relations = Relationship.objects.filter(
-                    workspace=workspace,
-                    relationship_type=relationship_type,
-                    source_content_type=entity_content_type,
-                    source_object_id=entity.id,
-                    target_content_type=entity_content_type
-                ).values_list('target_object_id', flat=True)
-                common_entity_ids.update(outgoing_relations)
-            else:
-                # For non-directional relationships, check both directions
-                # Case 1: Entity -> Common Entity
-                outgoing_relations = Relationship.objects.filter(
-                    workspace=workspace,
-                    relationship_type=relationship_type,
-                    source_content_type=entity_content_type,
-                    source_object_id=entity.id,
-                    target_content_type=entity_content_type
-                ).values_list('target_object_id', flat=True)
-                common_entity_ids.update(outgoing_relations)
-                
-                # Case 2: Common Entity -> Entity
-                incoming_relations = Relationship.objects.filter(
-                    workspace=workspace,
-                    relationship_type=relationship_type,
-                    source_content_type=entity_content_type,
-                    target_content_type=entity_content_type,
-                    target_object_id=entity.id
-                ).values_list('source_object_id', flat=True)
-                common_entity_ids.update(incoming_relations)
-            
-            # Process each common entity
-            for common_entity_id in common_entity_ids:
-                try:
-                    common_entity = Entity.objects.get(id=common_entity_id, workspace=workspace)
-                except Entity.DoesNotExist:
-                    continue
-                
-                # Find all entities related to this common entity
-                related_entity_ids = set()
-                
-                if is_directional:
-                    # For directional relationships, only match entities with the same direction
-                    # For example, find others who also report to the same manager
-                    related_outgoing = Relationship.objects.filter(
-                        workspace=workspace,
-                        relationship_type=relationship_type,
-                        source_content_type=entity_content_type,
-                        target_content_type=entity_content_type,
-                        target_object_id=common_entity_id
-                    ).values_list('source_object_id', flat=True)
-                    related_entity_ids.update(related_outgoing)
-                else:
-                    # For non-directional relationships, check both directions
-                    # Others with outgoing relationship to common entity
-                    related_outgoing = Relationship.objects.filter(
-                        workspace=workspace,
-                        relationship_type=relationship_type,
-                        source_content_type=entity_content_type,
-                        target_content_type=entity_content_type,
-                        target_object_id=common_entity_id
-                    ).values_list('source_object_id', flat=True)
-                    related_entity_ids.update(related_outgoing)
-                    
-                    # Others with incoming relationship from common entity
-                    related_incoming = Relationship.objects.filter(
-                        workspace=workspace,
-                        relationship_type=relationship_type,
-                        source_content_type=entity_content_type,
-                        source_object_id=common_entity_id,
-                        target_content_type=entity_content_type
-                    ).values_list('target_object_id', flat=True)
-                    related_entity_ids.update(related_incoming)
-                
-                # Remove the current entity from the related set
-                if entity.id in related_entity_ids:
-                    related_entity_ids.remove(entity.id)
-                
-                # Create relationships with related entities
-                for related_id in related_entity_ids:
-                    # Skip if it's the same entity
-                    if related_id == entity.id:
-                        continue
-                    
-                    # Get the related entity
-                    try:
-                        related_entity = Entity.objects.get(id=related_id, workspace=workspace)
-                    except Entity.DoesNotExist:
-                        continue
-                    
-                    # Create a unique pair identifier (using sorted IDs)
-                    pair_key = tuple(sorted([entity.id, related_id]))
-                    
-                    # Skip if we've already processed this pair
-                    if pair_key in processed_pairs:
-                        continue
-                    
-                    processed_pairs.add(pair_key)
-                    
-                    # Determine source and target (always use lower ID as source)
-                    if entity.id < related_id:
-                        source_entity, target_entity = entity, related_entity
-                    else:
-                        source_entity, target_entity = related_entity, entity
-                    
-                    # Create the relationship
-                    _create_inferred_relationship(
-                        workspace=workspace,
-                        rule=rule,
-                        source_entity=source_entity,
-                        target_entity=target_entity,
-                        common_entity=common_entity
-                    )
-
-
-def _create_inferred_relationship(workspace, rule, source_entity, target_entity, common_entity):
-    """Create a single inferred relationship if it doesn't already exist."""
-    entity_content_type = ContentType.objects.get_for_model(Entity)
-    
-    # Check for existing relationship in either direction
-    existing_forward = Relationship.objects.filter(
-        workspace=workspace,
-        relationship_type=rule.inferred_relationship_type,
-        source_content_type=entity_content_type,
-        source_object_id=source_entity.id,
-        target_content_type=entity_content_type,
-        target_object_id=target_entity.id
-    ).first()
-    
-    existing_reverse = Relationship.objects.filter(
-        workspace=workspace,
-        relationship_type=rule.inferred_relationship_type,
+        result = _write_inferred(rule, pairs, entity_content_type, entity_ids=entity_ids, prune=entity_ids is None)
+    return result._replace(capped=max(result.capped, int(capped)))
+
+
+def _cap(pairs, limit):
+    """The first limit pairs (by entity ids), and whether any were left out"""
+    if len(pairs) <= limit:
+        return pairs, False
+    return {pair: pairs[pair] for pair in sorted(pairs)[:limit]}, True
+
+
+def _source_edges(rule, entity_content_type, relationship_type=None):
+    return Relationship.objects.filter(
+        workspace=rule.workspace,
+        relationship_type=relationship_type or rule.source_relationship_type,
         source_content_type=entity_content_type,
-        source_object_id=target_entity.id,
-        target_content_type=entity_content_type,
-        target_object_id=source_entity.id
-    ).first()
-    
-    # If a manually created relationship exists in either direction, don't change it
-    if (existing_forward and not existing_forward.details.startswith('Auto-inferred')) or \
-       (existing_reverse and not existing_reverse.details.startswith('Auto-inferred')):
-        return None
-    
-    # If an auto-inferred relationship exists in the reverse direction, delete it
-    if existing_reverse and existing_reverse.details.startswith('Auto-inferred'):
-        existing_reverse.delete()
-    
-    # Create or update the relationship
-    details = (f"Auto-inferred: Both entities share a '{rule.source_relationship_type.display_name}' "
-             f"relationship with '{common_entity.name}' (Rule: {rule.name})")
-    
-    relationship, created = Relationship.objects.update_or_create(
+        target_content_type=entity_content_type
+    )
+
+
+def _existing_entity_ids(workspace, ids=None):
+    """The ids (of those given, or all) of the workspace's entities; relationships may outlive their entities"""
+    entities = Entity.objects.filter(workspace=workspace)
+    if ids is None:
+        return set(entities.values_list('id', flat=True))
+    existing = set()
+    for chunk in chunked(ids):
+        existing.update(entities.filter(id__in=chunk).values_list('id', flat=True))
+    return existing
+
+
+def _load_edges(rule, entity_content_type, ids, column):
+    """(id, source id, target id) of the source-type edges with column in ids, or all edges if ids is None"""
+    edges = _source_edges(rule, entity_content_type).values_list('id', 'source_object_id', 'target_object_id')
+    if ids is None:
+        return list(edges.iterator())
+    rows = []
+    for chunk in chunked(ids):
+        rows.extend(edges.filter(**{f'{column}__in': chunk}))
+    return rows
+
+
+def _edges_touching(rule, entity_content_type, ids, directional_column):
+    """
+    Source-type edges whose directional_column is one of ids, and for a
+    non-directional type also those whose other end is; every edge if ids is None
+    """
+    edges = _load_edges(rule, entity_content_type, ids, directional_column)
+    if ids is not None and not rule.source_relationship_type.is_directional:
+        other = 'source_object_id' if directional_column == 'target_object_id' else 'target_object_id'
+        edges = set(edges) | set(_load_edges(rule, entity_content_type, ids, other))
+    existing = _existing_entity_ids(
+        rule.workspace, None if ids is None else {entity_id for edge in edges for entity_id in edge[1:]}
+    )
+    return [edge for edge in edges if edge[1] in existing and edge[2] in existing]
+
+
+def _members_by_common(rule, entity_content_type, common_ids=None):
+    """
+    Map each common entity (of common_ids, or all) to its members: the
+    entities with a source-type relationship with it (pointing at it, for a
+    directional type), each with the ids of those relationships
+    """
+    common_ids = None if common_ids is None else set(common_ids)
+    is_directional = rule.source_relationship_type.is_directional
+    members = defaultdict(lambda: defaultdict(list))
+    for edge_id, source_id, target_id in _edges_touching(rule, entity_content_type, common_ids, 'target_object_id'):
+        if common_ids is None or target_id in common_ids:
+            members[target_id][source_id].append(edge_id)
+        if not is_directional and (common_ids is None or source_id in common_ids):
+            members[source_id][target_id].append(edge_id)
+    return members
+
+
+def _commons_by_member(rule, entity_content_type, member_ids):
+    """The inverse of _members_by_common, for the given members only"""
+    member_ids = set(member_ids)
+    is_directional = rule.source_relationship_type.is_directional
+    commons = defaultdict(lambda: defaultdict(list))
+    for edge_id, source_id, target_id in _edges_touching(rule, entity_content_type, member_ids, 'source_object_id'):
+        if source_id in member_ids:
+            commons[source_id][target_id].append(edge_id)
+        if not is_directional and target_id in member_ids:
+            commons[target_id][source_id].append(edge_id)
+    return commons
+
+
+def _add_support(pairs, pair, common_id, edge_ids):
+    if pair not in pairs:
+        pairs[pair] = (common_id, set())
+    pairs[pair][1].update(edge_ids)
+
+
+def infer_pairs(members, entity_id=None):
+    """
+    The inferred (lower id, higher id) pairs, each mapped to the id of the
+    lowest common entity supporting it and the ids of all the source
+    relationships supporting it. With entity_id, only the pairs involving
+    that entity.
+    """
+    pairs = {}
+    for common_id in sorted(members):
+        group = members[common_id]
+        if entity_id is None:
+            candidates = combinations(sorted(group), 2)
+        elif entity_id in group:
+            candidates = (tuple(sorted((entity_id, other))) for other in group if other != entity_id)
+        else:
+            continue
+        for first_id, second_id in candidates:
+            _add_support(pairs, (first_id, second_id), common_id, group[first_id] + group[second_id])
+    return pairs
+
+
+def _supported_pairs(commons, candidates):
+    """infer_pairs for just the candidate pairs, from the commons of their entities"""
+    pairs = {}
+    for first_id, second_id in candidates:
+        shared = set(commons.get(first_id, ())) & set(commons.get(second_id, ()))
+        for common_id in sorted(shared):
+            edge_ids = commons[first_id][common_id] + commons[second_id][common_id]
+            _add_support(pairs, (first_id, second_id), common_id, edge_ids)
+    return pairs
+
+
+def _adjacency(rule, entity_content_type, relationship_type):
+    """
+    Map each entity to the (next entity, relationship id) steps that
+    relationships of relationship_type lead to from it, in both directions
+    for a non-directional type
+    """
+    both_ways = not relationship_type.is_directional
+    edges = list(_source_edges(rule, entity_content_type, relationship_type).values_list(
+        'id', 'source_object_id', 'target_object_id'
+    ).iterator())
+    existing = _existing_entity_ids(rule.workspace)
+    steps = defaultdict(list)
+    for edge_id, source_id, target_id in sorted(edges):
+        if source_id not in existing or target_id not in existing:
+            continue
+        steps[source_id].append((target_id, edge_id))
+        if both_ways:
+            steps[target_id].append((source_id, edge_id))
+    return steps
+
+
+def transitive_pairs(steps, max_depth, limit):
+    """
+    The (start, end) pairs joined by a chain of two to max_depth steps,
+    found by semi-naive iteration: each round extends only the paths that
+    reached a new entity in the round before, by one step. Stops after
+    limit pairs. Returns ({pair: (entity before end, relationship ids of
+    the path)}, whether the limit was hit).
+    """
+    # (start, end) -> (entity before end, relationship id of the last step);
+    # one-step pairs are only recorded, they already have their relationship
+    previous = {}
+    frontier = {}
+    for start in sorted(steps):
+        for end, edge_id in steps[start]:
+            if end != start and (start, end) not in previous:
+                previous[(start, end)] = (None, edge_id)
+                frontier.setdefault(start, []).append(end)
+
+    found = []
+    for _ in range(max_depth - 1):
+        next_frontier = {}
+        for start in sorted(frontier):
+            for middle in frontier[start]:
+                for end, edge_id in steps.get(middle, ()):
+                    if end == start or (start, end) in previous:
+                        continue
+                    previous[(start, end)] = (middle, edge_id)
+                    next_frontier.setdefault(start, []).append(end)
+                    found.append((start, end))
+                    if len(found) >= limit:
+                        return _chain_paths(found, previous), True
+        if not next_frontier:
+            break
+        frontier = next_frontier
+    return _chain_paths(found, previous), False
+
+
+def _chain_paths(found, previous):
+    paths = {}
+    for start, end in found:
+        edge_ids = set()
+        step = end
+        while step is not None:
+            middle, edge_id = previous[(start, step)]
+            edge_ids.add(edge_id)
+            step = middle
+        paths[(start, end)] = (previous[(start, end)][0], edge_ids)
+    return paths
+
+
+def composed_pairs(first_steps, second_steps, limit):
+    """
+    The (start, end) pairs joined by a step of first_steps then one of
+    second_steps. Stops after limit pairs. Returns ({pair: (the first middle
+    entity found, relationship ids of every such path)}, whether the limit
+    was hit).
+    """
+    pairs = {}
+    for start in sorted(first_steps):
+        for middle, first_id in first_steps[start]:
+            for end, second_id in second_steps.get(middle, ()):
+                if end == start:
+                    continue
+                if (start, end) not in pairs:
+                    if len(pairs) >= limit:
+                        return pairs, True
+                    pairs[(start, end)] = (middle, set())
+                pairs[(start, end)][1].update((first_id, second_id))
+    return pairs, False
+
+
+def _chain_pairs(rule, entity_content_type):
+    """The pairs a transitive, composition or inverse rule infers, and whether it hit its cap"""
+    steps = _adjacency(rule, entity_content_type, rule.source_relationship_type)
+    if rule.pattern == RelationshipInferenceRule.PATTERN_TRANSITIVE:
+        found, capped = transitive_pairs(steps, rule.max_depth, rule.max_inferred)
+    elif rule.pattern == RelationshipInferenceRule.PATTERN_COMPOSITION:
+        if rule.second_relationship_type is None:
+            return {}, False
+        second_steps = _adjacency(rule, entity_content_type, rule.second_relationship_type)
+        found, capped = composed_pairs(steps, second_steps, rule.max_inferred)
+    else:
+        found = {}
+        for start in sorted(steps):
+            for end, edge_id in steps[start]:
+                found.setdefault((end, start), (None, set()))[1].add(edge_id)
+        found, capped = _cap(found, rule.max_inferred)
+
+    if _is_directed(rule):
+        return found, capped
+    # Pairs of a non-directional type run from the lower id; the two
+    # directions of a pair share one relationship
+    pairs = {}
+    for (start, end), (via_id, edge_ids) in found.items():
+        pair = (min(start, end), max(start, end))
+        first_via_id, known_ids = pairs.get(pair, (via_id, set()))
+        pairs[pair] = (first_via_id, known_ids | edge_ids)
+    return pairs, capped
+
+
+def inferred_details(rule, via_name):
+    source = rule.source_relationship_type.display_name
+    if rule.pattern == RelationshipInferenceRule.PATTERN_TRANSITIVE:
+        reason = f"Linked by a chain of '{source}' relationships through '{via_name}'"
+    elif rule.pattern == RelationshipInferenceRule.PATTERN_COMPOSITION:
+        second = rule.second_relationship_type.display_name if rule.second_relationship_type else ''
+        reason = f"Linked by '{source}' then '{second}' through '{via_name}'"
+    elif rule.pattern == RelationshipInferenceRule.PATTERN_INVERSE:
+        reason = f"Inverse of a '{source}' relationship"
+    else:
+        reason = f"Both entities share a '{source}' relationship with '{via_name}'"
+    return f"{AUTO_INFERRED_PREFIX} {reason} (Rule: {rule.name})"
+
+
+def _write_inferred(rule, pairs, entity_content_type, entity_ids=None, prune=False, candidates=()):
+    """
+    Bring the inferred relationships of a rule, and their provenance, in line
+    with pairs ({(source id, target id): (id of the entity named in the
+    details or None, ids of the supporting relationships)}) using bulk writes.
+    Only relationships touching entity_ids (all, if None) are looked at.
+    Of this rule's inferred relationships not in pairs, prune removes all
+    of them and candidates names the pairs that may be removed. Without
+    prune, no more are created than the rule's max_inferred allows.
+    """
+    workspace = rule.workspace
+    directed = _is_directed(rule)
+    existing = Relationship.objects.filter(
         workspace=workspace,
         relationship_type=rule.inferred_relationship_type,
         source_content_type=entity_content_type,
-        source_object_id=source_entity.id,
-        target_content_type=entity_content_type,
-        target_object_id=target_entity.id,
-        defaults={'details': details}
+        target_content_type=entity_content_type
+    ).values_list('id', 'source_object_id', 'target_object_id', 'details')
+    if entity_ids is None:
+        rows = list(existing.iterator())
+    else:
+        rows = []
+        for chunk in chunked(entity_ids):
+            rows.extend(existing.filter(Q(source_object_id__in=chunk) | Q(target_object_id__in=chunk)))
+
+    # relationship id -> rule id -> {source relationship id: provenance id}
+    provenance = defaultdict(dict)
+    for chunk in chunked({row[0] for row in rows}):
+        for provenance_id, relationship_id, rule_id, source_id in RelationshipProvenance.objects.filter(
+            relationship_id__in=chunk
+        ).values_list('id', 'relationship_id', 'rule_id', 'source_relationship_id'):
+            provenance[relationship_id].setdefault(rule_id, {})[source_id] = provenance_id
+
+    # Manual relationships block a pair in either direction unless direction matters
+    pair_key = (lambda source_id, target_id: (source_id, target_id)) if directed else (
+        lambda source_id, target_id: frozenset((source_id, target_id))
     )
-    
-    return relationship
+    manual = set()
+    inferred = {}  # (source id, target id) -> (relationship id, details)
+    for relationship_id, source_id, target_id, details in rows:
+        if relationship_id in provenance:
+            inferred[(source_id, target_id)] = (relationship_id, details)
+        else:
+            manual.add(pair_key(source_id, target_id))
+
+    names = {}
+    for via_ids in chunked({via_id for via_id, _ in pairs.values() if via_id is not None}):
+        names.update(Entity.objects.filter(id__in=via_ids).values_list('id', 'name'))
+
+    now = timezone.now()
+    to_create, to_update, to_delete = [], [], set()
+    new_provenance, stale_provenance = [], set()
+    kept = set()
+    for (source_id, target_id), (via_id, supporting) in pairs.items():
+        # A relationship created by hand is never changed
+        if pair_key(source_id, target_id) in manual:
+            continue
+        kept.add((source_id, target_id))
+
+        # An inferred relationship in the other direction is replaced
+        reverse = None if directed else inferred.get((target_id, source_id))
+        if reverse is not None:
+            to_delete.add(reverse[0])
+
+        details = inferred_details(rule, names.get(via_id, ''))
+        current = inferred.get((source_id, target_id))
+        if current is None:
+            to_create.append((Relationship(
+                workspace=workspace,
+                relationship_type=rule.inferred_relationship_type,
+                source_content_type=entity_content_type,
+                source_object_id=source_id,
+                target_content_type=entity_content_type,
+                target_object_id=target_id,
+                details=details
+            ), supporting))
+            continue
+
+        relationship_id, current_details = current
+        if current_details != details:
+            to_update.append(Relationship(id=relationship_id, details=details, updated_at=now))
+        recorded = provenance[relationship_id].get(rule.id, {})
+        new_provenance.extend(
+            RelationshipProvenance(relationship_id=relationship_id, rule=rule, source_relationship_id=edge_id)
+            for edge_id in supporting - set(recorded)
+        )
+        stale_provenance.update(
+            provenance_id for edge_id, provenance_id in recorded.items() if edge_id not in supporting
+        )
 
+    # This rule's inferred relationships that nothing supports any more lose
+    # its provenance, and are deleted if no other rule infers them
+    removable = set(inferred) if prune else {
+        key for source_id, target_id in candidates for key in ((source_id, target_id), (target_id, source_id))
+    }
+    for key, (relationship_id, _) in inferred.items():
+        if key in kept or key not in removable or rule.id not in provenance[relationship_id]:
+            continue
+        if len(provenance[relationship_id]) == 1:
+            to_delete.add(relationship_id)
+        else:
+            stale_provenance.update(provenance[relationship_id][rule.id].values())
 
-def handle_relationship_deleted(workspace, relationship):
-    """When a relationship is deleted, update any inferred relationships that depend on it."""
-    # Find rules that use this relationship type as a source
+    capped = False
+    if not prune and to_create:
+        room = max(0, rule.max_inferred - rule.provenance.values('relationship').distinct().count())
+        capped = len(to_create) > room
+        to_create = to_create[:room]
+
+    # bulk_create sets the new primary keys (SQLite 3.35+, PostgreSQL)
+    Relationship.objects.bulk_create([relationship for relationship, _ in to_create], batch_size=500)
+    if to_create:
+        # bulk_create sends no post_save signals
+        bump_relationship_version([rule.workspace_id])
+    new_provenance.extend(
+        RelationshipProvenance(relationship_id=relationship.pk, rule=rule, source_relationship_id=edge_id)
+        for relationship, supporting in to_create for edge_id in supporting
+    )
+    Relationship.objects.bulk_update(to_update, ['details', 'updated_at'], batch_size=500)
+    for provenance_ids in chunked(stale_provenance):
+        RelationshipProvenance.objects.filter(id__in=provenance_ids).delete()
+    RelationshipProvenance.objects.bulk_create(new_provenance, batch_size=500, ignore_conflicts=True)
+    for relationship_ids in chunked(to_delete):
+        Relationship.objects.filter(id__in=relationship_ids).delete()
+    return InferenceResult(len(to_create), len(to_update), len(to_delete), int(capped))
+
+
+def _memberships(rule, relationship, entity_content_type):
+    """The (common entity id, member id) pairs a source-type relationship contributes"""
+    if relationship.source_content_type != entity_content_type or relationship.target_content_type != entity_content_type:
+        return set()
+    source_id, target_id = relationship.source_object_id, relationship.target_object_id
+    memberships = {(target_id, source_id)}
+    if not rule.source_relationship_type.is_directional:
+        memberships.add((source_id, target_id))
+    return memberships
+
+
+def _recompute(rule, candidates, entity_content_type):
+    """Re-derive the support of the candidate pairs from the current edges and write the result"""
+    commons = _commons_by_member(
+        rule, entity_content_type, {entity_id for pair in candidates for entity_id in pair}
+    ) if candidates else {}
+    pairs = _supported_pairs(commons, sorted(candidates))
+    # Every candidate (and its reverse) touches its lower entity id
+    entity_ids = {first_id for first_id, _ in candidates}
+    with transaction.atomic():
+        return _write_inferred(rule, pairs, entity_content_type, entity_ids=entity_ids, candidates=candidates)
+
+
+def relationship_added(relationship):
+    """
+    Update inferred relationships after a relationship is created (or moved
+    by an edit). It makes its source a member of its target's group (and
+    the other way round when non-directional), so only pairs of that member
+    with the group's other members can gain support. Rules of the other
+    patterns using its type are re-run. Returns an InferenceResult.
+    """
     rules = RelationshipInferenceRule.objects.filter(
-        workspace=workspace,
-        source_relationship_type=relationship.relationship_type,
+        _uses_type(relationship.relationship_type),
+        workspace=relationship.workspace,
+        is_active=True
+    ).select_related(*RULE_RELATED)
+    entity_content_type = ContentType.objects.get_for_model(Entity)
+
+    results = []
+    for rule in rules:
+        if not _is_shared_target(rule):
+            results.append(apply_rule(rule))
+            continue
+        memberships = _memberships(rule, relationship, entity_content_type)
+        if not memberships:
+            continue
+        members = _members_by_common(rule, entity_content_type, {common_id for common_id, _ in memberships})
+        candidates = {
+            tuple(sorted((member_id, other_id)))
+            for common_id, member_id in memberships
+            for other_id in members.get(common_id, ())
+            if other_id != member_id
+        }
+        results.append(_recompute(rule, candidates, entity_content_type))
+    return _combine(results)
+
+
+def dependent_relationship_ids(relationship):
+    """Ids of the inferred relationships that relationship supports; read this before deleting or moving it"""
+    return set(RelationshipProvenance.objects.filter(
+        source_relationship=relationship
+    ).values_list('relationship_id', flat=True))
+
+
+def relationship_removed(relationship, dependent_ids):
+    """
+    Update inferred relationships after a relationship is deleted or moved.
+    dependent_ids comes from dependent_relationship_ids() before the change;
+    for a shared-target rule each of those stays only while its two entities
+    still share a common entity, and rules of the other patterns with
+    dependents are re-run. Only rules set to auto-update are applied.
+    Returns an InferenceResult.
+    """
+    if not dependent_ids:
+        return NO_CHANGES
+
+    rules = RelationshipInferenceRule.objects.filter(
+        _uses_type(relationship.relationship_type),
+        workspace=relationship.workspace,
         is_active=True,
         auto_update=True
-    )
-    
-    # If no rules match, we can exit early
-    if not rules.exists():
-        return
-    
-    # Get Entity content type
+    ).select_related(*RULE_RELATED)
     entity_content_type = ContentType.objects.get_for_model(Entity)
-    
-    # Find affected entities
-    affected_entities = []
-    
-    # Add source entity if it's an Entity
-    if relationship.source_content_type == entity_content_type:
-        try:
-            entity = Entity.objects.get(id=relationship.source_object_id)
-            affected_entities.append(entity)
-        except Entity.DoesNotExist:
-            pass
-    
-    # Add target entity if it's an Entity
-    if relationship.target_content_type == entity_content_type:
-        try:
-            entity = Entity.objects.get(id=relationship.target_object_id)
-            affected_entities.append(entity)
-        except Entity.DoesNotExist:
-            pass
-    
-    # Process affected entities
-    with transaction.atomic():
-        # First, delete all auto-inferred relationships for affected entities
-        for entity in affected_entities:
-            # Delete relationships where entity is source
-            Relationship.objects.filter(
-                workspace=workspace,
-                source_content_type=entity_content_type,
-                source_object_id=entity.id,
-                details__startswith='Auto-inferred:'
-            ).delete()
-            
-            # Delete relationships where entity is target
-            Relationship.objects.filter(
-                workspace=workspace,
-                target_content_type=entity_content_type,
-                target_object_id=entity.id,
-                details__startswith='Auto-inferred:'
-            ).delete()
-        
-        # Then, reapply all rules for these entities
-        for entity in affected_entities:
-            for rule in rules:
-                _apply_rule(rule, entity)
-                # Find auto-inferred relationships for this entity created by this rule
-                Relationship.objects.filter(
-                    workspace=workspace,
-                    relationship_type=rule.inferred_relationship_type,
-                    source_content_type=entity_content_type,
-                    source_object_id=entity.id,
-                    details__startswith="Auto-inferred:"
-                ).delete()
-                
-                # Also delete relationships where this entity is the target
-                Relationship.objects.filter(
-                    workspace=workspace,
-                    relationship_type=rule.inferred_relationship_type,
-                    target_content_type=entity_content_type,
-                    target_object_id=entity.id,
-                    details__startswith="Auto-inferred:"
-                ).delete()
-        
-        # Reapply inference rules for all affected entities
-        for entity in affected_entities:
-            for rule in rules:
-                _apply_rule(rule, entity)
\ No newline at end of file
+
+    # rule id -> the pairs of the dependents that rule inferred
+    candidates = defaultdict(set)
+    for chunk in chunked(dependent_ids):
+        for rule_id, source_id, target_id in RelationshipProvenance.objects.filter(
+            relationship_id__in=chunk
+        ).values_list('rule_id', 'relationship__source_object_id', 'relationship__target_object_id'):
+            candidates[rule_id].add(tuple(sorted((source_id, target_id))))
+
+    return _combine(
+        _recompute(rule, candidates[rule.id], entity_content_type) if _is_shared_target(rule) else apply_rule(rule)
+        for rule in rules if rule.id in candidates
+    )
@@ -0,0 +1,106 @@
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from notekeeper.models import NoteEmbedding, Workspace
+from notekeeper.vector_index import get_note_index
+
+
+class Command(BaseCommand):
+    help = 'Compare approximate (IVF) and int8-quantized note search against exact search: recall, latency and memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('workspace_id', type=int, help='ID of the workspace to benchmark')
+        parser.add_argument(
+            '--queries',
+            type=int,
+            default=50,
+            help='Number of stored chunks to use as queries. Default is 50.',
+        )
+        parser.add_argument(
+            '--top-k',
+            type=int,
+            default=5,
+            help='Number of notes retrieved per query. Default is 5.',
+        )
+        parser.add_argument(
+            '--nprobe',
+            type=int,
+            nargs='+',
+            default=[1, 4, 16, 64],
+            help='nprobe values to try. Default is 1 4 16 64.',
+        )
+
+    def handle(self, *args, **options):
+        workspace_id = options['workspace_id']
+        if not Workspace.objects.filter(id=workspace_id).exists():
+            raise CommandError(f'Workspace with ID {workspace_id} does not exist')
+
+        index = get_note_index(workspace_id)
+        top_k = options['top_k']
+
+        # Use stored chunks as queries, excluding their own note from the results
+        samples = list(NoteEmbedding.objects.filter(
+            note__workspace_id=workspace_id
+        ).order_by('?').values_list('note_id', 'embedding')[:options['queries']])
+        if not samples:
+            raise CommandError(f'Workspace {workspace_id} has no note embeddings')
+        queries = [(note_id, np.frombuffer(data, dtype='<f4')) for note_id, data in samples]
+
+        self.stdout.write(f'Workspace {workspace_id}: {len(index)} chunks, {len(queries)} queries, top {top_k}')
+
+        exact_results, exact_times = self._run(index, queries, top_k, exact=True, quantized=False)
+        self.stdout.write(
+            f'{"mode":<14}{"mean ms":>10}{"p95 ms":>10}{"recall":>10}{"speedup":>10}'
+        )
+        exact_mean = np.mean(exact_times)
+        self.stdout.write(
+            f'{"exact":<14}{exact_mean:>10.2f}{np.percentile(exact_times, 95):>10.2f}{1.0:>10.3f}{1.0:>10.1f}'
+        )
+
+        runs = [('int8 rescore', {'exact': True, 'quantized': True})]
+        runs += [(f'ivf nprobe={nprobe}', {'exact': False, 'nprobe': nprobe}) for nprobe in options['nprobe']]
+        for label, search_options in runs:
+            results, times = self._run(index, queries, top_k, **search_options)
+
+            # Recall: share of the exact top-k notes the approximate search also found
+            found = expected = 0
+            for approximate, exact in zip(results, exact_results):
+                found += len(approximate & exact)
+                expected += len(exact)
+            recall = found / expected if expected else 1.0
+
+            mean = np.mean(times)
+            self.stdout.write(
+                f'{label:<14}{mean:>10.2f}{np.percentile(times, 95):>10.2f}'
+                f'{recall:>10.3f}{exact_mean / mean if mean else 0:>10.1f}'
+            )
+
+        stats = index.stats
+        float_bytes = stats['capacity'] * stats['dimensions'] * 4
+        # int8 values plus one float32 scale per row
+        int8_bytes = stats['capacity'] * (stats['dimensions'] + 4)
+        self.stdout.write(
+            f'Vector memory: float32 {float_bytes / 2**20:.1f} MiB, int8 {int8_bytes / 2**20:.1f} MiB '
+            f'({float_bytes - int8_bytes:,} bytes saved per worker on the first pass, '
+            f'rescoring reads up to {settings.VECTOR_INDEX_RESCORE} float rows per query)'
+        )
+
+        self.stdout.write(self.style.SUCCESS('Benchmark complete'))
+
+    def _run(self, index, queries, top_k, **search_options):
+        """Run every query, returning the sets of note ids found and the latencies in ms"""
+        if not search_options.get('exact') or search_options.get('quantized'):
+            # Warm up so IVF training or quantization is not counted as query latency
+            note_id, vector = queries[0]
+            index.search(vector, top_k=top_k, exclude_note_ids={note_id}, **search_options)
+
+        results, times = [], []
+        for note_id, vector in queries:
+            started = time.perf_counter()
+            hits = index.search(vector, top_k=top_k, exclude_note_ids={note_id}, **search_options)
+            times.append((time.perf_counter() - started) * 1000)
+            results.append({hit.note_id for hit in hits})
+        return results, times
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from notekeeper.models import Workspace
+from notekeeper.vector_index import NoteVectorIndex, indexed_workspace_ids, invalidate_note_index
+
+
+class Command(BaseCommand):
+    help = 'Drop tombstoned rows from the memory-mapped note embedding index files'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workspace',
+            type=int,
+            default=None,
+            help='Only compact the index of this workspace ID',
+        )
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Rebuild the index from the NoteEmbedding table instead of compacting it',
+        )
+
+    def handle(self, *args, **options):
+        workspace_id = options['workspace']
+        if workspace_id is not None:
+            if not Workspace.objects.filter(id=workspace_id).exists():
+                raise CommandError(f'Workspace with ID {workspace_id} does not exist')
+            workspace_ids = [workspace_id]
+        elif options['rebuild']:
+            workspace_ids = list(Workspace.objects.values_list('id', flat=True))
+        else:
+            workspace_ids = indexed_workspace_ids()
+
+        if not workspace_ids:
+            self.stdout.write('No vector indexes found')
+            return
+
+        for workspace_id in workspace_ids:
+            index = NoteVectorIndex(workspace_id)
+            if options['rebuild']:
+                count = index.rebuild()
+                self.stdout.write(f'Workspace {workspace_id}: rebuilt with {count} embeddings')
+            elif not index.exists():
+                self.stdout.write(f'Workspace {workspace_id}: no index on disk, skipping')
+            else:
+                removed = index.compact()
+                self.stdout.write(f'Workspace {workspace_id}: removed {removed} tombstoned rows, {len(index)} live')
+
+        # Handles in this process are re-checked against the database on next use
+        invalidate_note_index()
+        self.stdout.write(self.style.SUCCESS('Vector index maintenance complete'))
@@ -95,7 +95,9 @@ class Command(BaseCommand):
             for entity_embedding in EntityEmbedding.objects.filter(entity__workspace=workspace):
                 embedding_data = {
                     'entity_id': entity_embedding.entity_id,
-                    'embedding': entity_embedding.embedding,
+                    'embedding': entity_embedding.vector.tolist(),
+                    'model_name': entity_embedding.model_name,
+                    'content_hash': entity_embedding.content_hash,
                     'generated_at': entity_embedding.generated_at.isoformat()
                 }
                 entity_embeddings_data.append(embedding_data)
@@ -129,7 +131,9 @@ class Command(BaseCommand):
             for note_embedding in NoteEmbedding.objects.filter(note__workspace=workspace):
                 embedding_data = {
                     'note_id': note_embedding.note_id,
-                    'embedding': note_embedding.embedding,
+                    'embedding': note_embedding.vector.tolist(),
+                    'model_name': note_embedding.model_name,
+                    'content_hash': note_embedding.content_hash,
                     'section_index': note_embedding.section_index,
                     'section_text': note_embedding.section_text,
                     'generated_at': note_embedding.generated_at.isoformat()
@@ -1,5 +1,5 @@
 from django.core.management.base import BaseCommand
-from notekeeper.models import Tag, Note, Entity
+from notekeeper.models import Tag, Note, Entity, Workspace
 
 class Command(BaseCommand):
     help = 'Fixes entity-note relationships based on shared tags'
@@ -7,18 +7,18 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         self.stdout.write("Starting to fix entity-note relationships...")
         
-        # Get all tags and rebuild their relationships
-        tags = Tag.objects.all()
-        for tag in tags:
-            self.stdout.write(f"Updating relationships for tag: #{tag.name}")
-            tag.update_relationships()
+        # Rebuild the relationships of each workspace's tags in one statement
+        for workspace in Workspace.objects.all():
+            added = Tag.objects.filter(workspace=workspace).update_relationships()
+            self.stdout.write(f"Workspace {workspace.name}: added {added} entity-note links")
         
         # Count how many relationships were established
+        total_tags = Tag.objects.count()
         total_entities = Entity.objects.count()
         total_notes = Note.objects.count()
         related_notes = Note.objects.filter(referenced_entities__isnull=False).distinct().count()
         
         self.stdout.write(self.style.SUCCESS(
-            f"Completed! Processed {tags.count()} tags, {total_entities} entities. "
+            f"Completed! Processed {total_tags} tags, {total_entities} entities. "
             f"{related_notes} out of {total_notes} notes now have referenced entities."
-        )) 
\ No newline at end of file
+        ))
@@ -10,6 +10,8 @@ from notekeeper.models import (
     Workspace, Entity, Note, Tag, Relationship, RelationshipType, 
     RelationshipInferenceRule, NoteEmbedding, EntityEmbedding
 )
+from notekeeper.batching import deferred_side_effects
+from notekeeper.utils.embedding import EMBEDDING_MODEL
 from django.utils.dateparse import parse_datetime
 
 class Command(BaseCommand):
@@ -48,8 +50,9 @@ class Command(BaseCommand):
             except FileNotFoundError:
                 raise CommandError('Invalid workspace ZIP file: workspace.json not found')
             
-            # Start a transaction to ensure atomicity
-            with transaction.atomic():
+            # Start a transaction to ensure atomicity. Per-row side effects
+            # (relinking, embedding jobs, backups) run once after it commits.
+            with deferred_side_effects(), transaction.atomic():
                 # Import based on schema version
                 if schema_version == '1.0':
                     workspace = self._import_v1(temp_dir, options.get('new_name'), workspace_data)
@@ -730,10 +733,9 @@ class Command(BaseCommand):
                 EntityEmbedding.objects.filter(entity_id=entity_id).delete()
                 
                 # Create new embedding
-                entity_embedding = EntityEmbedding(
-                    entity_id=entity_id,
-                    embedding=embedding
-                )
+                entity_embedding = EntityEmbedding(entity_id=entity_id)
+                entity_embedding.set_vector(embedding, model_name=embedding_data.get('model_name', EMBEDDING_MODEL))
+                entity_embedding.content_hash = embedding_data.get('content_hash', '')
                 
                 # If we have timestamp, preserve it
                 if 'generated_at' in embedding_data:
@@ -782,10 +784,11 @@ class Command(BaseCommand):
                 # Create new embedding
                 note_embedding = NoteEmbedding(
                     note_id=note_id,
-                    embedding=embedding,
                     section_index=section_index,
                     section_text=section_text
                 )
+                note_embedding.set_vector(embedding, model_name=embedding_data.get('model_name', EMBEDDING_MODEL))
+                note_embedding.content_hash = embedding_data.get('content_hash', '')
                 
                 # If we have timestamp, preserve it
                 if 'generated_at' in embedding_data:
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from notekeeper.models import Entity, Note
+from notekeeper.search import rebuild_search_index, search_available
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the SQLite full-text search index over notes and entities'
+
+    def handle(self, *args, **options):
+        if not search_available():
+            raise CommandError(
+                'Full-text search tables not found: they need SQLite with FTS5, created by migration 0040'
+            )
+
+        started = time.time()
+        rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt search index for {Note.objects.count()} notes and {Entity.objects.count()} entities '
+            f'in {time.time() - started:.1f}s'
+        ))
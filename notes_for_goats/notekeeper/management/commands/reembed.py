@@ -0,0 +1,306 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from notekeeper.embedding_jobs import entity_embedding_text, note_embedding_chunks
+from notekeeper.models import EmbeddingJob, Entity, EntityEmbedding, Note, NoteEmbedding, Workspace
+from notekeeper.utils.embedding import batch_texts, count_tokens, current_model, generate_embeddings_batch, text_hash
+from notekeeper.vector_index import NoteVectorIndex, invalidate_note_index
+
+
+class RateLimiter:
+    """
+    Sliding one-minute budget of requests and tokens, shared by all threads.
+    acquire() blocks until a request of the given size fits in both budgets.
+    """
+
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._sent = deque()  # (timestamp, tokens)
+        self._tokens = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._sent and self._sent[0][0] <= now - 60:
+                    self._tokens -= self._sent.popleft()[1]
+
+                fits_requests = not self.requests_per_minute or len(self._sent) < self.requests_per_minute
+                # A single request bigger than the whole token budget is let through on an empty window
+                fits_tokens = (
+                    not self.tokens_per_minute
+                    or not self._sent
+                    or self._tokens + tokens <= self.tokens_per_minute
+                )
+                if fits_requests and fits_tokens:
+                    self._sent.append((now, tokens))
+                    self._tokens += tokens
+                    return
+                wait = self._sent[0][0] + 60 - now
+            time.sleep(max(wait, 0.05))
+
+
+class Command(BaseCommand):
+    help = 'Regenerate note and entity embeddings in bulk, with rate limits and a resumable checkpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workspace',
+            type=int,
+            action='append',
+            dest='workspaces',
+            help='Only re-embed this workspace ID (can be given more than once). Defaults to all workspaces.',
+        )
+        parser.add_argument(
+            '--only',
+            choices=['notes', 'entities'],
+            default=None,
+            help='Only re-embed notes or only entities',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Re-embed everything, even text whose stored hash and model are current',
+        )
+        parser.add_argument(
+            '--page-size',
+            type=int,
+            default=200,
+            help='Objects loaded and committed per step. Default is 200.',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=settings.EMBEDDING_MAX_WORKERS,
+            help='Concurrent embedding requests. Defaults to EMBEDDING_MAX_WORKERS.',
+        )
+        parser.add_argument(
+            '--rpm',
+            type=int,
+            default=0,
+            help='Maximum embedding requests per minute (0 for no limit)',
+        )
+        parser.add_argument(
+            '--tpm',
+            type=int,
+            default=0,
+            help='Maximum estimated tokens per minute (0 for no limit)',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            default=None,
+            help='Checkpoint file used to resume an interrupted run. Defaults to reembed_checkpoint.json in the project root.',
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Ignore an existing checkpoint and start from the beginning',
+        )
+
+    def handle(self, *args, **options):
+        workspace_ids = options['workspaces'] or []
+        missing = set(workspace_ids) - set(Workspace.objects.filter(id__in=workspace_ids).values_list('id', flat=True))
+        if missing:
+            raise CommandError(f"Workspace(s) not found: {', '.join(map(str, sorted(missing)))}")
+
+        self.force = options['force']
+        self.page_size = max(1, options['page_size'])
+        self.limiter = RateLimiter(options['rpm'], options['tpm'])
+        self.touched_workspaces = set()
+
+        checkpoint_path = options['checkpoint'] or os.path.join(settings.BASE_DIR, 'reembed_checkpoint.json')
+        run = {
+            'workspaces': sorted(workspace_ids),
+            'only': options['only'],
+            'force': self.force,
+            'model': current_model(),
+        }
+        self.checkpoint = self._load_checkpoint(checkpoint_path, run, options['restart'])
+        self.checkpoint_path = checkpoint_path
+
+        object_types = ['notes', 'entities'] if not options['only'] else [options['only']]
+        started = time.time()
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as executor:
+                self.executor = executor
+                for object_type in object_types:
+                    if object_type == 'notes':
+                        queryset = Note.objects.all()
+                    else:
+                        queryset = Entity.objects.prefetch_related('tags')
+                    if workspace_ids:
+                        queryset = queryset.filter(workspace_id__in=workspace_ids)
+                    self._run(object_type, queryset.order_by('id'))
+        finally:
+            # bulk_create sends no signals, so rebuild the vector indexes we
+            # changed (also after an interruption, for the pages committed so far)
+            for workspace_id in sorted(self.touched_workspaces):
+                NoteVectorIndex(workspace_id).rebuild()
+            invalidate_note_index()
+
+        # Finished, so the next run starts from the beginning
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        counts = self.checkpoint['counts']
+        self.stdout.write(self.style.SUCCESS(
+            f"Re-embedded {counts['notes']} notes ({counts['chunks']} chunks) and {counts['entities']} entities "
+            f"with {counts['requests']} requests in {time.time() - started:.1f}s "
+            f"({counts['skipped']} unchanged objects skipped)"
+        ))
+
+    # ---- checkpointing -----------------------------------------------
+
+    def _load_checkpoint(self, path, run, restart):
+        if os.path.exists(path) and not restart:
+            with open(path) as f:
+                checkpoint = json.load(f)
+            if checkpoint.get('run') != run:
+                raise CommandError(
+                    f"Checkpoint {path} belongs to a run with different options; "
+                    f"pass the same options or --restart"
+                )
+            self.stdout.write(f"Resuming from checkpoint {path}: {checkpoint['last_id']}")
+            return checkpoint
+
+        return {
+            'run': run,
+            'last_id': {'notes': 0, 'entities': 0},
+            'counts': {'notes': 0, 'entities': 0, 'chunks': 0, 'skipped': 0, 'requests': 0},
+        }
+
+    def _save_checkpoint(self):
+        tmp_path = f'{self.checkpoint_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.checkpoint, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    # ---- embedding ---------------------------------------------------
+
+    def _run(self, object_type, queryset):
+        while True:
+            page = list(queryset.filter(id__gt=self.checkpoint['last_id'][object_type])[:self.page_size])
+            if not page:
+                return
+
+            if object_type == 'notes':
+                done = self._embed_notes(page)
+            else:
+                done = self._embed_entities(page)
+
+            counts = self.checkpoint['counts']
+            counts[object_type] += done
+            counts['skipped'] += len(page) - done
+            self.checkpoint['last_id'][object_type] = page[-1].id
+            self._save_checkpoint()
+            self.stdout.write(f"{object_type}: up to ID {page[-1].id}, {counts[object_type]} re-embedded")
+
+    def _embed_texts(self, texts):
+        """Embed texts in request-sized batches on the worker pool, keeping their order"""
+        batches = batch_texts(texts)
+        futures = []
+        for batch in batches:
+            batch_items = [texts[i] for i in batch]
+            self.limiter.acquire(sum(count_tokens(text) for text in batch_items))
+            futures.append(self.executor.submit(self._embed_with_retries, batch_items))
+
+        results = [None] * len(texts)
+        for batch, future in zip(batches, futures):
+            for i, vector in zip(batch, future.result()):
+                results[i] = vector
+        self.checkpoint['counts']['requests'] += len(batches)
+        return results
+
+    def _embed_with_retries(self, texts, attempts=5):
+        for attempt in range(1, attempts + 1):
+            try:
+                return generate_embeddings_batch(texts)
+            except Exception as e:
+                if attempt == attempts:
+                    raise
+                delay = min(2 ** attempt, 60)
+                self.stderr.write(f"Embedding request failed ({e}); retrying in {delay}s")
+                time.sleep(delay)
+
+    def _embed_notes(self, notes):
+        stored = defaultdict(list)
+        for note_id, section_index, content_hash, model_name in NoteEmbedding.objects.filter(
+            note__in=notes
+        ).order_by('section_index').values_list('note_id', 'section_index', 'content_hash', 'model_name'):
+            stored[note_id].append((section_index, content_hash, model_name))
+
+        # Work out which notes changed, and their chunks
+        model_name = current_model()
+        pending = []  # (note, chunks)
+        for note in notes:
+            chunks = note_embedding_chunks(note)
+            expected = [(i, text_hash(chunk), model_name) for i, chunk in enumerate(chunks)]
+            if self.force or stored[note.id] != expected:
+                pending.append((note, chunks))
+        if not pending:
+            return 0
+
+        vectors = iter(self._embed_texts([chunk for _, chunks in pending for chunk in chunks]))
+        rows = []
+        for note, chunks in pending:
+            for i, chunk in enumerate(chunks):
+                row = NoteEmbedding(
+                    note=note,
+                    section_index=i,
+                    section_text=chunk[:1000] if len(chunk) > 1000 else chunk
+                )
+                row.set_vector(next(vectors), text=chunk)
+                rows.append(row)
+
+        note_ids = [note.id for note, _ in pending]
+        with transaction.atomic():
+            # Raw delete: per-row delete signals would update the vector index
+            # one row at a time, and it is rebuilt at the end anyway
+            NoteEmbedding.objects.filter(note_id__in=note_ids)._raw_delete(NoteEmbedding.objects.db)
+            NoteEmbedding.objects.bulk_create(rows, batch_size=500)
+            EmbeddingJob.objects.filter(object_type=EmbeddingJob.OBJECT_NOTE, object_id__in=note_ids).delete()
+
+        self.touched_workspaces.update(note.workspace_id for note, _ in pending)
+        self.checkpoint['counts']['chunks'] += len(rows)
+        return len(pending)
+
+    def _embed_entities(self, entities):
+        stored = dict(
+            (entity_id, (content_hash, model_name))
+            for entity_id, content_hash, model_name in EntityEmbedding.objects.filter(
+                entity__in=entities
+            ).values_list('entity_id', 'content_hash', 'model_name')
+        )
+
+        model_name = current_model()
+        pending = []  # (entity, text)
+        for entity in entities:
+            text = entity_embedding_text(entity)
+            if self.force or stored.get(entity.id) != (text_hash(text), model_name):
+                pending.append((entity, text))
+        if not pending:
+            return 0
+
+        vectors = self._embed_texts([text for _, text in pending])
+        rows = []
+        for (entity, text), vector in zip(pending, vectors):
+            row = EntityEmbedding(entity=entity)
+            row.set_vector(vector, text=text)
+            rows.append(row)
+
+        entity_ids = [entity.id for entity, _ in pending]
+        with transaction.atomic():
+            EntityEmbedding.objects.filter(entity_id__in=entity_ids).delete()
+            EntityEmbedding.objects.bulk_create(rows, batch_size=500)
+            EmbeddingJob.objects.filter(object_type=EmbeddingJob.OBJECT_ENTITY, object_id__in=entity_ids).delete()
+
+        return len(pending)
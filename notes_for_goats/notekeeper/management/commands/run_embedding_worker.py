@@ -0,0 +1,65 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from notekeeper.embedding_jobs import claim_jobs, process_job_in_thread, release_stale_jobs
+
+
+class Command(BaseCommand):
+    help = 'Process queued note and entity embedding jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=settings.EMBEDDING_MAX_WORKERS,
+            help='Number of jobs processed concurrently. Defaults to EMBEDDING_MAX_WORKERS.',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=2.0,
+            help='Seconds to wait before checking an empty queue again. Default is 2.',
+        )
+        parser.add_argument(
+            '--stale-after',
+            type=int,
+            default=600,
+            help='Requeue jobs that have been running longer than this many seconds. Default is 600.',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit once no jobs are due instead of waiting for more',
+        )
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        processed = failed = 0
+
+        released = release_stale_jobs(options['stale_after'])
+        if released:
+            self.stdout.write(f'Requeued {released} stale jobs')
+
+        self.stdout.write(f'Embedding worker started with {workers} threads')
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            try:
+                while True:
+                    jobs = claim_jobs(limit=workers * 4)
+                    if not jobs:
+                        if options['once']:
+                            break
+                        time.sleep(options['poll_interval'])
+                        release_stale_jobs(options['stale_after'])
+                        continue
+
+                    for succeeded in executor.map(process_job_in_thread, jobs):
+                        processed += 1
+                        if not succeeded:
+                            failed += 1
+            except KeyboardInterrupt:
+                self.stdout.write('Stopping embedding worker')
+
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} jobs ({failed} failed)'))
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.20 on 2026-10-17 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notekeeper", "0034_entity_title"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="entityembedding",
+            name="embedding",
+            field=models.JSONField(null=True),
+        ),
+        migrations.AlterField(
+            model_name="noteembedding",
+            name="embedding",
+            field=models.JSONField(null=True),
+        ),
+        migrations.AddField(
+            model_name="entityembedding",
+            name="dimensions",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="entityembedding",
+            name="embedding_blob",
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AddField(
+            model_name="entityembedding",
+            name="model_name",
+            field=models.CharField(default="text-embedding-ada-002", max_length=100),
+        ),
+        migrations.AddField(
+            model_name="noteembedding",
+            name="dimensions",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="noteembedding",
+            name="embedding_blob",
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AddField(
+            model_name="noteembedding",
+            name="model_name",
+            field=models.CharField(default="text-embedding-ada-002", max_length=100),
+        ),
+    ]
@@ -0,0 +1,46 @@
+import numpy as np
+from django.db import migrations
+
+BATCH_SIZE = 500
+
+def _convert(model, to_binary):
+    """Rewrite every row of an embedding model between JSON and packed float32"""
+    batch = []
+    for row in model.objects.all().iterator(chunk_size=BATCH_SIZE):
+        if to_binary:
+            vector = np.asarray(row.embedding or [], dtype='<f4')
+            row.embedding_blob = vector.tobytes()
+            row.dimensions = vector.size
+        else:
+            vector = np.frombuffer(row.embedding_blob or b'', dtype='<f4')
+            row.embedding = [float(x) for x in vector]
+        batch.append(row)
+        
+        if len(batch) >= BATCH_SIZE:
+            fields = ['embedding_blob', 'dimensions'] if to_binary else ['embedding']
+            model.objects.bulk_update(batch, fields)
+            batch = []
+    
+    if batch:
+        fields = ['embedding_blob', 'dimensions'] if to_binary else ['embedding']
+        model.objects.bulk_update(batch, fields)
+
+def pack_embeddings(apps, schema_editor):
+    """Convert JSON embedding lists to packed little-endian float32 blobs"""
+    for model_name in ('NoteEmbedding', 'EntityEmbedding'):
+        _convert(apps.get_model('notekeeper', model_name), to_binary=True)
+
+def unpack_embeddings(apps, schema_editor):
+    """Convert packed float32 blobs back to JSON lists"""
+    for model_name in ('NoteEmbedding', 'EntityEmbedding'):
+        _convert(apps.get_model('notekeeper', model_name), to_binary=False)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notekeeper', '0035_embedding_blob_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(pack_embeddings, unpack_embeddings),
+    ]
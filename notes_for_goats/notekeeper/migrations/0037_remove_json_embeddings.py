@@ -0,0 +1,41 @@
+# Generated by Django 4.2.20 on 2026-10-17 09:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notekeeper", "0036_pack_embeddings_to_float32"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="entityembedding",
+            name="embedding",
+        ),
+        migrations.RemoveField(
+            model_name="noteembedding",
+            name="embedding",
+        ),
+        migrations.RenameField(
+            model_name="entityembedding",
+            old_name="embedding_blob",
+            new_name="embedding",
+        ),
+        migrations.RenameField(
+            model_name="noteembedding",
+            old_name="embedding_blob",
+            new_name="embedding",
+        ),
+        migrations.AlterField(
+            model_name="entityembedding",
+            name="embedding",
+            field=models.BinaryField(),
+        ),
+        migrations.AlterField(
+            model_name="noteembedding",
+            name="embedding",
+            field=models.BinaryField(),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.20 on 2026-10-17 19:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notekeeper', '0038_embeddingjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='entityembedding',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='noteembedding',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
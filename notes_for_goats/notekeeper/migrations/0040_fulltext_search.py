@@ -0,0 +1,67 @@
+from django.db import migrations
+from django.db.utils import OperationalError
+
+# External-content FTS5 tables over notes and entities. The text stays in the
+# notekeeper tables; triggers keep the full-text index in sync with every
+# insert, update and delete, including bulk and raw SQL writes.
+SEARCH_TABLES = [
+    ('notekeeper_note_fts', 'notekeeper_note', ['title', 'content']),
+    ('notekeeper_entity_fts', 'notekeeper_entity', ['name', 'details']),
+]
+
+
+def _create_sql(fts_table, source_table, columns):
+    column_list = ', '.join(columns)
+    new_values = ', '.join(f'new.{column}' for column in columns)
+    old_values = ', '.join(f'old.{column}' for column in columns)
+    delete_old = (
+        f"INSERT INTO {fts_table}({fts_table}, rowid, {column_list}) "
+        f"VALUES('delete', old.id, {old_values});"
+    )
+    insert_new = f"INSERT INTO {fts_table}(rowid, {column_list}) VALUES (new.id, {new_values});"
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5("
+        f"{column_list}, content='{source_table}', content_rowid='id', "
+        f"tokenize='unicode61 remove_diacritics 2')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts_table}_ai AFTER INSERT ON {source_table} BEGIN {insert_new} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts_table}_ad AFTER DELETE ON {source_table} BEGIN {delete_old} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts_table}_au AFTER UPDATE OF {column_list} ON {source_table} "
+        f"BEGIN {delete_old} {insert_new} END",
+        f"INSERT INTO {fts_table}({fts_table}) VALUES('rebuild')",
+    ]
+
+
+def create_search_tables(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for fts_table, source_table, columns in SEARCH_TABLES:
+            try:
+                for statement in _create_sql(fts_table, source_table, columns):
+                    cursor.execute(statement)
+            except OperationalError:
+                # SQLite built without FTS5: searches fall back to LIKE queries
+                return
+
+
+def drop_search_tables(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for fts_table, _, _ in SEARCH_TABLES:
+            for suffix in ('ai', 'ad', 'au'):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {fts_table}_{suffix}")
+            cursor.execute(f"DROP TABLE IF EXISTS {fts_table}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notekeeper', '0039_embedding_content_hash'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_tables, drop_search_tables),
+    ]
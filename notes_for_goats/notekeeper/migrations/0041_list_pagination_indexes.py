@@ -0,0 +1,25 @@
+# Generated by Django 4.2.20 on 2026-10-17 20:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notekeeper', '0040_fulltext_search'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='entity',
+            index=models.Index(fields=['workspace', 'type', 'name', 'id'], name='entity_list_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(fields=['workspace', '-timestamp', '-id'], name='note_list_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='relationship',
+            index=models.Index(fields=['workspace', '-created_at', '-id'], name='relationship_list_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.20 on 2026-10-17 20:09
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notekeeper', '0041_list_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='entity',
+            index=models.Index(models.F('workspace'), django.db.models.functions.text.Lower('name'), name='entity_name_lower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(models.F('workspace'), django.db.models.functions.text.Lower('name'), name='tag_name_lower_idx'),
+        ),
+    ]
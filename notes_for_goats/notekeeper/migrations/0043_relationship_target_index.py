@@ -0,0 +1,17 @@
+# Generated by Django 4.2.20 on 2026-10-17 20:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notekeeper', '0042_hashtag_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='relationship',
+            index=models.Index(fields=['relationship_type', 'target_object_id'], name='relationship_target_idx'),
+        ),
+    ]
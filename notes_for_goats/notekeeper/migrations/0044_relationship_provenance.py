@@ -0,0 +1,82 @@
+# Generated by Django 4.2.20 on 2026-10-17 20:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+from collections import defaultdict
+
+
+def backfill_provenance(apps, schema_editor):
+    """
+    Record provenance for relationships inferred before it was tracked. They
+    are found by their "Auto-inferred: ... (Rule: <name>)" details; the
+    source relationships are the current edges through the common entities
+    the pair shares, or unknown (null) if none are left.
+    """
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    Relationship = apps.get_model('notekeeper', 'Relationship')
+    RelationshipInferenceRule = apps.get_model('notekeeper', 'RelationshipInferenceRule')
+    RelationshipProvenance = apps.get_model('notekeeper', 'RelationshipProvenance')
+
+    entity_type = ContentType.objects.filter(app_label='notekeeper', model='entity').first()
+    if entity_type is None:
+        return
+
+    rows = []
+    for rule in RelationshipInferenceRule.objects.select_related('source_relationship_type'):
+        inferred = Relationship.objects.filter(
+            workspace_id=rule.workspace_id,
+            relationship_type_id=rule.inferred_relationship_type_id,
+            details__startswith='Auto-inferred:',
+            details__endswith=f"(Rule: {rule.name})"
+        ).values_list('id', 'source_object_id', 'target_object_id')
+        if not inferred:
+            continue
+
+        # member -> common entity -> ids of the source relationships linking them
+        commons = defaultdict(lambda: defaultdict(list))
+        edges = Relationship.objects.filter(
+            workspace_id=rule.workspace_id,
+            relationship_type_id=rule.source_relationship_type_id,
+            source_content_type=entity_type,
+            target_content_type=entity_type
+        ).values_list('id', 'source_object_id', 'target_object_id')
+        for edge_id, source_id, target_id in edges:
+            commons[source_id][target_id].append(edge_id)
+            if not rule.source_relationship_type.is_directional:
+                commons[target_id][source_id].append(edge_id)
+
+        for relationship_id, source_id, target_id in inferred:
+            shared = set(commons[source_id]) & set(commons[target_id])
+            supporting = {
+                edge_id for common_id in shared
+                for edge_id in commons[source_id][common_id] + commons[target_id][common_id]
+            }
+            for edge_id in supporting or [None]:
+                rows.append(RelationshipProvenance(
+                    relationship_id=relationship_id, rule_id=rule.id, source_relationship_id=edge_id
+                ))
+
+    RelationshipProvenance.objects.bulk_create(rows, batch_size=500, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notekeeper', '0043_relationship_target_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelationshipProvenance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('relationship', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='provenance', to='notekeeper.relationship')),
+                ('rule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='provenance', to='notekeeper.relationshipinferencerule')),
+                ('source_relationship', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='supported_provenance', to='notekeeper.relationship')),
+            ],
+            options={
+                'unique_together': {('relationship', 'rule', 'source_relationship')},
+            },
+        ),
+        migrations.RunPython(backfill_provenance, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.20 on 2026-10-17 20:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notekeeper', '0044_relationship_provenance'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='relationshipinferencerule',
+            name='max_depth',
+            field=models.PositiveSmallIntegerField(default=5, help_text='For chain rules: the longest chain followed, in relationships'),
+        ),
+        migrations.AddField(
+            model_name='relationshipinferencerule',
+            name='max_inferred',
+            field=models.PositiveIntegerField(default=10000, help_text='Most relationships this rule may infer; inference stops once reached'),
+        ),
+        migrations.AddField(
+            model_name='relationshipinferencerule',
+            name='pattern',
+            field=models.CharField(choices=[('shared_target', 'Shared connection'), ('transitive', 'Chain (transitive)'), ('composition', 'Composition of two types'), ('inverse', 'Inverse')], default='shared_target', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='relationshipinferencerule',
+            name='second_relationship_type',
+            field=models.ForeignKey(blank=True, help_text='For composition rules: then this relationship from the entity reached', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='second_inference_rules', to='notekeeper.relationshiptype'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.20 on 2026-10-17 20:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notekeeper', '0045_inference_rule_patterns'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='relationship',
+            index=models.Index(fields=['target_content_type', 'target_object_id'], name='relationship_target_object_idx'),
+        ),
+    ]
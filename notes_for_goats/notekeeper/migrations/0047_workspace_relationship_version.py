@@ -0,0 +1,18 @@
+# Generated by Django 4.2.20 on 2026-10-17 20:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notekeeper', '0046_relationship_target_object_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workspace',
+            name='relationship_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
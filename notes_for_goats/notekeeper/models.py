@@ -1,10 +1,14 @@
-from django.db import models
+from django.db import connection, models
+from django.db.models import F
+from django.db.models.functions import Lower
 from django.utils import timezone
 import re
 import uuid
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.auth.models import User
+from .batching import current_batch
+from .utils.embedding import EMBEDDING_MODEL, current_model, pack_embedding, unpack_embedding, text_hash
 
 
 class Workspace(models.Model):
@@ -17,13 +21,53 @@ class Workspace(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
+    # Bumped whenever the workspace's relationships change (see adjacency.py)
+    relationship_version = models.PositiveIntegerField(default=0, editable=False)
     
     def __str__(self):
         return self.name
     
     class Meta:
         ordering = ['name']
-        
+
+
+class TagQuerySet(models.QuerySet):
+    def update_relationships(self, note_ids=None, entity_ids=None):
+        """
+        Link every note to every entity that shares one of these tags, with a
+        single INSERT of the missing (note, entity) pairs. note_ids and
+        entity_ids narrow the update to those notes or entities.
+        Returns the number of links added.
+        """
+        if note_ids is not None and not note_ids or entity_ids is not None and not entity_ids:
+            return 0
+
+        refs_table = Note.referenced_entities.through._meta.db_table
+        note_tags_table = Note.tags.through._meta.db_table
+        entity_tags_table = Entity.tags.through._meta.db_table
+
+        tag_sql, params = self.order_by().values('pk').query.sql_with_params()
+        conditions = [f"nt.tag_id IN ({tag_sql})"]
+        params = list(params)
+        if note_ids is not None:
+            conditions.append(f"nt.note_id IN ({', '.join(['%s'] * len(note_ids))})")
+            params.extend(note_ids)
+        if entity_ids is not None:
+            conditions.append(f"et.entity_id IN ({', '.join(['%s'] * len(entity_ids))})")
+            params.extend(entity_ids)
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {refs_table} (note_id, entity_id) "
+                f"SELECT DISTINCT nt.note_id, et.entity_id FROM {note_tags_table} nt "
+                f"JOIN {entity_tags_table} et ON et.tag_id = nt.tag_id "
+                f"WHERE {' AND '.join(conditions)} AND NOT EXISTS ("
+                f"SELECT 1 FROM {refs_table} r WHERE r.note_id = nt.note_id AND r.entity_id = et.entity_id)",
+                params
+            )
+            return cursor.rowcount
+
+
 class Tag(models.Model):
     """
     Represents a hashtag that can be used across notes and entities
@@ -32,10 +76,16 @@ class Tag(models.Model):
     name = models.CharField(max_length=50)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    objects = TagQuerySet.as_manager()
     
     class Meta:
         unique_together = ('workspace', 'name')  # Tags are unique within a workspace
         ordering = ['name']
+        indexes = [
+            # Case-insensitive hashtag lookups in Note.save
+            models.Index(F('workspace'), Lower('name'), name='tag_name_lower_idx'),
+        ]
     
     def __str__(self):
         return f"#{self.name}"
@@ -49,22 +99,8 @@ class Tag(models.Model):
             self.update_relationships()
     
     def update_relationships(self):
-        """Update relationships between entities and notes that share this tag"""
-        # Get all notes with this tag
-        notes = self.tagged_notes.all()
-        
-        # Get all entities with this tag
-        entities = self.tagged_entities.all()
-        
-        # For each entity, ensure it's linked to all notes with this tag
-        for entity in entities:
-            # Add all notes with this tag to the entity's referenced_notes
-            entity.note_notes.add(*notes)
-        
-        # For each note, ensure it's linked to all entities with this tag
-        for note in notes:
-            # Add all entities with this tag to the note's referenced_entities
-            note.referenced_entities.add(*entities)
+        """Link the entities and notes that share this tag; returns the number of links added"""
+        return Tag.objects.filter(pk=self.pk).update_relationships()
 
 
 class Entity(models.Model):
@@ -102,38 +138,27 @@ class Entity(models.Model):
         # First save the entity itself
         super().save(*args, **kwargs)
         
-        # Ensure a tag exists with the same name as the entity (lowercase for consistency)
-        entity_name_tag, created = Tag.objects.get_or_create(
-            workspace=self.workspace,
-            name=self.name.lower().replace(" ", "")
-        )
-        
-        # Link this tag to the entity if not already linked
-        self.tags.add(entity_name_tag)
+        # In batch mode, name tags are added for all saved entities when the batch ends
+        batch = current_batch()
+        if batch is not None:
+            batch.name_tag_entity_ids.add(self.pk)
+            return
         
-        # Now handle the regular tag relationships
-        if hasattr(self, 'tags') and self.pk:
-            self.update_relationships_from_tags()
-        
-        # After saving, trigger relationship update for all the entity's tags
-        # This ensures existing notes with the same tags get connected to this entity
-        for tag in self.tags.all():
-            tag.update_relationships()
+        link_entity_name_tags([self])
     
     def update_relationships_from_tags(self):
-        """Update relationships with notes based on shared tags"""
-        # For each tag, find notes that also have this tag
-        for tag in self.tags.all():
-            # Get notes with this tag
-            related_notes = tag.tagged_notes.all()
-            
-            # Add these notes to this entity's referenced_notes
-            if related_notes.exists():
-                self.note_notes.add(*related_notes)
+        """Link this entity to the notes that share its tags; returns the number of links added"""
+        return self.tags.all().update_relationships(entity_ids=[self.pk])
     
     class Meta:
         verbose_name_plural = "Entities"
         ordering = ['name']
+        indexes = [
+            # Keyset pagination of the entity list
+            models.Index(fields=['workspace', 'type', 'name', 'id'], name='entity_list_idx'),
+            # Case-insensitive name lookups when resolving a note's hashtags
+            models.Index(F('workspace'), Lower('name'), name='entity_name_lower_idx'),
+        ]
 
 class Note(models.Model):
     """
@@ -160,52 +185,114 @@ class Note(models.Model):
         # First save the note normally to ensure it exists in the database
         super().save(*args, **kwargs)
         
-        # Extract hashtags from content (words prefixed with #)
-        hashtags = re.findall(r'#(\w+)', self.content)
+        # In batch mode, the hashtags of all saved notes are resolved together when the batch ends
+        batch = current_batch()
+        if batch is not None:
+            batch.hashtag_note_ids.add(self.pk)
+            return
         
-        # Convert to lowercase for case-insensitive matching
-        lower_hashtags = [tag.lower() for tag in hashtags]
+        link_note_hashtags([self])
         
-        # ONLY ADD tags, never remove them
-        # Create or get Tag objects for each hashtag
-        for hashtag in lower_hashtags:
-            tag, created = Tag.objects.get_or_create(
-                workspace=self.workspace,
-                name=hashtag
+    class Meta:
+        verbose_name_plural = "Notes"
+        ordering = ['-timestamp']
+        indexes = [
+            # Keyset pagination of the note list
+            models.Index(fields=['workspace', '-timestamp', '-id'], name='note_list_idx'),
+        ]
+
+
+# Words prefixed with #
+HASHTAG_PATTERN = re.compile(r'#(\w+)')
+
+
+def _tag_ids(workspace_id, names):
+    """
+    Map each of the tag names to its Tag id, creating the missing tags in one
+    statement (ignoring any another save has just created)
+    """
+    existing = set(Tag.objects.filter(workspace_id=workspace_id, name__in=names).values_list('name', flat=True))
+    Tag.objects.bulk_create(
+        [Tag(workspace_id=workspace_id, name=name) for name in names if name not in existing],
+        ignore_conflicts=True
+    )
+    return dict(Tag.objects.filter(workspace_id=workspace_id, name__in=names).values_list('name', 'pk'))
+
+
+def _group_by_workspace(objects):
+    groups = {}
+    for obj in objects:
+        groups.setdefault(obj.workspace_id, []).append(obj)
+    return groups.items()
+
+
+def link_entity_name_tags(entities):
+    """
+    Give each entity a tag matching its name (lowercase, without spaces) and
+    link it to the notes that share its tags
+    """
+    for workspace_id, workspace_entities in _group_by_workspace(entities):
+        names = {entity.pk: entity.name.lower().replace(" ", "") for entity in workspace_entities}
+        tag_ids = _tag_ids(workspace_id, sorted(set(names.values())))
+        Entity.tags.through.objects.bulk_create(
+            [Entity.tags.through(entity_id=pk, tag_id=tag_ids[name]) for pk, name in names.items()],
+            ignore_conflicts=True
+        )
+        Tag.objects.filter(workspace_id=workspace_id).update_relationships(entity_ids=list(names))
+
+
+def link_note_hashtags(notes):
+    """
+    Tag notes with the #hashtags in their content and reference the entities
+    the hashtags name, in a fixed number of queries per workspace.
+    Tags are only ever added. referenced_entities becomes the entities named
+    by a hashtag or carrying a tag that matches one (both case-insensitive),
+    plus the entities sharing a tag with the note.
+    """
+    note_tags = Note.tags.through
+    references = Note.referenced_entities.through
+    for workspace_id, workspace_notes in _group_by_workspace(notes):
+        hashtags = {
+            note.pk: {tag.lower() for tag in HASHTAG_PATTERN.findall(note.content)}
+            for note in workspace_notes
+        }
+        all_hashtags = sorted(set().union(*hashtags.values()))
+        matches = {}  # lowercase hashtag -> ids of the entities it refers to
+        if all_hashtags:
+            tag_ids = _tag_ids(workspace_id, all_hashtags)
+            note_tags.objects.bulk_create(
+                [note_tags(note_id=pk, tag_id=tag_ids[name]) for pk, names in hashtags.items() for name in names],
+                ignore_conflicts=True
             )
-            # Add the tag without clearing or removing any existing tags
-            self.tags.add(tag)
-        
-        # Handle entity references
-        workspace_entities = Entity.objects.filter(workspace=self.workspace)
-        entities_to_add = []
         
-        for entity in workspace_entities:
-            # Check if entity name matches any hashtag (case-insensitive)
-            if entity.name.lower() in lower_hashtags:
-                entities_to_add.append(entity)
-                continue
-            
-            # Check if any entity tag matches any hashtag
-            entity_tags = [tag.name.lower() for tag in entity.tags.all()]
-            
-            # If any tag matches a hashtag, add the entity
-            if any(tag in lower_hashtags for tag in entity_tags):
-                entities_to_add.append(entity)
+            # Entities named like a hashtag, and entities carrying a tag that
+            # matches one. Separate lookups rather than an OR, so each is an
+            # index search (on Lower(name)) instead of a scan of the workspace.
+            named = Entity.objects.annotate(name_lower=Lower('name')).filter(
+                workspace_id=workspace_id, name_lower__in=all_hashtags
+            ).order_by().values_list('pk', 'name_lower')
+            matching_tags = dict(Tag.objects.annotate(name_lower=Lower('name')).filter(
+                workspace_id=workspace_id, name_lower__in=all_hashtags
+            ).order_by().values_list('pk', 'name_lower'))
+            tagged = Entity.tags.through.objects.filter(tag_id__in=matching_tags).values_list('entity_id', 'tag_id')
+            for entity_id, name in named:
+                matches.setdefault(name, set()).add(entity_id)
+            for entity_id, tag_id in tagged:
+                matches.setdefault(matching_tags[tag_id], set()).add(entity_id)
         
-        # Update referenced_entities
-        if entities_to_add:
-            self.referenced_entities.set(entities_to_add)
-        else:
-            self.referenced_entities.clear()
+        # Replace the references with the hashtag matches...
+        references.objects.filter(note_id__in=list(hashtags)).delete()
+        references.objects.bulk_create(
+            [
+                references(note_id=pk, entity_id=entity_id)
+                for pk, names in hashtags.items()
+                for entity_id in set().union(*(matches.get(name, ()) for name in names))
+            ],
+            ignore_conflicts=True
+        )
         
-        # Trigger tag relationship update for shared connections
-        for tag in self.tags.all():
-            tag.update_relationships()
-    
-    class Meta:
-        verbose_name_plural = "Notes"
-        ordering = ['-timestamp']
+        # ...then link the notes to the entities that share their tags
+        Tag.objects.filter(workspace_id=workspace_id).update_relationships(note_ids=list(hashtags))
 
 class RelationshipType(models.Model):
     workspace = models.ForeignKey(Workspace, on_delete=models.CASCADE, related_name='relationship_types')
@@ -250,6 +337,15 @@ class Relationship(models.Model):
             ('workspace', 'source_content_type', 'source_object_id', 'target_content_type', 'target_object_id', 'relationship_type')
         ]
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pagination of the relationship list
+            models.Index(fields=['workspace', '-created_at', '-id'], name='relationship_list_idx'),
+            # Finding the relationships that point at an entity (inference, graphs)
+            models.Index(fields=['relationship_type', 'target_object_id'], name='relationship_target_idx'),
+            # Finding the relationships that point at any of a set of objects (graphs);
+            # the unique constraint's index already covers the source side
+            models.Index(fields=['target_content_type', 'target_object_id'], name='relationship_target_object_idx'),
+        ]
         
     def __str__(self):
         source = str(self.source) if self.source else f"Unknown ({self.source_object_id})"
@@ -258,9 +354,22 @@ class Relationship(models.Model):
 
 class RelationshipInferenceRule(models.Model):
     """Rules for automatically inferring relationships between entities."""
+    # What a rule matches (see inference.py)
+    PATTERN_SHARED_TARGET = 'shared_target'  # A -> C <- B gives A - B
+    PATTERN_TRANSITIVE = 'transitive'  # A -> B -> ... -> C gives A - C
+    PATTERN_COMPOSITION = 'composition'  # A -> B, then B -> C of the second type, gives A - C
+    PATTERN_INVERSE = 'inverse'  # A -> B gives B - A
+    PATTERNS = [
+        (PATTERN_SHARED_TARGET, 'Shared connection'),
+        (PATTERN_TRANSITIVE, 'Chain (transitive)'),
+        (PATTERN_COMPOSITION, 'Composition of two types'),
+        (PATTERN_INVERSE, 'Inverse'),
+    ]
+    
     workspace = models.ForeignKey(Workspace, on_delete=models.CASCADE, related_name='inference_rules')
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True)
+    pattern = models.CharField(max_length=20, choices=PATTERNS, default=PATTERN_SHARED_TARGET)
     
     # What relationship type to look for
     source_relationship_type = models.ForeignKey(
@@ -270,6 +379,16 @@ class RelationshipInferenceRule(models.Model):
         help_text="When two entities share this relationship with a common target"
     )
     
+    # The type followed after the source type, for composition rules
+    second_relationship_type = models.ForeignKey(
+        RelationshipType,
+        related_name='second_inference_rules',
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        help_text="For composition rules: then this relationship from the entity reached"
+    )
+    
     # What relationship type to create between entities that share the common relationship
     inferred_relationship_type = models.ForeignKey(
         RelationshipType,
@@ -284,6 +403,16 @@ class RelationshipInferenceRule(models.Model):
         help_text="Automatically update inferred relationships when source relationships change"
     )
     
+    # Limits on what one rule can infer
+    max_depth = models.PositiveSmallIntegerField(
+        default=5,
+        help_text="For chain rules: the longest chain followed, in relationships"
+    )
+    max_inferred = models.PositiveIntegerField(
+        default=10000,
+        help_text="Most relationships this rule may infer; inference stops once reached"
+    )
+    
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -294,6 +423,31 @@ class RelationshipInferenceRule(models.Model):
     def __str__(self):
         return f"{self.name} ({self.workspace.name})"
 
+class RelationshipProvenance(models.Model):
+    """
+    Why an inferred relationship exists: the rule that inferred it and one
+    of the source relationships supporting it. An inferred relationship has
+    a row per supporting source relationship of each rule that infers it;
+    relationships without rows were created by hand. source_relationship is
+    null when the support is not known (rows backfilled from before
+    provenance was recorded, or whose source was deleted).
+    """
+    relationship = models.ForeignKey(Relationship, on_delete=models.CASCADE, related_name='provenance')
+    rule = models.ForeignKey(RelationshipInferenceRule, on_delete=models.CASCADE, related_name='provenance')
+    source_relationship = models.ForeignKey(
+        Relationship,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='supported_provenance'
+    )
+    
+    class Meta:
+        unique_together = ('relationship', 'rule', 'source_relationship')
+    
+    def __str__(self):
+        return f"{self.relationship_id} from {self.source_relationship_id} ({self.rule.name})"
+
 class UserPreference(models.Model):
     """Stores user preferences"""
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='preferences')
@@ -303,22 +457,104 @@ class UserPreference(models.Model):
     def __str__(self):
         return f"Preferences for {self.user.username}"
 
-class NoteEmbedding(models.Model):
+class StoredEmbedding(models.Model):
+    """
+    Base for stored embedding vectors.
+    Vectors are kept as packed little-endian float32 bytes rather than JSON,
+    with the dimension count, generating model and a hash of the embedded
+    text recorded alongside.
+    """
+    embedding = models.BinaryField()
+    dimensions = models.PositiveIntegerField(default=0)
+    model_name = models.CharField(max_length=100, default=EMBEDDING_MODEL)
+    # sha256 of the exact text that was embedded, used to skip unchanged text
+    content_hash = models.CharField(max_length=64, blank=True, default='')
+    generated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        abstract = True
+    
+    @property
+    def vector(self):
+        """Return the embedding as a read-only float32 array over the stored bytes"""
+        return unpack_embedding(self.embedding)
+    
+    def set_vector(self, vector, model_name=None, text=None):
+        """
+        Pack a vector into the binary field and record its dimensions and model
+        (the configured backend's unless given), plus the hash of the embedded
+        text when it is given
+        """
+        self.embedding = pack_embedding(vector)
+        self.dimensions = len(self.embedding) // 4
+        self.model_name = model_name or current_model()
+        if text is not None:
+            self.content_hash = text_hash(text)
+    
+    def is_current(self, text, model_name=None):
+        """True if this vector was generated from exactly this text with this (or the current) model"""
+        return (
+            bool(self.content_hash)
+            and self.content_hash == text_hash(text)
+            and self.model_name == (model_name or current_model())
+        )
+
+class NoteEmbedding(StoredEmbedding):
     """Stores embeddings for notes to enable semantic search"""
     note = models.ForeignKey(Note, on_delete=models.CASCADE, related_name='embeddings')
-    embedding = models.JSONField()
-    generated_at = models.DateTimeField(auto_now=True)
     section_index = models.IntegerField(default=0)
     section_text = models.TextField(blank=True, null=True)
     
     def __str__(self):
         return f"Embedding for {self.note} (section {self.section_index})"
 
-class EntityEmbedding(models.Model):
+class EntityEmbedding(StoredEmbedding):
     """Stores embeddings for entities to enable semantic search"""
     entity = models.OneToOneField(Entity, on_delete=models.CASCADE, related_name='embedding')
-    embedding = models.JSONField()
-    generated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
         return f"Embedding for {self.entity}"
+
+
+class EmbeddingJob(models.Model):
+    """
+    Pending request to (re)generate the embedding of a note or entity.
+    Saves only enqueue a job; the run_embedding_worker command does the work.
+    There is at most one job per object, so repeated saves coalesce.
+    """
+    OBJECT_NOTE = 'note'
+    OBJECT_ENTITY = 'entity'
+    OBJECT_TYPES = [
+        (OBJECT_NOTE, 'Note'),
+        (OBJECT_ENTITY, 'Entity'),
+    ]
+    
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_FAILED = 'failed'
+    STATUSES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    
+    object_type = models.CharField(max_length=20, choices=OBJECT_TYPES)
+    object_id = models.PositiveBigIntegerField()
+    status = models.CharField(max_length=20, choices=STATUSES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    # Bumped on every enqueue so a worker can tell the object changed while it ran
+    requested_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        unique_together = ('object_type', 'object_id')
+        ordering = ['next_attempt_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+    
+    def __str__(self):
+        return f"Embed {self.object_type} {self.object_id} ({self.status})"
@@ -0,0 +1,164 @@
+"""
+Keyset (cursor) pagination for the list views.
+
+A page is fetched with a WHERE clause that starts right after the last row of
+the previous page, rather than with OFFSET, so every page costs one index
+range scan however deep it is, and rows added meanwhile do not shift later
+pages. The ordering must end in a unique column (normally id) and its columns
+must not be null. The cursor handed to the next request is the last row's
+ordering values, as JSON in URL-safe base64.
+
+Views add ?cursor=... to page forward (other query parameters, i.e. the
+filters, are kept), and ?format=json returns a page as JSON for infinite
+scrolling.
+"""
+import base64
+import datetime
+import json
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from django.http import JsonResponse
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _json_default(value):
+    # Full precision: DjangoJSONEncoder drops microseconds, which would make
+    # rows sharing a timestamp's millisecond fall between pages
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError(f"Cannot put {type(value).__name__} in a cursor")
+
+
+def encode_cursor(values):
+    data = json.dumps(values, default=_json_default, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, UnicodeError) as e:
+        raise InvalidCursor(f"Malformed cursor: {e}")
+    if not isinstance(values, list):
+        raise InvalidCursor("Malformed cursor")
+    return values
+
+
+def _after(ordering, values):
+    """
+    Rows strictly after `values` in `ordering`, e.g. for (-timestamp, -id):
+    timestamp < t OR (timestamp = t AND id < i)
+    """
+    condition = None
+    for key, value in reversed(list(zip(ordering, values))):
+        name = key.lstrip('-')
+        lookup = 'lt' if key.startswith('-') else 'gt'
+        step = Q(**{f'{name}__{lookup}': value})
+        if condition is not None:
+            step |= Q(**{name: value}) & condition
+        condition = step
+    return condition
+
+
+class KeysetPage:
+    """One page of rows, plus the cursor of the page after it (None on the last page)"""
+
+    def __init__(self, items, next_cursor, cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.cursor = cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def is_first(self):
+        return not self.cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def keyset_paginate(queryset, ordering, cursor=None, page_size=None):
+    """
+    Return the KeysetPage of queryset, sorted by ordering, that follows cursor
+    (the first page if cursor is empty). Ordering keys may name model fields
+    or annotations. Raises InvalidCursor for a cursor that does not fit.
+    """
+    page_size = page_size or settings.LIST_PAGE_SIZE
+    queryset = queryset.order_by(*ordering)
+
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != len(ordering):
+            raise InvalidCursor("Cursor does not match the list ordering")
+        parsed = []
+        for key, value in zip(ordering, values):
+            try:
+                # Field values go back through the field (e.g. datetimes from ISO strings)
+                value = queryset.model._meta.get_field(key.lstrip('-')).to_python(value)
+            except FieldDoesNotExist:
+                pass
+            except ValidationError as e:
+                raise InvalidCursor(f"Malformed cursor: {e}")
+            parsed.append(value)
+        queryset = queryset.filter(_after(ordering, parsed))
+
+    # One extra row tells whether there is a next page
+    rows = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor([getattr(rows[-1], key.lstrip('-')) for key in ordering])
+    return KeysetPage(rows, next_cursor, cursor)
+
+
+def paginate_request(request, queryset, ordering):
+    """
+    keyset_paginate with the cursor and page size (?page_size=, capped at
+    LIST_MAX_PAGE_SIZE) from the request. A bad cursor restarts at the first page.
+    """
+    try:
+        page_size = min(int(request.GET.get('page_size', settings.LIST_PAGE_SIZE)), settings.LIST_MAX_PAGE_SIZE)
+    except ValueError:
+        page_size = settings.LIST_PAGE_SIZE
+    page_size = max(1, page_size)
+
+    try:
+        page = keyset_paginate(queryset, ordering, request.GET.get('cursor'), page_size)
+    except InvalidCursor:
+        page = keyset_paginate(queryset, ordering, None, page_size)
+
+    # Links to the next and first page keep every other query parameter (the filters)
+    params = request.GET.copy()
+    params.pop('cursor', None)
+    params.pop('format', None)
+    page.first_url = f"?{params.urlencode()}" if params else '?'
+    page.next_url = None
+    if page.has_next:
+        params['cursor'] = page.next_cursor
+        page.next_url = f"?{params.urlencode()}"
+    return page
+
+
+def wants_json(request):
+    return request.GET.get('format') == 'json'
+
+
+def page_json_response(page, serialize):
+    """JSON for infinite scroll: the serialized items and the cursor of the next page"""
+    return JsonResponse({
+        'items': [serialize(item) for item in page.items],
+        'next_cursor': page.next_cursor,
+        'has_next': page.has_next,
+    })
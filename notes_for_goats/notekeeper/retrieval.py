@@ -0,0 +1,168 @@
+"""
+Hybrid retrieval for Ask AI.
+
+Notes and entities are ranked twice: lexically, with bm25 over the full-text
+index (search.py), and semantically, with cosine similarity over their
+embeddings. The rankings are merged with weighted reciprocal rank fusion,
+
+    score(item) = sum over rankings of weight / (settings.HYBRID_RRF_K + rank)
+
+so an item ranked high by either retriever rises, and one ranked high by both
+rises furthest. Fusion only looks at ranks, so bm25 and cosine scores never
+need to be put on the same scale. When one retriever is unavailable (no
+embedding backend, or no FTS5 tables) the other one is used alone.
+
+Long notes are embedded as several chunks. Vector search ranks chunks and
+each note takes its best one, while bm25 ranks whole notes (the full-text
+index mirrors Note rows, not chunks). Notes found only by bm25 are then
+given the chunk that contains the most query words, so that the context
+built for them shows their relevant section as well.
+"""
+import logging
+from collections import defaultdict, namedtuple
+
+import numpy as np
+from django.conf import settings
+
+from .embedding_jobs import note_embedding_chunks
+from .models import EntityEmbedding, Note, NoteEmbedding
+from .search import TERM_PATTERN, ranked_entity_ids, ranked_note_ids, search_available
+from .utils.embedding import generate_embeddings, get_embedding_cache, similarity_search
+from .utils.embedding_backends import get_embedding_backend
+from .vector_index import get_note_index
+
+logger = logging.getLogger(__name__)
+
+# A fused note ranking entry; embedding_id is the best-matching chunk (the
+# nearest one, or for keyword-only matches the one with the most query words)
+RetrievedNote = namedtuple('RetrievedNote', ['note_id', 'score', 'embedding_id'])
+
+
+def reciprocal_rank_fusion(rankings, k=None):
+    """
+    Merge several rankings into one.
+    rankings is a list of (ids best first, weight) pairs. Returns a list of
+    (id, fused score) pairs, best first; ties keep first-seen order.
+    """
+    if k is None:
+        k = settings.HYBRID_RRF_K
+    scores = {}
+    for ids, weight in rankings:
+        if not weight:
+            continue
+        for rank, item_id in enumerate(ids, start=1):
+            scores[item_id] = scores.get(item_id, 0.0) + weight / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def query_vector(query, use_local_llm=False):
+    """
+    Embedding of the query as a float32 array, or None if vector search should
+    not be used. In local LLM mode the query is only embedded by a backend that
+    runs on this machine, so questions are not sent to a remote API.
+    """
+    backend = get_embedding_backend()
+    if not backend.is_available() or (use_local_llm and not backend.runs_locally):
+        return None
+    # Cached, so re-asked questions skip the embedding call
+    query_array = np.asarray(generate_embeddings(query), dtype=np.float32)
+    logger.info(f"Query embedding cache: {get_embedding_cache().stats()}")
+    return query_array
+
+
+def retrieval_available(use_local_llm=False):
+    """True if at least one of the two retrievers can be used"""
+    backend = get_embedding_backend()
+    vectors = backend.is_available() and (backend.runs_locally or not use_local_llm)
+    return vectors or search_available()
+
+
+def retrieve_notes(workspace, query, top_k=5, query_array=None, exclude_note_ids=None):
+    """
+    The top_k workspace notes for query, as RetrievedNotes ranked by fused score.
+    Vector search is skipped when query_array is None.
+    """
+    exclude_note_ids = set(exclude_note_ids or ())
+    depth = max(top_k, settings.HYBRID_CANDIDATES)
+    rankings = []
+
+    embedding_ids = {}
+    if query_array is not None:
+        hits = get_note_index(workspace.id).search(query_array, top_k=depth, exclude_note_ids=exclude_note_ids)
+        rankings.append(([hit.note_id for hit in hits], settings.HYBRID_VECTOR_WEIGHT))
+        embedding_ids = {hit.note_id: hit.embedding_id for hit in hits}
+
+    lexical = [
+        note_id for note_id in ranked_note_ids(workspace.id, query, depth + len(exclude_note_ids))
+        if note_id not in exclude_note_ids
+    ]
+    rankings.append((lexical[:depth], settings.HYBRID_LEXICAL_WEIGHT))
+
+    fused = reciprocal_rank_fusion(rankings)[:top_k]
+    keyword_only = [note_id for note_id, _ in fused if note_id not in embedding_ids]
+    if keyword_only:
+        embedding_ids.update(lexical_sections(keyword_only, query))
+
+    return [
+        RetrievedNote(note_id, score, embedding_ids.get(note_id))
+        for note_id, score in fused
+    ]
+
+
+def lexical_sections(note_ids, query):
+    """
+    {note id: embedding id} of the chunk of each note that contains the most
+    query words (the first such chunk on a tie). Notes with no embeddings,
+    or none of whose chunks contains a query word, are left out.
+    """
+    terms = {term.lower() for term in TERM_PATTERN.findall(query) if len(term) > 1}
+    sections = defaultdict(dict)
+    for note_id, section_index, embedding_id in NoteEmbedding.objects.filter(
+        note_id__in=note_ids
+    ).values_list('note_id', 'section_index', 'id'):
+        sections[note_id][section_index] = embedding_id
+
+    best = {}
+    for note in Note.objects.filter(id__in=[note_id for note_id in sections if len(sections[note_id]) > 1]):
+        # Re-chunk the note the way it was embedded; section_text is truncated
+        best_score = 0
+        for section_index, chunk in enumerate(note_embedding_chunks(note)):
+            if section_index not in sections[note.id]:
+                continue
+            score = sum(word in terms for word in TERM_PATTERN.findall(chunk.lower()))
+            if score > best_score:
+                best_score = score
+                best[note.id] = sections[note.id][section_index]
+    for note_id, by_index in sections.items():
+        if len(by_index) == 1:
+            best[note_id] = next(iter(by_index.values()))
+    return best
+
+
+def similar_entity_ids(workspace, query_array, top_k=5):
+    """
+    Return the ids of the workspace entities whose embeddings are most similar
+    to the query, scoring every entity with a single matrix product
+    """
+    rows = list(EntityEmbedding.objects.filter(
+        entity__workspace=workspace,
+        dimensions=query_array.size
+    ).values_list('entity_id', 'embedding'))
+
+    if not rows:
+        return []
+
+    entity_ids = [entity_id for entity_id, _ in rows]
+    matrix = np.frombuffer(b''.join(bytes(data) for _, data in rows), dtype='<f4').reshape(len(rows), -1)
+    similar_entities = similarity_search(query_array, matrix, top_k=top_k)
+    return [entity_ids[idx] for idx, _ in similar_entities]
+
+
+def retrieve_entities(workspace, query, top_k=5, query_array=None):
+    """IDs of the top_k workspace entities for query, ranked by fused score"""
+    depth = max(top_k, settings.HYBRID_CANDIDATES)
+    rankings = []
+    if query_array is not None:
+        rankings.append((similar_entity_ids(workspace, query_array, top_k=depth), settings.HYBRID_VECTOR_WEIGHT))
+    rankings.append((ranked_entity_ids(workspace.id, query, depth), settings.HYBRID_LEXICAL_WEIGHT))
+    return [entity_id for entity_id, _ in reciprocal_rank_fusion(rankings)[:top_k]]
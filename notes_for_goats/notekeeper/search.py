@@ -0,0 +1,156 @@
+"""
+Full-text search over notes and entities.
+
+On SQLite, migration 0040 creates FTS5 tables that mirror Note.title/content
+and Entity.name/details, kept in sync by triggers. Searches use them for
+ranked (bm25) prefix matching. On other databases, or SQLite builds without
+FTS5, they fall back to icontains filters.
+"""
+import logging
+import re
+
+from django.db import connection
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
+
+logger = logging.getLogger(__name__)
+
+NOTE_SEARCH_TABLE = 'notekeeper_note_fts'
+ENTITY_SEARCH_TABLE = 'notekeeper_entity_fts'
+
+# bm25 column weights: a match in the title/name counts more than one in the body
+NOTE_COLUMN_WEIGHTS = (10.0, 1.0)
+ENTITY_COLUMN_WEIGHTS = (10.0, 1.0)
+
+SEARCH_TABLES = [NOTE_SEARCH_TABLE, ENTITY_SEARCH_TABLE]
+
+TERM_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+# Per-process answer to "do the FTS5 tables exist?"
+_available = None
+
+
+def search_available():
+    """True if the FTS5 search tables exist in the default database"""
+    global _available
+    if _available is None:
+        if connection.vendor != 'sqlite':
+            _available = False
+        else:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name IN (%s, %s)",
+                    SEARCH_TABLES
+                )
+                _available = cursor.fetchone()[0] == len(SEARCH_TABLES)
+            if not _available:
+                logger.warning("Full-text search tables are missing; falling back to LIKE searches")
+    return _available
+
+
+def match_expression(query, match_any=False):
+    """
+    FTS5 MATCH expression for a user's search box text.
+    Every word must appear, each as a whole word or a prefix (so "proj"
+    finds "project"). With match_any, for questions rather than search box
+    text, any whole word may appear and bm25 sorts out the best matches.
+    Words are quoted, so FTS5 operators in user input are treated as plain
+    text. Returns '' if the text has no searchable words.
+    """
+    terms = TERM_PATTERN.findall(query)
+    if match_any:
+        # Single letters match nearly every row without helping the ranking
+        return ' OR '.join(f'"{term}"' for term in terms if len(term) > 1)
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def _match_subquery(table, expression):
+    return RawSQL(f"SELECT rowid FROM {table} WHERE {table} MATCH %s", [expression])
+
+
+def search_notes(notes, query):
+    """
+    Filter a Note queryset to notes matching query, best matches first
+    (then newest first). Falls back to icontains on title and content.
+    Either way the notes are annotated with search_rank, lower is better.
+    """
+    expression = match_expression(query)
+    if not expression or not search_available():
+        # Every match ranks the same, so callers can order on search_rank regardless
+        return notes.filter(Q(title__icontains=query) | Q(content__icontains=query)).annotate(
+            search_rank=Value(0.0, output_field=FloatField())
+        ).order_by('-timestamp')
+
+    # Join the FTS table so SQLite drives the query from the MATCH and scores
+    # every hit in one pass; the ORM has no way to express a virtual table join
+    weights = ', '.join(str(weight) for weight in NOTE_COLUMN_WEIGHTS)
+    return notes.extra(
+        tables=[NOTE_SEARCH_TABLE],
+        where=[f'{NOTE_SEARCH_TABLE}.rowid = notekeeper_note.id', f'{NOTE_SEARCH_TABLE} MATCH %s'],
+        params=[expression],
+    ).annotate(
+        # An annotation rather than an extra select, so list pages can filter on it
+        search_rank=RawSQL(f'bm25({NOTE_SEARCH_TABLE}, {weights})', [], output_field=FloatField())
+    ).order_by('search_rank', '-timestamp')
+
+
+def search_entities(entities, query):
+    """
+    Filter an Entity queryset to entities whose name or details match query,
+    or with a tag containing it, annotated with search_rank (lower is
+    better; bm25, with tag-only matches last). Falls back to icontains on
+    name and details, where every match ranks the same.
+    """
+    expression = match_expression(query)
+    if not expression or not search_available():
+        text_match = Q(name__icontains=query) | Q(details__icontains=query)
+        rank = Value(0.0, output_field=FloatField())
+    else:
+        text_match = Q(id__in=_match_subquery(ENTITY_SEARCH_TABLE, expression))
+        # A correlated subquery rather than a join, as tag matches have no FTS row;
+        # bm25 scores are negative, so their 0.0 sorts after every text match
+        weights = ', '.join(str(weight) for weight in ENTITY_COLUMN_WEIGHTS)
+        rank = Coalesce(RawSQL(
+            f"SELECT bm25({ENTITY_SEARCH_TABLE}, {weights}) FROM {ENTITY_SEARCH_TABLE} "
+            f"WHERE {ENTITY_SEARCH_TABLE} MATCH %s AND {ENTITY_SEARCH_TABLE}.rowid = notekeeper_entity.id",
+            [expression], output_field=FloatField()
+        ), 0.0)
+
+    # Tag names are short and few, so a LIKE over them stays cheap
+    return entities.filter(text_match | Q(tags__name__icontains=query)).distinct().annotate(search_rank=rank)
+
+
+def _ranked_ids(table, source_table, weights, workspace_id, query, limit):
+    expression = match_expression(query, match_any=True)
+    if not expression or not search_available():
+        return []
+
+    weight_list = ', '.join(str(weight) for weight in weights)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT {source_table}.id FROM {table} "
+            f"JOIN {source_table} ON {source_table}.id = {table}.rowid "
+            f"WHERE {table} MATCH %s AND {source_table}.workspace_id = %s "
+            f"ORDER BY bm25({table}, {weight_list}) LIMIT %s",
+            [expression, workspace_id, limit]
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def ranked_note_ids(workspace_id, query, limit):
+    """IDs of the workspace notes sharing the most (rare) words with query, best first"""
+    return _ranked_ids(NOTE_SEARCH_TABLE, 'notekeeper_note', NOTE_COLUMN_WEIGHTS, workspace_id, query, limit)
+
+
+def ranked_entity_ids(workspace_id, query, limit):
+    """IDs of the workspace entities sharing the most (rare) words with query, best first"""
+    return _ranked_ids(ENTITY_SEARCH_TABLE, 'notekeeper_entity', ENTITY_COLUMN_WEIGHTS, workspace_id, query, limit)
+
+
+def rebuild_search_index():
+    """Repopulate the FTS5 tables from the note and entity tables"""
+    with connection.cursor() as cursor:
+        for table in SEARCH_TABLES:
+            cursor.execute(f"INSERT INTO {table}({table}) VALUES('rebuild')")
+            cursor.execute(f"INSERT INTO {table}({table}) VALUES('optimize')")
@@ -1,12 +1,22 @@
-from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.db import transaction
+from django.db.models.signals import post_save, pre_delete, post_delete, m2m_changed
 from django.dispatch import receiver
 from django.utils import timezone
 import time
-from .models import Workspace, Entity, Note, RelationshipType, Relationship, Tag
+from .models import (
+    Workspace, Entity, Note, RelationshipType, Relationship, Tag, EmbeddingJob,
+    link_entity_name_tags, link_note_hashtags
+)
 from .views import create_backup
-from .utils.embedding import generate_embeddings, count_tokens, generate_chunked_embeddings
+from .batching import batch_finished, chunked, current_batch
+from .embedding_jobs import (
+    enqueue_embeddings, enqueue_note_embedding, enqueue_entity_embedding,
+    note_embedding_is_current, entity_embedding_is_current
+)
 from .models import NoteEmbedding, EntityEmbedding
-from django.conf import settings
+from .utils.embedding_backends import embeddings_available
+from .vector_index import index_note_embedding, unindex_note_embedding, delete_note_index, reindex_workspace
+from .adjacency import bump_relationship_version
 import logging
 
 # Keep track of last backup time to prevent too frequent backups
@@ -27,159 +37,152 @@ def backup_on_data_change(sender, instance, **kwargs):
     """
     global _last_backup_time
     
-    current_time = time.time()
-    if current_time - _last_backup_time < _BACKUP_COOLDOWN:
-        return
-    
     model_name = sender.__name__.lower()
     action = 'delete' if kwargs.get('created') is None else ('create' if kwargs.get('created') else 'update')
     reason = f"{model_name}_{action}"
     
+    # A batch backs up once, when it ends
+    batch = current_batch()
+    if batch is not None:
+        batch.backup_reason = batch.backup_reason or reason
+        return
+    
+    current_time = time.time()
+    if current_time - _last_backup_time < _BACKUP_COOLDOWN:
+        return
+    
     create_backup(reason=reason)
     _last_backup_time = current_time 
 
 @receiver(post_save, sender=Note)
 def generate_note_embedding(sender, instance, **kwargs):
-    """Generate and store embeddings when a note is created or updated"""
-    logger.info(f"Signal triggered for note {instance.id}: {instance.title[:30]}...")
+    """Queue an embedding job when a note is created or updated"""
+    # Only queue if the embedding backend can be used (e.g. OpenAI needs an API key)
+    if not embeddings_available():
+        logger.warning(f"Skipping embedding generation - embedding backend not available")
+        return
     
-    # Only generate if we have an OpenAI key (needed for embeddings)
-    if not settings.OPENAI_API_KEY:
-        logger.warning(f"Skipping embedding generation - No OpenAI API key configured")
+    batch = current_batch()
+    if batch is not None:
+        batch.embedding_note_ids.add(instance.id)
         return
-        
-    try:
-        # Check if this is a new note or an update
-        is_new = kwargs.get('created', False)
-        logger.info(f"Processing {'new' if is_new else 'updated'} note {instance.id}")
-        
-        # Combine title and content for better semantic representation
-        text_to_embed = f"{instance.title}\n\n{instance.content}"
-        
-        # First, delete any existing embeddings for this note
-        NoteEmbedding.objects.filter(note=instance).delete()
-        
-        # Check if text exceeds token limit
-        estimated_tokens = count_tokens(text_to_embed)
-        logger.info(f"Note {instance.id} estimated token count: {estimated_tokens}")
-        
-        if estimated_tokens <= 8000:
-            # Standard approach for smaller texts
-            start_time = time.time()
-            embedding_vector = generate_embeddings(text_to_embed)
-            elapsed = time.time() - start_time
-            
-            # Create the embedding
-            NoteEmbedding.objects.create(
-                note=instance,
-                embedding=embedding_vector,
-                section_index=0,
-                section_text=text_to_embed[:1000] if len(text_to_embed) > 1000 else text_to_embed
-            )
-            
-            logger.info(f"Created single embedding for note {instance.id} in {elapsed:.2f}s")
-        else:
-            # For large texts, use chunking
-            logger.info(f"Note {instance.id} exceeds token limit, using chunking")
-            
-            # Generate embeddings for chunks
-            start_time = time.time()
-            chunk_results = generate_chunked_embeddings(text_to_embed)
-            elapsed = time.time() - start_time
-            
-            # Save each chunk embedding
-            for i, (chunk_text, embedding) in enumerate(chunk_results):
-                NoteEmbedding.objects.create(
-                    note=instance,
-                    embedding=embedding,
-                    section_index=i,
-                    section_text=chunk_text[:1000] if len(chunk_text) > 1000 else chunk_text
-                )
-            
-            logger.info(f"Created {len(chunk_results)} chunk embeddings for note {instance.id} in {elapsed:.2f}s")
     
+    try:
+        # Timestamp-only edits and relinking saves leave the embedded text unchanged
+        if note_embedding_is_current(instance):
+            logger.info(f"Embeddings for note {instance.id} are up to date")
+            return
+        enqueue_note_embedding(instance.id)
     except Exception as e:
-        logger.error(f"Error generating embeddings for note {instance.id}: {str(e)}", exc_info=True)
+        logger.error(f"Error queueing embedding for note {instance.id}: {str(e)}", exc_info=True)
 
 @receiver(post_save, sender=Entity)
 def generate_entity_embedding(sender, instance, **kwargs):
-    """Generate and store embeddings when an entity is created or updated"""
-    # Only generate if we have an OpenAI key (needed for embeddings)
-    if not settings.OPENAI_API_KEY:
-        logger.warning(f"Skipping embedding generation for entity {instance.id} - No OpenAI API key")
+    """Queue an embedding job when an entity is created or updated"""
+    # Only queue if the embedding backend can be used (e.g. OpenAI needs an API key)
+    if not embeddings_available():
+        logger.warning(f"Skipping embedding generation for entity {instance.id} - embedding backend not available")
+        return
+    
+    batch = current_batch()
+    if batch is not None:
+        batch.embedding_entity_ids.add(instance.id)
         return
-        
+    
     try:
-        # Combine name, type, and details for better semantic representation
-        text_to_embed = f"{instance.name} - {instance.get_type_display()}"
-        
-        if instance.details:
-            text_to_embed += f"\n\n{instance.details}"
-        
-        # Add tags if available
-        if hasattr(instance, 'tags') and instance.tags.exists():
-            tag_list = ", ".join([tag.name for tag in instance.tags.all()])
-            text_to_embed += f"\n\nTags: {tag_list}"
-        
-        # Skip if there's nothing meaningful to embed
-        if not text_to_embed.strip():
-            logger.warning(f"Skipping embedding for entity {instance.id} - No content to embed")
+        if entity_embedding_is_current(instance):
+            logger.info(f"Embedding for entity {instance.id} is up to date")
             return
-            
-        # Generate embedding
-        logger.info(f"Generating embedding for entity {instance.id}: {instance.name}")
-        try:
-            embedding_vector = generate_embeddings(text_to_embed)
-            
-            # Validate embedding format
-            if not embedding_vector or not isinstance(embedding_vector, list):
-                logger.error(f"Invalid embedding format for entity {instance.id} - got {type(embedding_vector)}")
-                return
-                
-            # Save or update the embedding
-            EntityEmbedding.objects.update_or_create(
-                entity=instance,
-                defaults={'embedding': embedding_vector}
-            )
-            logger.info(f"Successfully saved embedding for entity {instance.id}")
-        except Exception as e:
-            logger.error(f"OpenAI embedding generation failed for entity {instance.id}: {str(e)}")
-            
+        enqueue_entity_embedding(instance.id)
     except Exception as e:
-        logger.error(f"Error generating embedding for entity {instance.id}: {str(e)}", exc_info=True)
+        logger.error(f"Error queueing embedding for entity {instance.id}: {str(e)}", exc_info=True)
 
 # Add a special handler for when relationships change to update related entity embeddings
 @receiver(post_save, sender=Relationship)
 def update_entity_embeddings_on_relationship_change(sender, instance, **kwargs):
     """
-    When relationships change, update embeddings for the related entities
-    to capture relationship context
+    When relationships change, queue embedding updates for the related
+    entities to capture relationship context
     """
-    if not settings.OPENAI_API_KEY:
+    if not embeddings_available():
         return
-        
+    
     try:
-        # Get the source and target entities if they are entities
-        if instance.source_content_type.model == 'entity':
-            entity_id = instance.source_object_id
-            try:
-                entity = Entity.objects.get(id=entity_id)
-                # Using an existing signal to regenerate the embedding
-                generate_entity_embedding(Entity, entity)
-            except Entity.DoesNotExist:
-                pass
-                
-        if instance.target_content_type.model == 'entity':
-            entity_id = instance.target_object_id
-            try:
-                entity = Entity.objects.get(id=entity_id)
-                # Using an existing signal to regenerate the embedding
-                generate_entity_embedding(Entity, entity)
-            except Entity.DoesNotExist:
-                pass
+        # Queue the source and target entities if they are entities
+        entity_ids = [
+            object_id for content_type, object_id in (
+                (instance.source_content_type, instance.source_object_id),
+                (instance.target_content_type, instance.target_object_id),
+            )
+            if content_type.model == 'entity'
+        ]
+        batch = current_batch()
+        if batch is not None:
+            batch.embedding_entity_ids.update(entity_ids)
+            return
+        for entity_id in entity_ids:
+            enqueue_entity_embedding(entity_id)
     except Exception as e:
         logger.error(f"Error updating entity embeddings for relationship {instance.id}: {e}")
 
+@receiver([post_save, post_delete], sender=Relationship)
+def bump_relationship_version_on_change(sender, instance, **kwargs):
+    """Invalidate the cached relationship adjacency of the relationship's workspace"""
+    batch = current_batch()
+    if batch is not None:
+        batch.relationship_workspace_ids.add(instance.workspace_id)
+        return
+    
+    bump_relationship_version([instance.workspace_id])
+
+@receiver(post_save, sender=NoteEmbedding)
+def update_vector_index_on_embedding_save(sender, instance, **kwargs):
+    """Keep the workspace's vector index in step with saved embeddings"""
+    batch = current_batch()
+    if batch is not None:
+        batch.index_workspace_ids.add(instance.note.workspace_id)
+        return
+    
+    def index():
+        try:
+            index_note_embedding(instance)
+        except Exception as e:
+            logger.error(f"Error indexing note embedding {instance.id}: {e}")
+    
+    # A rolled back write must not leave its vectors in the index
+    transaction.on_commit(index)
+
+@receiver(pre_delete, sender=NoteEmbedding)
+def remember_embedding_workspace(sender, instance, origin=None, **kwargs):
+    """Note the workspace of an embedding about to be deleted, while its note still exists"""
+    if isinstance(origin, Note):
+        instance.index_workspace_id = origin.workspace_id
+    elif isinstance(origin, Workspace):
+        instance.index_workspace_id = origin.id
+    else:
+        instance.index_workspace_id = Note.objects.filter(
+            id=instance.note_id
+        ).values_list('workspace_id', flat=True).first()
+
+@receiver(post_delete, sender=NoteEmbedding)
+def update_vector_index_on_embedding_delete(sender, instance, **kwargs):
+    """Tombstone deleted embeddings in the vector index"""
+    workspace_id = getattr(instance, 'index_workspace_id', None)
+    if workspace_id is None:
+        return
+    
+    batch = current_batch()
+    if batch is not None:
+        batch.index_workspace_ids.add(workspace_id)
+        return
+    
+    unindex_note_embedding(workspace_id, instance.id)
+
+@receiver(post_delete, sender=Workspace)
+def drop_vector_index_on_workspace_delete(sender, instance, **kwargs):
+    """Remove the vector index files of a deleted workspace"""
+    delete_note_index(instance.id)
+
 @receiver(post_delete, sender=NoteEmbedding)
 @receiver(post_delete, sender=EntityEmbedding)
 def log_embedding_deletion(sender, instance, **kwargs):
@@ -199,27 +202,61 @@ def handle_user_preference_change(sender, instance, **kwargs):
     pass
 
 @receiver(m2m_changed, sender=Note.tags.through)
-def update_note_entity_relationships(sender, instance, action, pk_set, **kwargs):
-    """Update entity references when a note's tags change"""
-    if action in ["post_add", "post_remove", "post_clear"]:
-        # Get the note
-        note = instance
-        
-        # Update entity references based on current tags
-        if hasattr(note, 'tags'):
-            # Get all entities that share tags with this note
-            shared_tag_entities = []
-            for tag in note.tags.all():
-                for entity in tag.tagged_entities.all():
-                    if entity not in shared_tag_entities:
-                        shared_tag_entities.append(entity)
-            
-            # Update note's referenced entities to include those with shared tags
-            if shared_tag_entities:
-                # Add these entities to the note's referenced_entities without removing existing ones
-                for entity in shared_tag_entities:
-                    note.referenced_entities.add(entity)
+def update_note_entity_relationships(sender, instance, action, pk_set, reverse, **kwargs):
+    """Reference the entities that share a note's newly added tags"""
+    # Removing tags never removes references, so only additions need work
+    if action != "post_add" or not pk_set:
+        return
+    
+    batch = current_batch()
+    if batch is not None:
+        batch.relink_note_ids.update(pk_set if reverse else [instance.pk])
+        return
+    
+    if reverse:
+        # tag.tagged_notes.add(...): instance is the tag, pk_set the notes
+        Tag.objects.filter(pk=instance.pk).update_relationships(note_ids=list(pk_set))
+    else:
+        Tag.objects.filter(pk__in=pk_set).update_relationships(note_ids=[instance.pk])
 
+@receiver(batch_finished)
+def run_deferred_side_effects(sender, batch, **kwargs):
+    """Run the side effects recorded by a deferred_side_effects() block, once and in bulk"""
+    global _last_backup_time
+    
+    for entity_ids in chunked(batch.name_tag_entity_ids):
+        link_entity_name_tags(list(Entity.objects.filter(pk__in=entity_ids)))
+    for note_ids in chunked(batch.hashtag_note_ids):
+        link_note_hashtags(list(Note.objects.filter(pk__in=note_ids)))
+    # Hashtag resolution already relinked the notes it handled
+    for note_ids in chunked(batch.relink_note_ids - batch.hashtag_note_ids):
+        Tag.objects.all().update_relationships(note_ids=note_ids)
+    
+    # Queued without the per-object "is it current?" check; the worker
+    # leaves unchanged text alone
+    if batch.embedding_note_ids or batch.embedding_entity_ids:
+        if embeddings_available():
+            enqueue_embeddings(EmbeddingJob.OBJECT_NOTE, batch.embedding_note_ids)
+            enqueue_embeddings(EmbeddingJob.OBJECT_ENTITY, batch.embedding_entity_ids)
+    
+    if batch.relationship_workspace_ids:
+        bump_relationship_version(batch.relationship_workspace_ids)
+    
+    for workspace_id in batch.index_workspace_ids:
+        try:
+            reindex_workspace(workspace_id)
+        except Exception as e:
+            logger.error(f"Error rebuilding the vector index of workspace {workspace_id}: {e}")
+    
+    if batch.backup_reason:
+        create_backup(reason=f"batch_{batch.backup_reason}")
+        _last_backup_time = time.time()
+    
+    logger.info(
+        f"Ran deferred side effects: {len(batch.hashtag_note_ids)} notes, "
+        f"{len(batch.name_tag_entity_ids)} entities, {len(batch.index_workspace_ids)} vector indexes"
+    )
+    
 def ready():
     """Function to be called when the app is ready to ensure signals are connected"""
     logger.info("Notekeeper signals registered successfully")
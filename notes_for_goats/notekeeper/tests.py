@@ -1,3 +1,529 @@
-from django.test import TestCase
+import datetime
+import os
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import adjacency
+from .adjacency import WorkspaceAdjacency, relationships_of, workspace_adjacency
+from .inference import composed_pairs, transitive_pairs
+from .models import Entity, Note, NoteEmbedding, Relationship, RelationshipType, Tag, Workspace
+from .pagination import InvalidCursor, decode_cursor, encode_cursor, keyset_paginate, paginate_request
+from .retrieval import lexical_sections, reciprocal_rank_fusion
+from .utils.embedding import batch_similarity_search, quantize_rows, similarity_search
+from .vector_index import NoteVectorIndex, get_note_index, invalidate_note_index
+
+
+class PackEmbeddingsMigrationTests(TransactionTestCase):
+    """Migration 0036 rewrites JSON embedding lists as packed float32 blobs, and back"""
+
+    before = [('notekeeper', '0035_embedding_blob_and_more')]
+    after = [('notekeeper', '0036_pack_embeddings_to_float32')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def create_embeddings(self, apps):
+        workspace = apps.get_model('notekeeper', 'Workspace').objects.create(name='Herd')
+        note = apps.get_model('notekeeper', 'Note').objects.create(workspace=workspace, title='Grazing', content='Hay')
+        entity = apps.get_model('notekeeper', 'Entity').objects.create(workspace=workspace, name='Billy', type='PERSON')
+        NoteEmbedding = apps.get_model('notekeeper', 'NoteEmbedding')
+        EntityEmbedding = apps.get_model('notekeeper', 'EntityEmbedding')
+        return (
+            NoteEmbedding.objects.create(note=note, section_index=0, embedding=[0.5, -1.25, 3.0]),
+            NoteEmbedding.objects.create(note=note, section_index=1, embedding=None),
+            EntityEmbedding.objects.create(entity=entity, embedding=[1.0, 2.0]),
+        )
+
+    def test_forward_packs_little_endian_float32(self):
+        apps = self.migrate(self.before)
+        note_embedding, empty_embedding, entity_embedding = self.create_embeddings(apps)
+
+        apps = self.migrate(self.after)
+        NoteEmbedding = apps.get_model('notekeeper', 'NoteEmbedding')
+        EntityEmbedding = apps.get_model('notekeeper', 'EntityEmbedding')
+
+        packed = NoteEmbedding.objects.get(pk=note_embedding.pk)
+        self.assertEqual(bytes(packed.embedding_blob), np.array([0.5, -1.25, 3.0], dtype='<f4').tobytes())
+        self.assertEqual(packed.dimensions, 3)
+
+        empty = NoteEmbedding.objects.get(pk=empty_embedding.pk)
+        self.assertEqual(bytes(empty.embedding_blob), b'')
+        self.assertEqual(empty.dimensions, 0)
+
+        packed = EntityEmbedding.objects.get(pk=entity_embedding.pk)
+        self.assertEqual(np.frombuffer(bytes(packed.embedding_blob), dtype='<f4').tolist(), [1.0, 2.0])
+        self.assertEqual(packed.dimensions, 2)
+
+    def test_backward_restores_json_lists(self):
+        apps = self.migrate(self.before)
+        note_embedding, _, entity_embedding = self.create_embeddings(apps)
+        self.migrate(self.after)
+
+        apps = self.migrate(self.before)
+        self.assertEqual(
+            apps.get_model('notekeeper', 'NoteEmbedding').objects.get(pk=note_embedding.pk).embedding,
+            [0.5, -1.25, 3.0]
+        )
+        self.assertEqual(
+            apps.get_model('notekeeper', 'EntityEmbedding').objects.get(pk=entity_embedding.pk).embedding,
+            [1.0, 2.0]
+        )
+
+
+class SimilaritySearchTests(SimpleTestCase):
+    matrix = np.array([[1, 0], [0, 1], [0, 0], [3, 3]], dtype=np.float32)
+
+    def test_ranks_by_cosine_similarity(self):
+        results = batch_similarity_search([[1, 0], [0, 2]], self.matrix, top_k=2)
+        self.assertEqual([index for index, _ in results[0]], [0, 3])
+        self.assertEqual([index for index, _ in results[1]], [1, 3])
+        self.assertAlmostEqual(results[0][1][1], np.sqrt(0.5), places=6)
+
+    def test_orthogonal_rows_are_kept_and_zero_rows_skipped(self):
+        results = batch_similarity_search([[1, 0]], self.matrix, top_k=4)[0]
+        self.assertEqual([index for index, _ in results], [0, 3, 1])
+        self.assertEqual(results[-1][1], 0.0)
+
+    def test_zero_query_matches_nothing(self):
+        self.assertEqual(batch_similarity_search([[0, 0]], self.matrix), [[]])
+
+    def test_list_input_keeps_original_positions(self):
+        embeddings = [[0, 1], None, [1, 2, 3], [1, 0]]
+        self.assertEqual([index for index, _ in similarity_search([1, 0], embeddings)], [3, 0])
+
+
+class TemporaryIndexDirMixin:
+    """Keeps vector index files in a temporary directory"""
+
+    def setUp(self):
+        super().setUp()
+        self.index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.index_dir, ignore_errors=True)
+        settings_override = override_settings(VECTOR_INDEX_DIR=self.index_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        invalidate_note_index()
+        self.addCleanup(invalidate_note_index)
+
+
+class NoteVectorIndexTests(TemporaryIndexDirMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.index = NoteVectorIndex(1, directory=self.index_dir)
+        self.index.upsert(10, 1, 0, [1, 0, 0])
+        self.index.upsert(11, 2, 0, [0, 1, 0])
+        self.index.upsert(12, 2, 1, [0, 0.9, 0.1])
+
+    def search(self, vector, **kwargs):
+        return [(hit.note_id, hit.embedding_id) for hit in self.index.search(np.array(vector, dtype=np.float32), **kwargs)]
+
+    def test_search_returns_each_note_once_by_its_best_chunk(self):
+        self.assertTrue(self.index.exists())
+        self.assertEqual(len(self.index), 3)
+        self.assertEqual(self.search([0, 1, 0.2]), [(2, 12)])
+        self.assertEqual(self.search([1, 1, 0]), [(1, 10), (2, 11)])
+        self.assertEqual(self.search([1, 1, 0], exclude_note_ids={1}), [(2, 11)])
+
+    def test_remove_tombstones_rows(self):
+        self.assertEqual(self.index.remove([11, 99]), 1)
+        self.assertEqual(self.index.remove([11]), 0)
+        self.assertEqual(self.index.stats['tombstones'], 1)
+        self.assertEqual(self.search([0, 1, 0]), [(2, 12)])
+
+    def test_upsert_replaces_the_previous_vector(self):
+        self.index.upsert(10, 1, 0, [0, 0, 1])
+        self.assertEqual(self.index.stats['count'], 4)
+        self.assertEqual(self.index.stats['tombstones'], 1)
+        self.assertEqual(self.search([0, 0, 1], exclude_note_ids={2}), [(1, 10)])
+        self.assertEqual(self.search([1, 0, 0]), [])
+
+    def test_upsert_skips_vectors_of_other_dimensions(self):
+        self.index.upsert(13, 3, 0, [1, 0])
+        self.assertEqual(len(self.index), 3)
+
+    def test_compact_drops_tombstones_and_keeps_results(self):
+        self.index.remove([11])
+        before = self.search([0, 1, 0.5])
+        self.assertEqual(self.index.compact(), 1)
+        self.assertEqual(self.index.stats['count'], 2)
+        self.assertEqual(self.index.stats['tombstones'], 0)
+        self.assertEqual(self.index.stats['generation'], 2)
+        self.assertEqual(self.search([0, 1, 0.5]), before)
+        self.assertEqual(self.index.compact(), 0)
+
+    def test_grows_past_its_capacity(self):
+        rng = np.random.default_rng(0)
+        for embedding_id in range(100, 200):
+            self.index.upsert(embedding_id, embedding_id, 0, rng.normal(size=3))
+        self.assertEqual(len(self.index), 103)
+        self.assertGreaterEqual(self.index.stats['capacity'], 103)
+        self.assertEqual(self.search([1, 0, 0], top_k=1, exact=True), [(1, 10)])
+
+
+class NoteIndexSignalTests(TemporaryIndexDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.workspace = Workspace.objects.create(name='Herd')
+        self.note = Note.objects.create(workspace=self.workspace, title='Grazing', content='Hay')
+        for section_index in range(3):
+            self.embed(self.note, section_index, [1, section_index, 0])
+        self.index = get_note_index(self.workspace.id)
+
+    def embed(self, note, section_index, vector):
+        embedding = NoteEmbedding(note=note, section_index=section_index)
+        embedding.set_vector(vector)
+        embedding.save()
+        return embedding
+
+    def test_saved_embeddings_are_indexed_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.embed(self.note, 3, [0, 0, 1])
+        self.assertEqual(len(self.index), 3)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(len(self.index), 4)
+
+    def test_deleting_a_note_tombstones_its_chunks_once_committed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.note.delete()
+        stats = self.index.stats
+        self.assertEqual((stats['count'], stats['tombstones']), (3, 3))
+
+
+class QuantizeRowsTests(SimpleTestCase):
+    def test_rows_scale_to_the_int8_range(self):
+        quantized, scales = quantize_rows([[1, -2, 0.5], [0, 0, 0]])
+        self.assertEqual(quantized.dtype, np.int8)
+        self.assertEqual(quantized.tolist(), [[64, -127, 32], [0, 0, 0]])
+        self.assertAlmostEqual(float(scales[0]), 2 / 127)
+        self.assertEqual(float(scales[1]), 0.0)
+
+    def test_round_trip_error_is_within_half_a_step(self):
+        matrix = np.random.default_rng(0).normal(size=(50, 16)).astype(np.float32)
+        quantized, scales = quantize_rows(matrix)
+        error = np.abs(quantized * scales[:, None] - matrix)
+        self.assertTrue((error <= scales[:, None] / 2 + 1e-6).all())
+
+    def test_empty_matrix(self):
+        quantized, scales = quantize_rows(np.empty((0, 4), dtype=np.float32))
+        self.assertEqual(quantized.shape, (0, 4))
+        self.assertEqual(scales.shape, (0,))
+
+
+class QuantizedSearchTests(TemporaryIndexDirMixin, SimpleTestCase):
+    @override_settings(VECTOR_INDEX_RESCORE=20)
+    def test_quantized_search_matches_exact_search(self):
+        rng = np.random.default_rng(1)
+        index = NoteVectorIndex(1, directory=self.index_dir)
+        for embedding_id in range(300):
+            index.upsert(embedding_id, embedding_id, 0, rng.normal(size=32))
+        for query in rng.normal(size=(5, 32)).astype(np.float32):
+            exact = index.search(query, top_k=5, exact=True, quantized=False)
+            quantized = index.search(query, top_k=5, exact=True, quantized=True)
+            self.assertEqual([hit.note_id for hit in quantized], [hit.note_id for hit in exact])
+            self.assertEqual([hit.similarity for hit in quantized], [hit.similarity for hit in exact])
+        self.assertTrue(os.path.exists(index._quantized_paths(index.stats['generation'])[0]))
+
+
+class ReciprocalRankFusionTests(SimpleTestCase):
+    def test_scores_sum_weighted_reciprocal_ranks(self):
+        fused = dict(reciprocal_rank_fusion([(['a', 'b'], 1.0), (['b', 'c'], 2.0)], k=10))
+        self.assertAlmostEqual(fused['a'], 1 / 11)
+        self.assertAlmostEqual(fused['b'], 1 / 12 + 2 / 11)
+        self.assertAlmostEqual(fused['c'], 2 / 12)
+
+    def test_items_ranked_by_both_rise_to_the_top(self):
+        fused = reciprocal_rank_fusion([(['a', 'b', 'c'], 1.0), (['c', 'b', 'd'], 1.0)], k=60)
+        self.assertEqual([item for item, _ in fused], ['c', 'b', 'a', 'd'])
+
+    def test_zero_weight_disables_a_ranking(self):
+        fused = reciprocal_rank_fusion([(['a'], 0), (['b'], 1.0)], k=60)
+        self.assertEqual([item for item, _ in fused], ['b'])
+
+    def test_ties_keep_first_seen_order(self):
+        fused = reciprocal_rank_fusion([(['x'], 1.0), (['y'], 1.0)], k=60)
+        self.assertEqual([item for item, _ in fused], ['x', 'y'])
+
+
+class LexicalSectionsTests(TestCase):
+    def setUp(self):
+        workspace = Workspace.objects.create(name='Herd')
+        self.long_note = Note.objects.create(workspace=workspace, title='Long', content='x')
+        self.short_note = Note.objects.create(workspace=workspace, title='Short', content='zebra')
+        self.sections = [self.embed(self.long_note, i) for i in range(3)]
+        self.short_section = self.embed(self.short_note, 0)
+
+    def embed(self, note, section_index):
+        embedding = NoteEmbedding(note=note, section_index=section_index)
+        embedding.set_vector([1.0, 0.0])
+        embedding.save()
+        return embedding
+
+    def test_picks_the_chunk_with_the_most_query_words(self):
+        chunks = ['goats graze', 'a zebra migrates', 'zebra herds and zebra foals']
+        with mock.patch('notekeeper.retrieval.note_embedding_chunks', return_value=chunks):
+            best = lexical_sections([self.long_note.id, self.short_note.id], 'Where does a zebra go?')
+        self.assertEqual(best, {self.long_note.id: self.sections[2].id, self.short_note.id: self.short_section.id})
+
+    def test_leaves_out_notes_without_matching_chunks(self):
+        with mock.patch('notekeeper.retrieval.note_embedding_chunks', return_value=['a', 'b', 'c']):
+            self.assertEqual(lexical_sections([self.long_note.id], 'zebra'), {})
+
+
+class KeysetPaginationTests(TestCase):
+    ordering = ['-timestamp', '-id']
+
+    def setUp(self):
+        workspace = Workspace.objects.create(name='Herd')
+        start = timezone.now()
+        # Several notes share each timestamp, down to the microsecond
+        for i in range(23):
+            Note.objects.create(
+                workspace=workspace, title=f'Note {i}', content='',
+                timestamp=start - datetime.timedelta(microseconds=i // 3)
+            )
+        self.notes = Note.objects.filter(workspace=workspace)
+
+    def test_cursor_round_trip(self):
+        values = [timezone.now(), 42, 'goat']
+        decoded = decode_cursor(encode_cursor(values))
+        self.assertEqual(decoded, [values[0].isoformat(), 42, 'goat'])
+        self.assertNotIn('=', encode_cursor(values))
+
+    def test_pages_cover_every_row_once_in_order(self):
+        expected = list(self.notes.order_by(*self.ordering).values_list('id', flat=True))
+        seen, cursor, pages = [], None, 0
+        while True:
+            page = keyset_paginate(self.notes, self.ordering, cursor, page_size=5)
+            seen.extend(note.id for note in page)
+            pages += 1
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        self.assertEqual(seen, expected)
+        self.assertEqual(pages, 5)
+
+    def test_rows_added_before_the_cursor_do_not_shift_later_pages(self):
+        first = keyset_paginate(self.notes, self.ordering, page_size=5)
+        second = keyset_paginate(self.notes, self.ordering, first.next_cursor, page_size=5)
+        Note.objects.create(workspace=self.notes.first().workspace, title='New', content='', timestamp=timezone.now())
+        again = keyset_paginate(self.notes, self.ordering, first.next_cursor, page_size=5)
+        self.assertEqual([note.id for note in again], [note.id for note in second])
+
+    def test_bad_cursors_are_rejected(self):
+        for cursor in ['not base64!', encode_cursor({'a': 1}), encode_cursor([1]), encode_cursor(['yesterday', 1])]:
+            with self.assertRaises(InvalidCursor):
+                keyset_paginate(self.notes, self.ordering, cursor)
+
+    def test_request_keeps_filters_and_restarts_on_a_bad_cursor(self):
+        request = RequestFactory().get('/notes/', {'q': 'hay', 'page_size': '10', 'cursor': 'garbage', 'format': 'json'})
+        page = paginate_request(request, self.notes, self.ordering)
+        self.assertTrue(page.is_first)
+        self.assertEqual(len(page), 10)
+        self.assertEqual(page.first_url, '?q=hay&page_size=10')
+        self.assertEqual(page.next_url, f'?q=hay&page_size=10&cursor={page.next_cursor}')
+
+
+class NoteListSearchTests(TestCase):
+    def setUp(self):
+        self.workspace = Workspace.objects.create(name='Herd')
+        self.note = Note.objects.create(workspace=self.workspace, title='Goat pen', content='Fix the gate - again')
+        self.url = reverse('notekeeper:note_list', kwargs={'workspace_id': self.workspace.id})
+
+    def titles(self, query):
+        response = self.client.get(self.url, {'q': query, 'format': 'json'})
+        self.assertEqual(response.status_code, 200)
+        return [item['title'] for item in response.json()['items']]
+
+    def test_punctuation_only_query(self):
+        # No words for full-text search, so it falls back to icontains
+        self.assertEqual(self.titles('-'), ['Goat pen'])
+        self.assertEqual(self.titles('?!'), [])
+
+    def test_search_without_fts_tables(self):
+        with mock.patch('notekeeper.search.search_available', return_value=False):
+            self.assertEqual(self.titles('gate'), ['Goat pen'])
+
+
+class EntityListSearchTests(TestCase):
+    def setUp(self):
+        self.workspace = Workspace.objects.create(name='Herd')
+        self.url = reverse('notekeeper:entity_list', kwargs={'workspace_id': self.workspace.id})
+        for name, entity_type, details in [
+            ('Alice', 'PERSON', 'Keeps the goat records'),
+            ('Goat Whisperer', 'PERSON', ''),
+            ('Bob', 'PERSON', 'Mends fences'),
+            ('Goat Census', 'PROJECT', ''),
+        ]:
+            Entity.objects.create(workspace=self.workspace, name=name, type=entity_type, details=details)
+        tag = Tag.objects.create(workspace=self.workspace, name='goatherds')
+        Entity.objects.get(name='Bob').tags.add(tag)
+
+    def names(self, query, page_size=10):
+        names, cursor = [], None
+        while True:
+            params = {'q': query, 'format': 'json', 'page_size': page_size}
+            if cursor:
+                params['cursor'] = cursor
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 200)
+            names.extend(item['name'] for item in response.json()['items'])
+            cursor = response.json()['next_cursor']
+            if not cursor:
+                return names
+
+    def test_matches_ranked_within_each_type(self):
+        # Name matches outrank details matches, and tag-only matches come last
+        expected = ['Goat Whisperer', 'Alice', 'Bob', 'Goat Census']
+        self.assertEqual(self.names('goat'), expected)
+        self.assertEqual(self.names('goat', page_size=1), expected)
+
+    def test_search_without_fts_tables(self):
+        with mock.patch('notekeeper.search.search_available', return_value=False):
+            self.assertEqual(self.names('goat'), ['Alice', 'Bob', 'Goat Whisperer', 'Goat Census'])
+
+
+class InferencePairTests(SimpleTestCase):
+    # Steps map an entity to its (next entity, relationship id) pairs
+    chain = {1: [(2, 'a')], 2: [(3, 'b')], 3: [(4, 'c')]}
+
+    def test_transitive_pairs_follow_chains(self):
+        pairs, limited = transitive_pairs(self.chain, max_depth=3, limit=100)
+        self.assertFalse(limited)
+        self.assertEqual(pairs, {
+            (1, 3): (2, {'a', 'b'}),
+            (2, 4): (3, {'b', 'c'}),
+            (1, 4): (3, {'a', 'b', 'c'}),
+        })
+
+    def test_transitive_pairs_stop_at_max_depth(self):
+        pairs, _ = transitive_pairs(self.chain, max_depth=2, limit=100)
+        self.assertEqual(set(pairs), {(1, 3), (2, 4)})
+
+    def test_transitive_pairs_skip_direct_pairs_and_cycles(self):
+        steps = {1: [(2, 'a'), (3, 'd')], 2: [(3, 'b'), (1, 'x')], 3: [(4, 'c')]}
+        pairs, _ = transitive_pairs(steps, max_depth=3, limit=100)
+        # 1 -> 3 is already a step, and paths back to their start are dropped
+        self.assertNotIn((1, 3), pairs)
+        self.assertNotIn((1, 1), pairs)
+        self.assertNotIn((2, 2), pairs)
+        # The path to 4 goes through the shortest way to 3
+        self.assertEqual(pairs[(1, 4)], (3, {'d', 'c'}))
+        self.assertEqual(pairs[(2, 4)], (3, {'b', 'c'}))
+
+    def test_transitive_pairs_limit(self):
+        pairs, limited = transitive_pairs(self.chain, max_depth=3, limit=1)
+        self.assertTrue(limited)
+        self.assertEqual(list(pairs), [(1, 3)])
+
+    def test_composed_pairs_collect_every_path(self):
+        first = {1: [(2, 'a'), (3, 'b')], 5: [(2, 'f')]}
+        second = {2: [(4, 'c')], 3: [(4, 'd'), (1, 'e')]}
+        pairs, limited = composed_pairs(first, second, limit=100)
+        self.assertFalse(limited)
+        self.assertEqual(pairs, {(1, 4): (2, {'a', 'b', 'c', 'd'}), (5, 4): (2, {'f', 'c'})})
+
+        pairs, limited = composed_pairs(first, second, limit=1)
+        self.assertTrue(limited)
+        self.assertEqual(list(pairs), [(1, 4)])
+
+
+class WorkspaceAdjacencyTests(SimpleTestCase):
+    def setUp(self):
+        # (relationship id, source, target, type), in id order
+        self.adjacency = WorkspaceAdjacency(1, 0, [
+            (10, 5, 7, 1),
+            (11, 7, 5, 2),
+            (12, 5, 9, 1),
+            (13, 9, 7, 2),
+            (14, 5, 7, 2),
+        ])
+
+    def ids(self, positions):
+        return self.adjacency.relationship_ids[positions].tolist()
+
+    def test_outgoing_and_incoming_in_id_order(self):
+        self.assertEqual(self.ids(self.adjacency.outgoing(5)), [10, 12, 14])
+        self.assertEqual(self.ids(self.adjacency.incoming(7)), [10, 13, 14])
+        self.assertEqual(self.ids(self.adjacency.outgoing(9)), [13])
+        self.assertEqual(self.ids(self.adjacency.incoming(9)), [12])
+
+    def test_unknown_entities_have_no_relationships(self):
+        for entity_id in (1, 6, 100):
+            self.assertEqual(len(self.adjacency.outgoing(entity_id)), 0)
+            self.assertEqual(len(self.adjacency.incoming(entity_id)), 0)
+
+    def test_touching(self):
+        self.assertEqual(self.ids(self.adjacency.touching([5, 9])), [10, 11, 12, 13, 14])
+        self.assertEqual(self.ids(self.adjacency.touching([9], [2])), [13])
+        self.assertEqual(self.ids(self.adjacency.touching([])), [])
+
+    def test_related_and_endpoint_ids(self):
+        self.assertEqual(self.adjacency.related_ids(7, 2), [5, 9])
+        self.assertEqual(self.adjacency.related_ids(5, 1), [])
+        self.assertEqual(self.adjacency.related_ids(5, 1, either_direction=True), [7, 9])
+        self.assertEqual(self.adjacency.endpoint_ids(1), [7, 9])
+        self.assertEqual(self.adjacency.endpoint_ids(1, sources=True), [5, 7, 9])
+
+    def test_empty_workspace(self):
+        empty = WorkspaceAdjacency(1, 0, [])
+        self.assertEqual(len(empty), 0)
+        self.assertEqual(len(empty.touching([1])), 0)
+        self.assertEqual(empty.endpoint_ids(1, sources=True), [])
+
+
+class WorkspaceAdjacencyCacheTests(TransactionTestCase):
+    def setUp(self):
+        adjacency._adjacencies.clear()
+        self.workspace = Workspace.objects.create(name='Herd')
+        self.a, self.b, self.c = [
+            Entity.objects.create(workspace=self.workspace, name=name, type='PERSON')
+            for name in ('Alice', 'Bob', 'Carol')
+        ]
+        self.knows = RelationshipType.objects.create(workspace=self.workspace, name='knows', display_name='Knows')
+
+    def tearDown(self):
+        adjacency._adjacencies.clear()
+
+    def relate(self, source, target):
+        entity_type = ContentType.objects.get_for_model(Entity)
+        return Relationship.objects.create(
+            workspace=self.workspace, relationship_type=self.knows,
+            source_content_type=entity_type, source_object_id=source.id,
+            target_content_type=entity_type, target_object_id=target.id,
+        )
+
+    def test_changes_bump_the_version_and_rebuild(self):
+        first = self.relate(self.a, self.b)
+        cached = workspace_adjacency(self.workspace.id)
+        self.assertIs(workspace_adjacency(self.workspace.id), cached)
+
+        second = self.relate(self.c, self.a)
+        rebuilt = workspace_adjacency(self.workspace.id)
+        self.assertGreater(rebuilt.version, cached.version)
+        self.assertEqual(rebuilt.relationship_ids.tolist(), [first.id, second.id])
+
+        first.delete()
+        self.assertEqual(workspace_adjacency(self.workspace.id).relationship_ids.tolist(), [second.id])
+
+    def test_relationships_of(self):
+        first = self.relate(self.a, self.b)
+        second = self.relate(self.c, self.a)
+        related = relationships_of(self.workspace.id, [self.a.id, self.b.id])
+        self.assertEqual(related[self.a.id], ([first], [second]))
+        self.assertEqual(related[self.b.id], ([], [first]))
@@ -0,0 +1,108 @@
+import numpy as np
+
+# Rows scored against the centroids at a time when assigning lists
+ASSIGN_BLOCK_SIZE = 8192
+
+# Training rows drawn per list; k-means runs on a sample, not the full matrix
+TRAINING_ROWS_PER_LIST = 32
+
+def default_list_count(row_count):
+    """
+    Number of inverted lists for a matrix of row_count vectors (about sqrt(N))
+    """
+    return max(1, int(round(np.sqrt(row_count))))
+
+def assign_lists(matrix, centroids, block_size=ASSIGN_BLOCK_SIZE):
+    """
+    Return the index of the most similar centroid for every row of matrix.
+    Rows are scored in blocks so memory stays bounded on large matrices.
+    """
+    assignments = np.empty(len(matrix), dtype=np.int32)
+    for start in range(0, len(matrix), block_size):
+        block = np.asarray(matrix[start:start + block_size], dtype=np.float32)
+        assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+def train_centroids(matrix, n_lists, iterations=10, seed=0):
+    """
+    Spherical k-means over unit-length rows.
+    Trains on a random sample of the matrix and returns n_lists unit-length
+    centroids; lists that end up empty are reseeded from random sample rows.
+    """
+    rng = np.random.default_rng(seed)
+    row_count = len(matrix)
+    n_lists = min(n_lists, row_count)
+
+    sample_size = min(row_count, n_lists * TRAINING_ROWS_PER_LIST)
+    sample_rows = np.sort(rng.choice(row_count, size=sample_size, replace=False))
+    sample = np.asarray(matrix[sample_rows], dtype=np.float32)
+
+    centroids = sample[rng.choice(sample_size, size=n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = assign_lists(sample, centroids)
+
+        # Sum the members of each list in one pass
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        counts = np.bincount(assignments, minlength=n_lists)
+
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = sample[rng.choice(sample_size, size=int(empty.sum()), replace=False)]
+
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        centroids = sums / norms
+
+    return centroids
+
+class IVFIndex:
+    """
+    Inverted-file index: every row belongs to the list of its nearest centroid,
+    and a query only scans the rows of its nprobe nearest lists.
+    The index stores list assignments only; vectors stay in the caller's matrix.
+    """
+
+    def __init__(self, centroids, assignments):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.assignments = np.asarray(assignments, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.assignments)
+
+    @property
+    def list_count(self):
+        return len(self.centroids)
+
+    @classmethod
+    def train(cls, matrix, n_lists=None, iterations=10, seed=0):
+        """Train centroids on a unit-length matrix and assign every row to a list"""
+        if not n_lists:
+            n_lists = default_list_count(len(matrix))
+        centroids = train_centroids(matrix, n_lists, iterations=iterations, seed=seed)
+        return cls(centroids, assign_lists(matrix, centroids))
+
+    def add(self, matrix):
+        """Assign rows appended after training to their nearest existing list"""
+        if len(matrix):
+            self.assignments = np.concatenate([self.assignments, assign_lists(matrix, self.centroids)])
+
+    def candidates(self, query, nprobe):
+        """Row positions in the nprobe lists whose centroids are nearest to query"""
+        nprobe = min(max(1, nprobe), self.list_count)
+        centroid_scores = self.centroids @ query
+        if nprobe < self.list_count:
+            probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        else:
+            probe = np.arange(self.list_count)
+        return np.flatnonzero(np.isin(self.assignments, probe))
+
+    def save(self, path):
+        # Write through a file object so numpy does not append another .npz suffix
+        with open(path, 'wb') as f:
+            np.savez(f, centroids=self.centroids, assignments=self.assignments)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['centroids'], data['assignments'])
@@ -1,16 +1,230 @@
 import numpy as np
-from openai import OpenAI
 from django.conf import settings
+from django.core.cache import caches
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import hashlib
 import re
+import threading
+import time
+import unicodedata
+from .embedding_backends import get_embedding_backend
+
+# Model of vectors stored before backends were configurable (OpenAI)
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+# Stored vectors are packed little-endian float32
+EMBEDDING_DTYPE = np.dtype('<f4')
+
+def current_model():
+    """Model name of the configured embedding backend, stored with every vector"""
+    return get_embedding_backend().model_name
+
+class EmbeddingCache:
+    """
+    Bounded LRU cache of text -> embedding vector with a time-to-live.
+    Keys combine the model name and a hash of the normalized text. When
+    settings.EMBEDDING_CACHE_ALIAS names a Django cache, entries are also
+    written there so every worker process shares them.
+    """
+    
+    def __init__(self, max_entries=None, ttl=None, alias=None):
+        self.max_entries = settings.EMBEDDING_CACHE_SIZE if max_entries is None else max_entries
+        self.ttl = settings.EMBEDDING_CACHE_TTL if ttl is None else ttl
+        self.alias = settings.EMBEDDING_CACHE_ALIAS if alias is None else alias
+        self._entries = OrderedDict()  # key -> (expires_at, vector)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def normalize(text):
+        """Collapse whitespace so trivially different spellings of a query share an entry"""
+        return ' '.join(unicodedata.normalize('NFC', text).split())
+    
+    def key(self, text, model=None):
+        return f"embedding:{model or current_model()}:{text_hash(self.normalize(text))}"
+    
+    def _shared(self):
+        return caches[self.alias] if self.alias else None
+    
+    def get(self, text, model=None):
+        """Return the cached vector for text, or None"""
+        key = self.key(text, model)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, vector = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return list(vector)
+                del self._entries[key]
+        
+        shared = self._shared()
+        if shared is not None:
+            vector = shared.get(key)
+            if vector is not None:
+                self._store(key, vector)
+                with self._lock:
+                    self.hits += 1
+                    self.shared_hits += 1
+                return list(vector)
+        
+        with self._lock:
+            self.misses += 1
+        return None
+    
+    def set(self, text, vector, model=None):
+        key = self.key(text, model)
+        vector = list(vector)
+        self._store(key, vector)
+        shared = self._shared()
+        if shared is not None:
+            shared.set(key, vector, timeout=self.ttl)
+    
+    def _store(self, key, vector):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.shared_hits = self.misses = 0
+    
+    def stats(self):
+        """Hit/miss counters for this process"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+_embedding_cache = None
+
+def get_embedding_cache():
+    """Return the process-wide embedding cache, creating it on first use"""
+    global _embedding_cache
+    if _embedding_cache is None:
+        _embedding_cache = EmbeddingCache()
+    return _embedding_cache
 
 def generate_embeddings(text):
-    """Generate embeddings for given text using OpenAI's embedding model"""
-    client = OpenAI(api_key=settings.OPENAI_API_KEY)
-    response = client.embeddings.create(
-        model="text-embedding-ada-002",
-        input=text
-    )
-    return response.data[0].embedding
+    """
+    Generate embeddings with the configured backend (settings.EMBEDDING_BACKEND)
+    Pass a string to get one vector, or a list of strings to get a list of
+    vectors in the same order. Results are cached (see EmbeddingCache), so
+    repeated texts such as re-asked questions skip the API call; only the
+    texts that miss the cache are sent, as batched requests. Meant for
+    query texts: document texts are rarely embedded twice, so the embedding
+    jobs call generate_embeddings_batch() instead.
+    """
+    if isinstance(text, str):
+        return generate_embeddings([text])[0]
+    
+    texts = list(text)
+    cache = get_embedding_cache()
+    results = [cache.get(t) for t in texts]
+    
+    missing = [i for i, vector in enumerate(results) if vector is None]
+    if missing:
+        vectors = generate_embeddings_batch([texts[i] for i in missing])
+        for i, vector in zip(missing, vectors):
+            cache.set(texts[i], vector)
+            results[i] = vector
+    
+    return results
+
+def batch_texts(texts, max_items=None, max_tokens=None):
+    """
+    Group texts into request-sized batches
+    Each batch holds at most max_items texts and about max_tokens estimated
+    tokens (a single oversized text still gets a batch of its own).
+    Returns a list of lists of positions into texts.
+    """
+    max_items = max_items or min(settings.EMBEDDING_BATCH_MAX_ITEMS, get_embedding_backend().max_batch_items)
+    max_tokens = max_tokens or settings.EMBEDDING_BATCH_MAX_TOKENS
+    
+    batches = []
+    current = []
+    current_tokens = 0
+    for i, text in enumerate(texts):
+        tokens = count_tokens(text)
+        if current and (len(current) >= max_items or current_tokens + tokens > max_tokens):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(i)
+        current_tokens += tokens
+    
+    if current:
+        batches.append(current)
+    return batches
+
+def _embed_batch(texts):
+    """Embed one request-sized batch with the configured backend, in input order"""
+    return get_embedding_backend().embed(texts)
+
+def generate_embeddings_batch(texts):
+    """
+    Generate embeddings for many texts with as few requests as possible
+    Texts are grouped by batch_texts; independent batches run concurrently on
+    a bounded thread pool (settings.EMBEDDING_MAX_WORKERS).
+    Returns a list of embedding vectors in the same order as texts.
+    """
+    texts = list(texts)
+    if not texts:
+        return []
+    
+    batches = batch_texts(texts)
+    if len(batches) == 1:
+        return _embed_batch(texts)
+    
+    results = [None] * len(texts)
+    max_workers = max(1, min(settings.EMBEDDING_MAX_WORKERS, len(batches)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(_embed_batch, [texts[i] for i in batch]): batch
+            for batch in batches
+        }
+        for future in as_completed(futures):
+            # Put each batch's vectors back at the positions of its texts
+            for i, embedding in zip(futures[future], future.result()):
+                results[i] = embedding
+    
+    return results
+
+def pack_embedding(vector):
+    """
+    Pack an embedding vector into little-endian float32 bytes for storage
+    """
+    return np.asarray(vector, dtype=EMBEDDING_DTYPE).tobytes()
+
+def unpack_embedding(data):
+    """
+    Read packed float32 bytes back as a numpy array.
+    The array is a read-only view over the buffer - nothing is copied.
+    """
+    if not data:
+        return np.empty(0, dtype=EMBEDDING_DTYPE)
+    return np.frombuffer(data, dtype=EMBEDDING_DTYPE)
+
+def text_hash(text):
+    """
+    sha256 hex digest of the exact text sent for embedding
+    """
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
 
 def count_tokens(text):
     """
@@ -80,17 +294,105 @@ def generate_chunked_embeddings(text):
     Returns a list of (chunk_text, embedding) tuples
     """
     chunks = chunk_text(text)
-    client = OpenAI(api_key=settings.OPENAI_API_KEY)
+    embeddings = generate_embeddings_batch(chunks)
+    return list(zip(chunks, embeddings))
+
+def as_matrix(embeddings):
+    """
+    Stack embeddings into a 2-D float32 matrix.
+    Accepts a 2-D array or a list of vectors (lists or arrays).
+    """
+    if isinstance(embeddings, np.ndarray):
+        matrix = embeddings
+    elif len(embeddings) == 0:
+        return np.empty((0, 0), dtype=np.float32)
+    else:
+        matrix = np.vstack([np.asarray(vector, dtype=np.float32) for vector in embeddings])
     
-    results = []
-    for chunk in chunks:
-        response = client.embeddings.create(
-            model="text-embedding-ada-002",
-            input=chunk
-        )
-        embedding = response.data[0].embedding
-        results.append((chunk, embedding))
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    return matrix
+
+def normalize_rows(matrix):
+    """
+    Return a copy of a matrix with every row scaled to unit length.
+    Zero rows stay zero, so they score 0 against any query.
+    """
+    matrix = np.array(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    matrix /= norms
+    return matrix
+
+def quantize_rows(matrix):
+    """
+    Scalar-quantize rows to int8 with one float32 scale per row.
+    Each row is stored as round(row / scale) with scale = max(|row|) / 127,
+    so row ~= int8_row * scale. Returns (int8 matrix, scales).
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    scales = np.abs(matrix).max(axis=1) / 127 if len(matrix) else np.empty(0, dtype=np.float32)
+    safe = np.where(scales > 0, scales, 1).astype(np.float32)
+    quantized = np.clip(np.rint(matrix / safe[:, None]), -127, 127).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+def top_k_indices(scores, top_k):
+    """
+    Indices of the top_k highest scores, best first.
+    Works on a 1-D array or row-wise on a 2-D array of scores, using
+    argpartition so only the selected entries are sorted.
+    """
+    scores = np.asarray(scores)
+    size = scores.shape[-1]
+    top_k = min(top_k, size)
+    if top_k <= 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.intp)
+    
+    if top_k < size:
+        top = np.argpartition(-scores, top_k - 1, axis=-1)[..., :top_k]
+    else:
+        top = np.broadcast_to(np.arange(size), scores.shape).copy()
+    order = np.argsort(-np.take_along_axis(scores, top, axis=-1), axis=-1, kind='stable')
+    return np.take_along_axis(top, order, axis=-1)
+
+def batch_similarity_search(query_embeddings, embeddings, top_k=5, normalized=False):
+    """
+    Find the most similar documents for several queries at once
+    Args:
+        query_embeddings: Q query vectors (2-D array or list of vectors)
+        embeddings: N document vectors (2-D array or list of vectors)
+        top_k: Number of top results to return per query
+        normalized: Set when embeddings are already unit length, to skip renormalizing
+    Returns:
+        One list of (index, similarity_score) tuples per query, best first
+    """
+    queries = as_matrix(query_embeddings)
+    matrix = as_matrix(embeddings)
+    if matrix.size == 0 or queries.size == 0:
+        return [[] for _ in range(len(queries))]
+    
+    # Zero vectors have no direction: they are skipped, not scored 0, so
+    # orthogonal documents (cosine exactly 0) are still returned
+    query_is_zero = ~queries.any(axis=1)
+    row_is_zero = ~matrix.any(axis=1)
+    queries = normalize_rows(queries)
+    if not normalized:
+        matrix = normalize_rows(matrix)
+    
+    # Q x N cosine similarities in a single BLAS call
+    scores = queries @ matrix.T
+    if row_is_zero.any():
+        scores[:, row_is_zero] = -np.inf
+    top = top_k_indices(scores, top_k)
     
+    results = []
+    for row_scores, row_top, is_zero in zip(scores, top, query_is_zero):
+        results.append([] if is_zero else [
+            (int(index), float(row_scores[index]))
+            for index in row_top
+            if not row_is_zero[index]
+        ])
     return results
 
 def similarity_search(query_embedding, embeddings_list, top_k=5):
@@ -98,38 +400,27 @@ def similarity_search(query_embedding, embeddings_list, top_k=5):
     Find the most similar documents based on cosine similarity
     Args:
         query_embedding: Embedding vector for the query
-        embeddings_list: List of embedding vectors to search through
+        embeddings_list: 2-D array or list of embedding vectors to search through
         top_k: Number of top results to return
     Returns:
         List of (index, similarity_score) tuples for the top_k most similar items
     """
-    query_array = np.array(query_embedding)
-    similarities = []
+    query_array = np.asarray(query_embedding, dtype=np.float32).ravel()
+    if query_array.size == 0:
+        return []
     
-    for i, embedding in enumerate(embeddings_list):
-        if embedding is not None:  # Explicitly check for None
-            try:
-                embedding_array = np.array(embedding)
-                
-                # Ensure arrays have content
-                if embedding_array.size == 0 or query_array.size == 0:
-                    continue
-                
-                # Calculate the norms
-                query_norm = np.linalg.norm(query_array)
-                embedding_norm = np.linalg.norm(embedding_array)
-                
-                # Avoid division by zero
-                if query_norm > 0 and embedding_norm > 0:
-                    # Calculate dot product and convert to Python float
-                    dot_product = np.dot(query_array, embedding_array)
-                    similarity = float(dot_product / (query_norm * embedding_norm))
-                    similarities.append((i, similarity))
-            except Exception as e:
-                # Skip problematic embeddings but log for debugging
-                print(f"Error processing embedding at index {i}: {e}")
-                continue
-    
-    # Sort by similarity (highest first) and return top k
-    similarities.sort(key=lambda x: x[1], reverse=True)
-    return similarities[:top_k]
+    if isinstance(embeddings_list, np.ndarray):
+        return batch_similarity_search(query_array, embeddings_list, top_k)[0]
+    
+    # Lists may hold missing or mismatched vectors; search the valid ones
+    # and map the results back to their original positions
+    positions = [
+        i for i, embedding in enumerate(embeddings_list)
+        if embedding is not None and len(embedding) == query_array.size
+    ]
+    if not positions:
+        return []
+    
+    valid = [embeddings_list[i] for i in positions]
+    results = batch_similarity_search(query_array, valid, top_k)[0]
+    return [(positions[index], similarity) for index, similarity in results]
@@ -0,0 +1,112 @@
+import re
+import threading
+import zlib
+
+import numpy as np
+from django.conf import settings
+from django.utils.module_loading import import_string
+from openai import OpenAI
+
+class EmbeddingBackend:
+    """
+    Interface for embedding providers, selected with settings.EMBEDDING_BACKEND.
+    Subclasses turn a batch of texts into vectors in a single call.
+    """
+    # Stored with every vector, so switching backends marks old vectors as stale
+    model_name = None
+    # Most texts accepted in a single embed() call
+    max_batch_items = 2048
+    # True if texts never leave this machine (so local LLM mode may embed queries)
+    runs_locally = False
+
+    def is_available(self):
+        """False when the backend cannot be used (e.g. missing credentials)"""
+        return True
+
+    def embed(self, texts):
+        """Return one embedding vector (a list of floats) per text, in order"""
+        raise NotImplementedError
+
+class OpenAIEmbeddingBackend(EmbeddingBackend):
+    """Embeddings from the OpenAI API"""
+    model_name = "text-embedding-ada-002"
+
+    def __init__(self):
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        """Shared client for the configured API key, so connections are reused across calls"""
+        api_key = settings.OPENAI_API_KEY
+        client = self._clients.get(api_key)
+        if client is None:
+            with self._lock:
+                client = self._clients.setdefault(api_key, OpenAI(api_key=api_key))
+        return client
+
+    def is_available(self):
+        return bool(settings.OPENAI_API_KEY)
+
+    def embed(self, texts):
+        response = self.client.embeddings.create(
+            model=self.model_name,
+            input=list(texts)
+        )
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+class HashingEmbeddingBackend(EmbeddingBackend):
+    """
+    Offline embeddings from a hashing vectorizer - no network or model files.
+    Words and word pairs are hashed into settings.EMBEDDING_HASHING_DIMENSIONS
+    signed buckets, weighted by sublinear term frequency and L2-normalized,
+    so texts sharing vocabulary get a high cosine similarity. Deterministic
+    across processes and machines, which makes it suitable for tests,
+    benchmarks and air-gapped installs.
+    """
+    max_batch_items = 10000
+    runs_locally = True
+
+    TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+    def __init__(self, dimensions=None):
+        self.dimensions = dimensions or settings.EMBEDDING_HASHING_DIMENSIONS
+        self.model_name = f"hashing-{self.dimensions}"
+
+    def _features(self, text):
+        words = self.TOKEN_PATTERN.findall(text.lower())
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def embed(self, texts):
+        vectors = []
+        for text in texts:
+            features = self._features(text)
+            vector = np.zeros(self.dimensions, dtype=np.float32)
+            if features:
+                hashes = np.array([zlib.crc32(feature.encode('utf-8')) for feature in features], dtype=np.uint32)
+                # Low bits pick the bucket, the top bit picks the sign to offset collisions
+                buckets = hashes % self.dimensions
+                signs = np.where(hashes & 0x80000000, -1.0, 1.0)
+                np.add.at(vector, buckets, signs)
+                vector = np.sign(vector) * np.log1p(np.abs(vector))
+                norm = np.linalg.norm(vector)
+                if norm > 0:
+                    vector /= norm
+            vectors.append(vector.tolist())
+        return vectors
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_embedding_backend():
+    """Return the configured embedding backend (created once per process)"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = import_string(settings.EMBEDDING_BACKEND)()
+    return _backend
+
+def embeddings_available():
+    """True if the configured backend can generate embeddings right now"""
+    return get_embedding_backend().is_available()
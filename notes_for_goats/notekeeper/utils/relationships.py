@@ -0,0 +1,49 @@
+"""
+Bulk loading of relationship endpoints.
+
+Relationship.source and Relationship.target are generic foreign keys, so
+Django loads each one with its own query the first time it is read. Pages
+that show many relationships resolve them all up front instead, with one
+query per content type, and cache the objects on the relationships.
+"""
+from collections import defaultdict
+
+from django.contrib.contenttypes.models import ContentType
+
+from ..models import Relationship
+
+
+def resolve_relationship_endpoints(relationships):
+    """
+    Load the sources and targets of relationships (a queryset or a list)
+    with one query per content type, and cache them so that .source and
+    .target (and str()) need no further queries. Endpoints that no longer
+    exist are cached as None. Returns the relationships as a list.
+    """
+    relationships = list(relationships)
+
+    ids_by_type = defaultdict(set)
+    for relationship in relationships:
+        ids_by_type[relationship.source_content_type_id].add(relationship.source_object_id)
+        ids_by_type[relationship.target_content_type_id].add(relationship.target_object_id)
+
+    objects = {}
+    for content_type_id, object_ids in ids_by_type.items():
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        if model is None:
+            # The model of a stale content type is gone, and so are its objects
+            continue
+        # in_bulk splits long id lists to fit the database's parameter limit
+        for object_id, obj in model._base_manager.in_bulk(object_ids).items():
+            objects[(content_type_id, object_id)] = obj
+
+    source_field = Relationship._meta.get_field('source')
+    target_field = Relationship._meta.get_field('target')
+    for relationship in relationships:
+        source_field.set_cached_value(
+            relationship, objects.get((relationship.source_content_type_id, relationship.source_object_id))
+        )
+        target_field.set_cached_value(
+            relationship, objects.get((relationship.target_content_type_id, relationship.target_object_id))
+        )
+    return relationships
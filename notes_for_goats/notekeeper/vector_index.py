@@ -0,0 +1,676 @@
+"""
+Per-workspace vector index over note embeddings, persisted as memory-mapped files.
+
+Each workspace's NoteEmbedding vectors are kept L2-normalized in a float32
+.npy matrix under settings.VECTOR_INDEX_DIR (next to db.sqlite3), with an
+int64 .npy sidecar of (embedding id, note id, section index, alive) rows and
+a small JSON meta file. Every worker process maps the same files read-only,
+so the vectors live once in the OS page cache instead of once per process,
+and a freshly started worker answers its first query without reloading the
+NoteEmbedding table.
+
+Saved embeddings are appended in place and deleted ones are tombstoned by
+clearing their alive flag, in both cases once the transaction that wrote
+them commits. When the matrix fills up, or when the
+compact_vector_index command drops tombstoned rows, a new generation of files
+is written and the meta file is switched over atomically; readers notice the
+new generation on their next query and remap.
+
+Workspaces with at least settings.ANN_THRESHOLD live chunks are searched
+approximately through an IVF index (utils/ann.py) that only scans the
+settings.ANN_NPROBE lists nearest to the query. Its centroids and list
+assignments are saved next to the generation they were trained on.
+
+With settings.VECTOR_INDEX_QUANTIZE, each generation also keeps an int8 copy
+of the matrix with one scale per row. Exact searches then scan the int8 copy
+(a quarter of the memory) and rescore only the best
+settings.VECTOR_INDEX_RESCORE candidates against the float32 rows.
+"""
+import glob
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from .batching import chunked
+from .models import NoteEmbedding
+from .utils.ann import IVFIndex
+from .utils.embedding import normalize_rows, quantize_rows, top_k_indices
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# A single search result: the best-matching chunk of a note
+SearchHit = namedtuple('SearchHit', ['note_id', 'similarity', 'embedding_id', 'section_index'])
+
+# Initial row capacity; the matrix doubles when it fills up
+_INITIAL_CAPACITY = 64
+
+# Rows converted at a time when quantizing or scanning the int8 matrix
+_BLOCK_SIZE = 8192
+
+# Columns of the id sidecar
+_EMBEDDING_ID, _NOTE_ID, _SECTION_INDEX, _ALIVE = range(4)
+
+_META_PATTERN = re.compile(r'^workspace_(\d+)\.json$')
+
+
+def _normalize(vector):
+    """Return a float32 unit-length copy of a vector (zero vectors stay zero)"""
+    array = np.array(vector, dtype=np.float32).ravel()
+    norm = np.linalg.norm(array)
+    if norm > 0:
+        array /= norm
+    return array
+
+
+def _empty_meta():
+    return {'generation': 0, 'count': 0, 'capacity': 0, 'dimensions': 0, 'tombstones': 0, 'skipped': 0}
+
+
+class NoteVectorIndex:
+    """Memory-mapped, normalized embedding matrix for the notes of one workspace"""
+
+    def __init__(self, workspace_id, directory=None):
+        self.workspace_id = workspace_id
+        self.directory = str(directory or settings.VECTOR_INDEX_DIR)
+        self._lock = threading.RLock()
+        # Read-only maps of the current generation, refreshed when the meta file changes
+        self._meta = _empty_meta()
+        self._meta_stamp = None
+        self._vectors = None
+        self._ids = None
+        # IVF index for approximate search, tied to one generation
+        self._ivf = None
+        self._ivf_generation = None
+        # int8 copy of the matrix and its row scales, tied to one generation
+        self._quantized = None
+        self._quantized_generation = None
+
+    # ---- file layout -------------------------------------------------
+
+    @property
+    def meta_path(self):
+        return os.path.join(self.directory, f'workspace_{self.workspace_id}.json')
+
+    @property
+    def lock_path(self):
+        return os.path.join(self.directory, f'workspace_{self.workspace_id}.lock')
+
+    def _array_paths(self, generation):
+        prefix = os.path.join(self.directory, f'workspace_{self.workspace_id}.{generation}')
+        return f'{prefix}.vectors.npy', f'{prefix}.ids.npy'
+
+    def _quantized_paths(self, generation):
+        prefix = os.path.join(self.directory, f'workspace_{self.workspace_id}.{generation}')
+        return f'{prefix}.int8.npy', f'{prefix}.scales.npy'
+
+    def _ivf_path(self, generation):
+        return os.path.join(self.directory, f'workspace_{self.workspace_id}.{generation}.ivf.npz')
+
+    def exists(self):
+        return os.path.exists(self.meta_path)
+
+    def _read_meta(self):
+        try:
+            with open(self.meta_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return _empty_meta()
+
+    def _write_meta(self, meta):
+        # Write-then-rename so readers never see a half-written meta file
+        tmp_path = f'{self.meta_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def _open_arrays(self, meta, mode):
+        if not meta['capacity']:
+            return None, None
+        vectors_path, ids_path = self._array_paths(meta['generation'])
+        return (
+            np.load(vectors_path, mmap_mode=mode),
+            np.load(ids_path, mmap_mode=mode),
+        )
+
+    @contextmanager
+    def _file_lock(self):
+        """Serialize writers across threads and worker processes"""
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            with open(self.lock_path, 'a') as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _refresh(self):
+        """Remap the arrays if another process has written a new meta file"""
+        try:
+            stat = os.stat(self.meta_path)
+        except FileNotFoundError:
+            stamp = None
+        else:
+            stamp = (stat.st_ino, stat.st_mtime_ns)
+
+        with self._lock:
+            if stamp == self._meta_stamp:
+                return
+            for _ in range(3):
+                meta = self._read_meta()
+                try:
+                    vectors, ids = self._open_arrays(meta, 'r')
+                    break
+                except FileNotFoundError:
+                    # A writer switched generations between our two reads; try again
+                    continue
+            else:
+                raise RuntimeError(f"Vector index for workspace {self.workspace_id} kept changing while opening it")
+            self._meta, self._vectors, self._ids = meta, vectors, ids
+            self._meta_stamp = stamp
+
+    # ---- writing -----------------------------------------------------
+
+    def _write_generation(self, meta, vectors, ids, dimensions, min_capacity=0, skipped=None):
+        """
+        Write the live rows of (vectors, ids) into a fresh generation of files
+        with room to grow, switch the meta file over and remove the old files.
+        """
+        if vectors is not None and meta['count']:
+            live = ids[:meta['count'], _ALIVE] == 1
+            live_vectors = vectors[:meta['count']][live]
+            live_ids = ids[:meta['count']][live]
+        else:
+            live_vectors = np.empty((0, dimensions), dtype=np.float32)
+            live_ids = np.empty((0, 4), dtype=np.int64)
+
+        count = len(live_ids)
+        generation = meta['generation'] + 1
+        if dimensions:
+            capacity = max(_INITIAL_CAPACITY, min_capacity, count * 2)
+            vectors_path, ids_path = self._array_paths(generation)
+            new_vectors = np.lib.format.open_memmap(vectors_path, mode='w+', dtype=np.float32, shape=(capacity, dimensions))
+            new_ids = np.lib.format.open_memmap(ids_path, mode='w+', dtype=np.int64, shape=(capacity, 4))
+            new_vectors[:count] = live_vectors
+            new_ids[:count] = live_ids
+            new_vectors.flush()
+            new_ids.flush()
+            if settings.VECTOR_INDEX_QUANTIZE:
+                self._write_quantized(generation, new_vectors, count, capacity)
+        else:
+            # No vectors yet, so there is nothing to map until the first append
+            capacity = 0
+            new_vectors = new_ids = None
+
+        new_meta = {
+            'generation': generation,
+            'count': count,
+            'capacity': capacity,
+            'dimensions': dimensions,
+            'tombstones': 0,
+            'skipped': meta.get('skipped', 0) if skipped is None else skipped,
+        }
+        self._write_meta(new_meta)
+
+        # Processes still mapping the old files keep their pages until they remap
+        if meta['capacity']:
+            old_files = os.path.join(self.directory, f"workspace_{self.workspace_id}.{meta['generation']}.*")
+            for path in glob.glob(old_files):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+        return new_meta, new_vectors, new_ids
+
+    def _write_quantized(self, generation, vectors, count, capacity):
+        """Write the int8 copy of the first `count` rows of a generation (call with the file lock held)"""
+        int8_path, scales_path = self._quantized_paths(generation)
+        suffix = f'.{os.getpid()}.tmp'
+        quantized = np.lib.format.open_memmap(int8_path + suffix, mode='w+', dtype=np.int8, shape=(capacity, vectors.shape[1]))
+        scales = np.lib.format.open_memmap(scales_path + suffix, mode='w+', dtype=np.float32, shape=(capacity,))
+        for start in range(0, count, _BLOCK_SIZE):
+            end = min(start + _BLOCK_SIZE, count)
+            quantized[start:end], scales[start:end] = quantize_rows(vectors[start:end])
+        quantized.flush()
+        scales.flush()
+        # Scales last: readers only use the int8 copy once both files are in place
+        os.replace(int8_path + suffix, int8_path)
+        os.replace(scales_path + suffix, scales_path)
+
+    def _quantized_arrays(self, meta):
+        """int8 matrix and scales of the current generation, created on first use"""
+        with self._lock:
+            if self._quantized_generation == meta['generation']:
+                return self._quantized
+
+            int8_path, scales_path = self._quantized_paths(meta['generation'])
+            if not os.path.exists(scales_path):
+                with self._file_lock():
+                    current = self._read_meta()
+                    if current['generation'] != meta['generation']:
+                        return None
+                    if not os.path.exists(scales_path):
+                        vectors, _ = self._open_arrays(current, 'r')
+                        self._write_quantized(current['generation'], vectors, current['count'], current['capacity'])
+                        logger.info(f"Quantized vector index for workspace {self.workspace_id} ({current['count']} rows)")
+
+            self._quantized = (np.load(int8_path, mmap_mode='r'), np.load(scales_path, mmap_mode='r'))
+            self._quantized_generation = meta['generation']
+            return self._quantized
+
+    def rebuild(self):
+        """Rewrite the index from every NoteEmbedding of the workspace"""
+        rows = NoteEmbedding.objects.filter(
+            note__workspace_id=self.workspace_id
+        ).values_list('id', 'note_id', 'section_index', 'embedding')
+
+        id_rows, vectors = [], []
+        skipped = 0
+        for embedding_id, note_id, section_index, data in rows.iterator(chunk_size=1000):
+            vector = np.frombuffer(data, dtype='<f4')
+            if vectors and vector.size != vectors[0].size:
+                logger.warning(f"Skipping embedding {embedding_id}: dimensions differ from the rest of the workspace")
+                skipped += 1
+                continue
+            id_rows.append((embedding_id, note_id, section_index, 1))
+            vectors.append(vector)
+
+        with self._file_lock():
+            meta = self._read_meta()
+            if vectors:
+                # Stack and normalize every row in one pass
+                matrix = normalize_rows(np.vstack(vectors))
+                ids = np.array(id_rows, dtype=np.int64)
+                source = dict(meta, count=len(ids))
+                self._write_generation(source, matrix, ids, matrix.shape[1], skipped=skipped)
+            else:
+                self._write_generation(dict(meta, count=0), None, None, 0, skipped=skipped)
+
+        logger.info(f"Built vector index for workspace {self.workspace_id} with {len(id_rows)} embeddings")
+        return len(id_rows)
+
+    def compact(self):
+        """Drop tombstoned rows and shrink the files; returns the number of rows removed"""
+        with self._file_lock():
+            meta = self._read_meta()
+            if not meta['tombstones']:
+                return 0
+            vectors, ids = self._open_arrays(meta, 'r')
+            self._write_generation(meta, vectors, ids, meta['dimensions'])
+            return meta['tombstones']
+
+    def upsert(self, embedding_id, note_id, section_index, vector):
+        """Append the vector for one NoteEmbedding row, tombstoning any older copy"""
+        unit = _normalize(vector)
+        with self._file_lock():
+            meta = self._read_meta()
+            vectors, ids = self._open_arrays(meta, 'r+')
+
+            if unit.size != meta['dimensions']:
+                if meta['count'] - meta['tombstones'] > 0:
+                    logger.warning(
+                        f"Skipping embedding {embedding_id}: {unit.size} dimensions, "
+                        f"index for workspace {self.workspace_id} uses {meta['dimensions']}"
+                    )
+                    return
+                # Nothing live yet, so the first vector decides the dimensionality
+                meta, vectors, ids = self._write_generation(dict(meta, count=0), None, None, unit.size)
+
+            count = meta['count']
+            stale = (ids[:count, _EMBEDDING_ID] == embedding_id) & (ids[:count, _ALIVE] == 1)
+            if stale.any():
+                ids[:count, _ALIVE][stale] = 0
+                meta['tombstones'] += int(stale.sum())
+
+            if count == meta['capacity']:
+                tombstones = meta['tombstones']
+                meta, vectors, ids = self._write_generation(meta, vectors, ids, meta['dimensions'], min_capacity=count + 1)
+                count = meta['count']
+                logger.info(f"Grew vector index for workspace {self.workspace_id} to {meta['capacity']} rows, dropped {tombstones} tombstones")
+
+            # Write the row before publishing the new count so readers never see a partial row
+            vectors[count] = unit
+            ids[count] = (embedding_id, note_id, section_index, 1)
+            vectors.flush()
+            ids.flush()
+
+            int8_path, scales_path = self._quantized_paths(meta['generation'])
+            if os.path.exists(scales_path):
+                quantized = np.load(int8_path, mmap_mode='r+')
+                scales = np.load(scales_path, mmap_mode='r+')
+                quantized[count:count + 1], scales[count:count + 1] = quantize_rows(unit[None, :])
+                quantized.flush()
+                scales.flush()
+            meta['count'] = count + 1
+            self._write_meta(meta)
+
+    def remove(self, embedding_ids):
+        """Tombstone the rows of several NoteEmbedding ids; returns the number of rows tombstoned"""
+        embedding_ids = np.fromiter(embedding_ids, dtype=np.int64)
+        if not embedding_ids.size or not self.exists():
+            return 0
+        with self._file_lock():
+            meta = self._read_meta()
+            vectors, ids = self._open_arrays(meta, 'r+')
+            if ids is None:
+                return 0
+            count = meta['count']
+            live = np.isin(ids[:count, _EMBEDDING_ID], embedding_ids) & (ids[:count, _ALIVE] == 1)
+            removed = int(live.sum())
+            if not removed:
+                return 0
+            ids[:count, _ALIVE][live] = 0
+            ids.flush()
+            meta['tombstones'] += removed
+            self._write_meta(meta)
+            return removed
+
+    def delete_files(self):
+        """Remove every file belonging to this index"""
+        pattern = os.path.join(self.directory, f'workspace_{self.workspace_id}.*')
+        for path in glob.glob(pattern):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self._meta = _empty_meta()
+            self._meta_stamp = None
+            self._vectors = self._ids = None
+            self._ivf = self._ivf_generation = None
+            self._quantized = self._quantized_generation = None
+
+    # ---- reading -----------------------------------------------------
+
+    @property
+    def stats(self):
+        """Current meta information (count includes tombstoned rows)"""
+        self._refresh()
+        return dict(self._meta)
+
+    def __len__(self):
+        meta = self.stats
+        return meta['count'] - meta['tombstones']
+
+    def _load_or_train_ivf(self, meta, vectors):
+        """Load the IVF index saved for a generation, training and saving it if missing"""
+        path = self._ivf_path(meta['generation'])
+        try:
+            return IVFIndex.load(path)
+        except FileNotFoundError:
+            pass
+
+        with self._file_lock():
+            # Another process may have trained it while we waited for the lock
+            try:
+                return IVFIndex.load(path)
+            except FileNotFoundError:
+                pass
+
+            started = time.monotonic()
+            ivf = IVFIndex.train(vectors[:meta['count']], n_lists=settings.ANN_LISTS or None)
+            logger.info(
+                f"Trained IVF index for workspace {self.workspace_id} with {ivf.list_count} lists "
+                f"over {len(ivf)} rows in {time.monotonic() - started:.1f}s"
+            )
+
+            # Only keep it on disk if the generation is still current
+            if self._read_meta()['generation'] == meta['generation']:
+                tmp_path = f'{path}.{os.getpid()}.tmp'
+                ivf.save(tmp_path)
+                os.replace(tmp_path, path)
+            return ivf
+
+    def _ann_index(self, meta, vectors):
+        """IVF index over the current generation, covering at least meta['count'] rows"""
+        with self._lock:
+            if self._ivf is None or self._ivf_generation != meta['generation']:
+                self._ivf = self._load_or_train_ivf(meta, vectors)
+                self._ivf_generation = meta['generation']
+            if len(self._ivf) < meta['count']:
+                # Rows appended since training join their nearest existing list
+                self._ivf.add(vectors[len(self._ivf):meta['count']])
+            return self._ivf
+
+    def search(self, query_vector, top_k=5, exclude_note_ids=None, exact=None, nprobe=None, quantized=None):
+        """
+        Find the notes most similar to a query vector.
+        Returns up to top_k SearchHits, one per note (its best-matching chunk),
+        ordered by cosine similarity. Only positive similarities are returned.
+        Large workspaces are searched approximately (see ANN_THRESHOLD); pass
+        exact=True or exact=False to force either mode. Exact searches scan the
+        int8 copy first when quantized (default VECTOR_INDEX_QUANTIZE) is set.
+        """
+        query = _normalize(query_vector)
+        self._refresh()
+        with self._lock:
+            meta, vectors, ids = self._meta, self._vectors, self._ids
+
+        size = meta['count']
+        if size == 0 or top_k <= 0 or vectors is None:
+            return []
+        if query.size != meta['dimensions']:
+            logger.warning(
+                f"Query has {query.size} dimensions, index for workspace "
+                f"{self.workspace_id} uses {meta['dimensions']}"
+            )
+            return []
+
+        if exact is None:
+            exact = size - meta['tombstones'] < settings.ANN_THRESHOLD
+        if quantized is None:
+            quantized = settings.VECTOR_INDEX_QUANTIZE
+
+        # Rows past `count` may be mid-append in another process, so only read up to it
+        if exact and quantized:
+            id_rows = np.array(ids[:size])
+            positions = self._quantized_candidates(meta, query, id_rows, top_k, exclude_note_ids)
+            if positions is None:
+                scores = np.asarray(vectors[:size]) @ query
+            else:
+                # Rescore the int8 shortlist at full precision
+                scores = np.asarray(vectors[positions]) @ query
+                id_rows = id_rows[positions]
+                size = len(positions)
+                if size == 0:
+                    return []
+        elif exact:
+            scores = np.asarray(vectors[:size]) @ query
+            id_rows = np.array(ids[:size])
+        else:
+            positions = self._ann_index(meta, vectors).candidates(query, nprobe or settings.ANN_NPROBE)
+            positions = positions[positions < size]
+            scores = np.asarray(vectors[positions]) @ query
+            id_rows = np.array(ids[positions])
+            size = len(positions)
+            if size == 0:
+                return []
+        note_ids = id_rows[:, _NOTE_ID]
+
+        scores[id_rows[:, _ALIVE] == 0] = -np.inf
+        if exclude_note_ids:
+            scores[np.isin(note_ids, list(exclude_note_ids))] = -np.inf
+
+        # Several chunks can belong to the same note, so widen the candidate
+        # window until it holds top_k distinct notes (or covers every row)
+        candidates = min(size, top_k * 4)
+        while True:
+            top = top_k_indices(scores, candidates)
+
+            hits = []
+            seen = set()
+            for position in top:
+                similarity = float(scores[position])
+                if similarity <= 0:
+                    break
+                note_id = int(note_ids[position])
+                if note_id in seen:
+                    continue
+                seen.add(note_id)
+                hits.append(SearchHit(
+                    note_id,
+                    similarity,
+                    int(id_rows[position, _EMBEDDING_ID]),
+                    int(id_rows[position, _SECTION_INDEX]),
+                ))
+                if len(hits) == top_k:
+                    return hits
+
+            if candidates >= size:
+                return hits
+            candidates = min(size, candidates * 4)
+
+    def _quantized_candidates(self, meta, query, id_rows, top_k, exclude_note_ids):
+        """
+        Positions of the best rows by int8 score, for rescoring against the float
+        rows. Returns None if the int8 copy is unavailable (e.g. a newer generation
+        was published mid-search), in which case the caller scores the float rows.
+        """
+        arrays = self._quantized_arrays(meta)
+        if arrays is None:
+            return None
+        quantized, scales = arrays
+        size = len(id_rows)
+
+        scores = np.empty(size, dtype=np.float32)
+        for start in range(0, size, _BLOCK_SIZE):
+            end = min(start + _BLOCK_SIZE, size)
+            scores[start:end] = (np.asarray(quantized[start:end], dtype=np.float32) @ query) * scales[start:end]
+
+        scores[id_rows[:, _ALIVE] == 0] = -np.inf
+        if exclude_note_ids:
+            scores[np.isin(id_rows[:, _NOTE_ID], list(exclude_note_ids))] = -np.inf
+
+        # Keep several chunks per requested note, since chunks of one note score alike
+        shortlist = top_k_indices(scores, min(size, max(settings.VECTOR_INDEX_RESCORE, top_k * 4)))
+        shortlist = shortlist[scores[shortlist] > 0]
+        # Sorted positions read the float memmap sequentially
+        return np.sort(shortlist)
+
+
+# Open index handles keyed by workspace id
+_indexes = {}
+_indexes_lock = threading.Lock()
+# Workspaces whose files this process has checked against the database
+_verified = set()
+# Deleted embedding ids waiting for their transaction to commit, per thread
+_pending_removals = threading.local()
+
+
+def _index_handle(workspace_id):
+    index = _indexes.get(workspace_id)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.setdefault(workspace_id, NoteVectorIndex(workspace_id))
+    return index
+
+
+def get_note_index(workspace_id):
+    """
+    Return the vector index for a workspace. The first call in a process
+    checks the files against the NoteEmbedding table and rebuilds them if
+    they are missing or out of step (e.g. after a crash or a bulk import).
+    """
+    index = _index_handle(workspace_id)
+    if workspace_id in _verified:
+        return index
+
+    with _indexes_lock:
+        if workspace_id not in _verified:
+            expected = NoteEmbedding.objects.filter(note__workspace_id=workspace_id).count()
+            stats = index.stats
+            indexed = stats['count'] - stats['tombstones'] + stats.get('skipped', 0)
+            if not index.exists() or indexed != expected:
+                index.rebuild()
+            _verified.add(workspace_id)
+    return index
+
+
+def index_note_embedding(note_embedding):
+    """Append a saved NoteEmbedding to its workspace index, if the index exists on disk"""
+    index = _index_handle(note_embedding.note.workspace_id)
+    if index.exists():
+        index.upsert(
+            note_embedding.id,
+            note_embedding.note_id,
+            note_embedding.section_index,
+            note_embedding.vector,
+        )
+
+
+def reindex_workspace(workspace_id):
+    """Rebuild a workspace's index if it exists on disk, e.g. after a batch of writes"""
+    index = _index_handle(workspace_id)
+    if index.exists():
+        index.rebuild()
+
+
+def unindex_note_embedding(workspace_id, embedding_id):
+    """
+    Tombstone a deleted NoteEmbedding once the delete commits. The rows
+    deleted in one transaction (e.g. every chunk of a deleted note) are
+    removed from each workspace's index in one pass.
+    """
+    pending = getattr(_pending_removals, 'ids', None)
+    if pending is None:
+        pending = _pending_removals.ids = defaultdict(set)
+    pending[workspace_id].add(embedding_id)
+    transaction.on_commit(_flush_removals)
+
+
+def _flush_removals():
+    pending = getattr(_pending_removals, 'ids', None)
+    if not pending:
+        return
+    _pending_removals.ids = None
+    for workspace_id, embedding_ids in pending.items():
+        # Rows queued by a delete that was rolled back still exist and stay indexed
+        for chunk in chunked(embedding_ids):
+            embedding_ids.difference_update(NoteEmbedding.objects.filter(id__in=chunk).values_list('id', flat=True))
+        try:
+            _index_handle(workspace_id).remove(embedding_ids)
+        except Exception as e:
+            logger.error(f"Error removing {len(embedding_ids)} embeddings from the vector index of workspace {workspace_id}: {e}")
+
+
+def indexed_workspace_ids():
+    """Ids of the workspaces that have an index on disk"""
+    try:
+        names = os.listdir(settings.VECTOR_INDEX_DIR)
+    except FileNotFoundError:
+        return []
+    return sorted(int(match.group(1)) for match in map(_META_PATTERN.match, names) if match)
+
+
+def invalidate_note_index(workspace_id=None):
+    """Forget cached handles (all of them if no workspace given) so they are re-checked on next use"""
+    with _indexes_lock:
+        if workspace_id is None:
+            _indexes.clear()
+            _verified.clear()
+        else:
+            _indexes.pop(workspace_id, None)
+            _verified.discard(workspace_id)
+
+
+def delete_note_index(workspace_id):
+    """Remove a workspace's index files, e.g. when the workspace is deleted"""
+    _index_handle(workspace_id).delete_files()
+    invalidate_note_index(workspace_id)
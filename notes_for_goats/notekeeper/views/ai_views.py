@@ -3,11 +3,12 @@ from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib import messages
 from django.utils import timezone
 from django.conf import settings
-from ..models import Workspace, Note, Entity, UserPreference, NoteEmbedding, Tag, Relationship
+from ..models import Workspace, Note, Entity, UserPreference, NoteEmbedding, Tag
 from ..llm_service import LLMService
-from ..utils.embedding import generate_embeddings, similarity_search
+from ..retrieval import query_vector, retrieval_available, retrieve_entities, retrieve_notes, similar_entity_ids
+from ..utils.embedding_backends import embeddings_available
+from ..adjacency import relationships_of
 import numpy as np
-from django.contrib.contenttypes.models import ContentType
 
 # Get logger for this module
 logger = logging.getLogger(__name__)
@@ -239,7 +240,7 @@ def ask_ai(request, workspace_id):
                         'query': query_tokens,
                         'total': prompt_tokens,
                         'limit': 16384 if not use_local_llm and "gpt-4" in settings.OPENAI_MODEL.lower() else 4096,
-                        'use_rag': context_mode == 'auto' and not use_local_llm and context_tokens > 0,
+                        'use_rag': context_mode == 'auto' and retrieval_available(use_local_llm) and context_tokens > 0,
                         'use_focused': context_mode == 'focused' and focused_note_id,
                         'use_filtered': context_mode == 'filtered' and (selected_tag_ids or selected_entity_ids),
                         'focused_title': focused_note.title if context_mode == 'focused' and focused_note_id else None,
@@ -304,7 +305,9 @@ def ask_ai(request, workspace_id):
 def get_database_context(workspace, query=None, use_local_llm=False):
     """
     Retrieve relevant data from the database for a specific workspace
-    If query is provided and OpenAI API key exists, use RAG to find the most relevant items
+    If query is provided, use hybrid RAG (keyword and embedding ranking, see
+    retrieval.py) to find the most relevant items. This also works in local LLM
+    mode and without an embedding backend, through the full-text index.
     Otherwise, return the full database context
     
     Parameters:
@@ -316,95 +319,41 @@ def get_database_context(workspace, query=None, use_local_llm=False):
     include_relationships = True
     
     # Decide whether to use RAG or full context
-    use_rag = query and settings.OPENAI_API_KEY and not use_local_llm
+    use_rag = query and retrieval_available(use_local_llm)
     
     if not use_rag:
         # Fall back to full context approach
         return get_full_database_context(workspace)
     
-    # Generate embedding for the query
-    query_embedding = generate_embeddings(query)
-    
-    # Get all note embeddings in this workspace
-    note_embeddings = NoteEmbedding.objects.filter(
-        note__workspace=workspace
-    ).select_related('note')
-    
-    # Group embeddings by note
-    note_embedding_map = {}
-    for ne in note_embeddings:
-        if ne.note_id not in note_embedding_map:
-            note_embedding_map[ne.note_id] = []
-        note_embedding_map[ne.note_id].append(ne)
-    
-    # Find most relevant notes by comparing with all embeddings
-    # and keeping the highest similarity score for each note
-    note_similarities = []
-    for note_id, embeddings in note_embedding_map.items():
-        # Find the highest similarity for any chunk of this note
-        max_similarity = 0
-        best_embedding = None
-        
-        for ne in embeddings:
-            embedding_array = np.array(ne.embedding)
-            query_array = np.array(query_embedding)
-            
-            # Calculate cosine similarity
-            similarity = float(np.dot(query_array, embedding_array) / (
-                np.linalg.norm(query_array) * np.linalg.norm(embedding_array)
-            ))
-            
-            if similarity > max_similarity:
-                max_similarity = similarity
-                best_embedding = ne
-        
-        # Add to results if we found a match
-        if best_embedding:
-            note_similarities.append((best_embedding.note_id, max_similarity, best_embedding))
+    # Embed the query if vector search can be used (None otherwise)
+    query_array = query_vector(query, use_local_llm=use_local_llm)
     
-    # Sort by similarity and get top 5
-    note_similarities.sort(key=lambda x: x[1], reverse=True)
-    top_5_similarities = note_similarities[:5]
+    # Find the most relevant notes by fusing keyword and vector rankings;
+    # vector hits carry the best-matching chunk of each note
+    retrieved = retrieve_notes(workspace, query, top_k=5, query_array=query_array)
+    top_5_similarities = _hits_with_sections(retrieved)
     relevant_note_ids = [note_id for note_id, _, _ in top_5_similarities]
     
-    # Get entity embeddings for this workspace
-    relevant_entity_ids = []
-    try:
-        from ..models import EntityEmbedding
-        
-        entity_embeddings_objs = EntityEmbedding.objects.filter(
-            entity__workspace=workspace
-        ).select_related('entity')
-        
-        if entity_embeddings_objs.exists():
-            entity_embeddings_list = [np.array(ee.embedding) for ee in entity_embeddings_objs]
-            entity_objects = [ee.entity for ee in entity_embeddings_objs]
-            
-            # Get top 5 most similar entities
-            similar_entities = similarity_search(
-                query_embedding,
-                entity_embeddings_list,
-                top_k=min(5, len(entity_embeddings_list))
-            )
-            
-            relevant_entity_ids = [entity_objects[idx].id for idx, _ in similar_entities]
-    except (ImportError, AttributeError):
-        # EntityEmbedding might not exist yet
-        pass
+    # Get the most relevant entities the same way
+    relevant_entity_ids = retrieve_entities(workspace, query, top_k=5, query_array=query_array)
     
     # Build context with only the relevant items
     context = f"WORKSPACE: {workspace.name}\n"
     if workspace.description:
         context += f"Description: {workspace.description}\n\n"
     
-    # Track total tokens to avoid exceeding limits
-    MAX_CONTEXT_TOKENS = 6000  # Reserve ~2000 tokens for the prompt and response
+    # Track total tokens to avoid exceeding limits. Local models have a 4096-token
+    # window and run on CPU, so they get a smaller, ranked context
+    MAX_CONTEXT_TOKENS = 2500 if use_local_llm else 6000  # Reserve room for the prompt and response
     estimated_tokens = estimate_tokens(context)
     
     # Add relevant entities (typically small)
     if relevant_entity_ids and estimated_tokens < MAX_CONTEXT_TOKENS:
         entities_context = "RELEVANT ENTITIES:\n"
-        for entity in Entity.objects.filter(id__in=relevant_entity_ids):
+        relevant_entities = list(Entity.objects.filter(id__in=relevant_entity_ids))
+        # Look up the relationships of all of them at once
+        relationships = relationships_of(workspace.id, [entity.id for entity in relevant_entities]) if include_relationships else {}
+        for entity in relevant_entities:
             entity_text = f"- {entity.name} (Type: {entity.get_type_display()})\n"
             if entity.details:
                 entity_text += f"  Details: {entity.details}\n"
@@ -421,23 +370,10 @@ def get_database_context(workspace, query=None, use_local_llm=False):
             if include_relationships:
                 # Check if we have enough tokens first
                 if estimated_tokens + 300 < MAX_CONTEXT_TOKENS:  # Allow ~300 tokens for relationships
-                    entity_content_type = ContentType.objects.get_for_model(Entity)
-                    
-                    # Get relationships where this entity is the source
-                    source_relationships = Relationship.objects.filter(
-                        workspace=workspace,
-                        source_content_type=entity_content_type,
-                        source_object_id=entity.id
-                    ).select_related('relationship_type')
-                    
-                    # Get relationships where this entity is the target
-                    target_relationships = Relationship.objects.filter(
-                        workspace=workspace,
-                        target_content_type=entity_content_type,
-                        target_object_id=entity.id
-                    ).select_related('relationship_type')
+                    # Relationships where this entity is the source, and where it is the target
+                    source_relationships, target_relationships = relationships[entity.id]
                     
-                    if source_relationships.exists() or target_relationships.exists():
+                    if source_relationships or target_relationships:
                         rel_text = "  Relationships:\n"
                         
                         # Add up to 3 most important relationships for brevity
@@ -449,30 +385,22 @@ def get_database_context(workspace, query=None, use_local_llm=False):
                             if relationship_count >= max_relationships:
                                 break
                                 
-                            if rel.target_content_type == entity_content_type:
-                                try:
-                                    target_entity = Entity.objects.get(id=rel.target_object_id)
-                                    rel_text += f"    → {rel.relationship_type.display_name} {target_entity.name}\n"
-                                    relationship_count += 1
-                                except Entity.DoesNotExist:
-                                    continue
+                            if rel.target is not None:
+                                rel_text += f"    → {rel.relationship_type.display_name} {rel.target.name}\n"
+                                relationship_count += 1
                         
                         # Add target relationships (other → entity)
                         for rel in target_relationships:
                             if relationship_count >= max_relationships:
                                 break
                                 
-                            if rel.source_content_type == entity_content_type:
-                                try:
-                                    source_entity = Entity.objects.get(id=rel.source_object_id)
-                                    # Use inverse name if available
-                                    if rel.relationship_type.is_directional and rel.relationship_type.inverse_name:
-                                        rel_text += f"    ← {source_entity.name} {rel.relationship_type.inverse_name} this\n"
-                                    else:
-                                        rel_text += f"    ← {source_entity.name} {rel.relationship_type.display_name} this\n"
-                                    relationship_count += 1
-                                except Entity.DoesNotExist:
-                                    continue
+                            if rel.source is not None:
+                                # Use inverse name if available
+                                if rel.relationship_type.is_directional and rel.relationship_type.inverse_name:
+                                    rel_text += f"    ← {rel.source.name} {rel.relationship_type.inverse_name} this\n"
+                                else:
+                                    rel_text += f"    ← {rel.source.name} {rel.relationship_type.display_name} this\n"
+                                relationship_count += 1
                         
                         if relationship_count > 0:
                             # Only add relationships text if we found valid relationships
@@ -496,7 +424,7 @@ def get_database_context(workspace, query=None, use_local_llm=False):
         
         # Prepare to allocate tokens intelligently based on note relevance
         notes_data = []
-        for note_id, similarity, best_embedding in top_5_similarities:
+        for note_id, score, best_embedding in top_5_similarities:
             try:
                 note = Note.objects.get(id=note_id)
                 # If we have a best_embedding with section_text, prefer using that specific section
@@ -515,7 +443,7 @@ def get_database_context(workspace, query=None, use_local_llm=False):
                     'note': note,
                     'content': content,
                     'preview': preview,
-                    'similarity': similarity,
+                    'score': score,
                     'token_estimate': estimate_tokens(
                         f"- {note.title} (Date: {note.timestamp.strftime('%Y-%m-%d')})\n"
                         f"  Content: {preview}\n"
@@ -524,8 +452,8 @@ def get_database_context(workspace, query=None, use_local_llm=False):
             except Note.DoesNotExist:
                 continue
                 
-        # Sort by similarity to allocate tokens to most relevant notes first
-        notes_data.sort(key=lambda x: x['similarity'], reverse=True)
+        # Sort by relevance to allocate tokens to most relevant notes first
+        notes_data.sort(key=lambda x: x['score'], reverse=True)
         
         # Add notes to context based on token budget
         for note_data in notes_data:
@@ -570,6 +498,20 @@ def get_database_context(workspace, query=None, use_local_llm=False):
     
     return context
 
+def _hits_with_sections(retrieved):
+    """
+    Turn retrieved notes into (note_id, score, best_embedding) tuples, loading
+    the matching NoteEmbedding rows (without their vectors) in one query.
+    best_embedding is None for notes without a matching embedded chunk.
+    """
+    embeddings = NoteEmbedding.objects.defer('embedding').in_bulk(
+        [hit.embedding_id for hit in retrieved if hit.embedding_id is not None]
+    )
+    return [
+        (hit.note_id, hit.score, embeddings.get(hit.embedding_id))
+        for hit in retrieved
+    ]
+
 def get_full_database_context(workspace, limit=False):
     """
     Retrieve all data from the database for a specific workspace
@@ -718,12 +660,12 @@ def get_smart_rag_context(workspace, query, focused_note, use_local_llm=False):
     Returns:
         String containing the relevant context data
     """
-    # If we have no query or no OpenAI API key, return a limited context with just the focused note
-    if not query or not settings.OPENAI_API_KEY or use_local_llm:
+    # If we have no query or no embedding backend, return a limited context with just the focused note
+    if not query or not embeddings_available() or use_local_llm:
         return get_truncated_note_context(focused_note)
     
-    # Generate embedding for the query
-    query_embedding = generate_embeddings(query)
+    # Generate embedding for the query (cached, so re-asked questions skip the API)
+    query_array = query_vector(query)
     
     # Track total tokens to avoid exceeding limits
     MAX_CONTEXT_TOKENS = 6000  # Reserve ~2000 tokens for the prompt and response
@@ -744,8 +686,7 @@ def get_smart_rag_context(workspace, query, focused_note, use_local_llm=False):
     if focused_note_embeddings.exists():
         # For each section of the focused note, calculate similarity
         for ne in focused_note_embeddings:
-            embedding_array = np.array(ne.embedding)
-            query_array = np.array(query_embedding)
+            embedding_array = ne.vector
             
             # Calculate cosine similarity
             similarity = float(np.dot(query_array, embedding_array) / (
@@ -814,47 +755,11 @@ def get_smart_rag_context(workspace, query, focused_note, use_local_llm=False):
     
     # 3. Now get other relevant notes (excluding the focused note)
     if estimated_tokens < MAX_CONTEXT_TOKENS:
-        # Get all note embeddings in this workspace except for the focused note
-        note_embeddings = NoteEmbedding.objects.filter(
-            note__workspace=workspace
-        ).exclude(
-            note=focused_note
-        ).select_related('note')
-        
-        # Group embeddings by note
-        note_embedding_map = {}
-        for ne in note_embeddings:
-            if ne.note_id not in note_embedding_map:
-                note_embedding_map[ne.note_id] = []
-            note_embedding_map[ne.note_id].append(ne)
-        
-        # Find most relevant notes
-        note_similarities = []
-        for note_id, embeddings in note_embedding_map.items():
-            # Find the highest similarity for any chunk of this note
-            max_similarity = 0
-            best_embedding = None
-            
-            for ne in embeddings:
-                embedding_array = np.array(ne.embedding)
-                query_array = np.array(query_embedding)
-                
-                # Calculate cosine similarity
-                similarity = float(np.dot(query_array, embedding_array) / (
-                    np.linalg.norm(query_array) * np.linalg.norm(embedding_array)
-                ))
-                
-                if similarity > max_similarity:
-                    max_similarity = similarity
-                    best_embedding = ne
-            
-            # Add to results if we found a match
-            if best_embedding:
-                note_similarities.append((best_embedding.note_id, max_similarity, best_embedding))
-        
-        # Sort by similarity and get top 5
-        note_similarities.sort(key=lambda x: x[1], reverse=True)
-        top_similarities = note_similarities[:5]
+        # Find relevant notes other than the focused note
+        retrieved = retrieve_notes(
+            workspace, query, top_k=5, query_array=query_array, exclude_note_ids={focused_note.id}
+        )
+        top_similarities = _hits_with_sections(retrieved)
         
         # Prepare data for additional notes
         if top_similarities:
@@ -865,7 +770,7 @@ def get_smart_rag_context(workspace, query, focused_note, use_local_llm=False):
                 
                 # Prepare note data
                 other_notes_data = []
-                for note_id, similarity, best_embedding in top_similarities:
+                for note_id, score, best_embedding in top_similarities:
                     try:
                         note = Note.objects.get(id=note_id)
                         # If we have a best_embedding with section_text, prefer using that specific section
@@ -881,7 +786,7 @@ def get_smart_rag_context(workspace, query, focused_note, use_local_llm=False):
                         other_notes_data.append({
                             'note': note,
                             'preview': preview,
-                            'similarity': similarity,
+                            'score': score,
                             'token_estimate': estimate_tokens(
                                 f"- {note.title} (Date: {note.timestamp.strftime('%Y-%m-%d')})\n"
                                 f"  Content: {preview}\n"
@@ -908,32 +813,8 @@ def get_smart_rag_context(workspace, query, focused_note, use_local_llm=False):
     relevant_entity_ids = []
     
     if estimated_tokens < MAX_CONTEXT_TOKENS:
-        try:
-            from ..models import EntityEmbedding
-            
-            entity_embeddings_objs = EntityEmbedding.objects.filter(
-                entity__workspace=workspace
-            ).select_related('entity')
-            
-            if entity_embeddings_objs.exists():
-                entity_embeddings_list = [np.array(ee.embedding) for ee in entity_embeddings_objs]
-                entity_objects = [ee.entity for ee in entity_embeddings_objs]
-                
-                # Get top 3 most similar entities (fewer than normal RAG to save tokens)
-                similar_entities = similarity_search(
-                    query_embedding,
-                    entity_embeddings_list,
-                    top_k=min(3, len(entity_embeddings_list))
-                )
-                
-                # Safely convert indices to entity IDs
-                relevant_entity_ids = []
-                for idx, similarity in similar_entities:
-                    if 0 <= idx < len(entity_objects):  # Ensure index is valid
-                        relevant_entity_ids.append(entity_objects[idx].id)
-        except (ImportError, AttributeError):
-            # EntityEmbedding might not exist yet
-            pass
+        # Get top 3 most similar entities (fewer than normal RAG to save tokens)
+        relevant_entity_ids = similar_entity_ids(workspace, query_array, top_k=3)
     
     # 5. Add a note about the smart RAG approach
     note_text = "\n[Note: This response uses parts of the focused note combined with other relevant content due to token limits.]\n"
@@ -1009,7 +890,7 @@ def get_filtered_context(workspace, tags=None, entities=None, query=None, use_lo
     filtered by tags and/or entities and prioritized for relevance using RAG
     """
     # Decide whether to use RAG or full context
-    use_rag = query and settings.OPENAI_API_KEY and not use_local_llm
+    use_rag = query and embeddings_available() and not use_local_llm
     
     # Check if we have any filters
     has_tag_filters = tags and tags.exists()
@@ -1073,8 +954,6 @@ def build_context_with_relationships(workspace, note_ids, entity_ids, filter_des
     - filter_description: Description of the filters applied
     - include_relationships: Whether to include relationship information
     """
-    from django.contrib.contenttypes.models import ContentType
-    
     # Filter by workspace and IDs
     entities = Entity.objects.filter(workspace=workspace, id__in=entity_ids)
     notes = Note.objects.filter(workspace=workspace, id__in=note_ids).order_by('-timestamp')
@@ -1087,11 +966,12 @@ def build_context_with_relationships(workspace, note_ids, entity_ids, filter_des
     else:
         context += "\n"
     
-    # Get entity content type for relationship queries
-    entity_content_type = ContentType.objects.get_for_model(Entity)
-    
     # Add filtered entities with their relationships
-    if entities.exists():
+    entities = list(entities)
+    if entities:
+        # Look up the relationships of all of them at once
+        relationships = relationships_of(workspace.id, [entity.id for entity in entities]) if include_relationships else {}
+        
         context += "FILTERED ENTITIES:\n"
         for entity in entities:
             # Basic entity info
@@ -1114,52 +994,33 @@ def build_context_with_relationships(workspace, note_ids, entity_ids, filter_des
             
             # Add relationship information if requested
             if include_relationships:
-                # Get relationships where this entity is the source
-                source_relationships = Relationship.objects.filter(
-                    workspace=workspace,
-                    source_content_type=entity_content_type,
-                    source_object_id=entity.id
-                ).select_related('relationship_type')
+                # Relationships where this entity is the source, and where it is the target
+                source_relationships, target_relationships = relationships[entity.id]
                 
-                # Get relationships where this entity is the target
-                target_relationships = Relationship.objects.filter(
-                    workspace=workspace,
-                    target_content_type=entity_content_type,
-                    target_object_id=entity.id
-                ).select_related('relationship_type')
-                
-                if source_relationships.exists() or target_relationships.exists():
+                if source_relationships or target_relationships:
                     context += "  Relationships:\n"
                     
                     # Add source relationships (entity → other)
                     for rel in source_relationships:
-                        if rel.target_content_type == entity_content_type:
-                            try:
-                                target_entity = Entity.objects.get(id=rel.target_object_id)
-                                context += f"    → {rel.relationship_type.display_name} {target_entity.name}\n"
-                                # Add details if they exist
-                                if rel.details:
-                                    details = rel.details if len(rel.details) < 50 else f"{rel.details[:47]}..."
-                                    context += f"      Details: {details}\n"
-                            except Entity.DoesNotExist:
-                                continue
+                        if rel.target is not None:
+                            context += f"    → {rel.relationship_type.display_name} {rel.target.name}\n"
+                            # Add details if they exist
+                            if rel.details:
+                                details = rel.details if len(rel.details) < 50 else f"{rel.details[:47]}..."
+                                context += f"      Details: {details}\n"
                     
                     # Add target relationships (other → entity)
                     for rel in target_relationships:
-                        if rel.source_content_type == entity_content_type:
-                            try:
-                                source_entity = Entity.objects.get(id=rel.source_object_id)
-                                # Use inverse name if available
-                                if rel.relationship_type.is_directional and rel.relationship_type.inverse_name:
-                                    context += f"    ← {source_entity.name} {rel.relationship_type.inverse_name} this\n"
-                                else:
-                                    context += f"    ← {source_entity.name} {rel.relationship_type.display_name} this\n"
-                                # Add details if they exist
-                                if rel.details:
-                                    details = rel.details if len(rel.details) < 50 else f"{rel.details[:47]}..."
-                                    context += f"      Details: {details}\n"
-                            except Entity.DoesNotExist:
-                                continue
+                        if rel.source is not None:
+                            # Use inverse name if available
+                            if rel.relationship_type.is_directional and rel.relationship_type.inverse_name:
+                                context += f"    ← {rel.source.name} {rel.relationship_type.inverse_name} this\n"
+                            else:
+                                context += f"    ← {rel.source.name} {rel.relationship_type.display_name} this\n"
+                            # Add details if they exist
+                            if rel.details:
+                                details = rel.details if len(rel.details) < 50 else f"{rel.details[:47]}..."
+                                context += f"      Details: {details}\n"
             
             context += "\n"  # Add space between entities
     
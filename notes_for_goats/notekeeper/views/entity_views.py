@@ -1,10 +1,16 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib import messages
-from django.contrib.contenttypes.models import ContentType
-from django.db.models import Q
+from django.conf import settings
 from django.http import JsonResponse
-from ..models import Workspace, Entity, Note, Relationship, RelationshipType, Tag
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from ..models import Workspace, Entity, Note, RelationshipType, Tag
 from ..forms import EntityForm
+from ..pagination import page_json_response, paginate_request, wants_json
+from ..adjacency import relationships_of, workspace_adjacency
+from ..graph import cached_entity_graph, graph_version
+from ..search import search_entities
 
 def entity_list(request, workspace_id):
     workspace = get_object_or_404(Workspace, pk=workspace_id)
@@ -20,11 +26,7 @@ def entity_list(request, workspace_id):
     
     # Apply search filter if provided
     if search_query:
-        entities_query = entities_query.filter(
-            Q(name__icontains=search_query) | 
-            Q(details__icontains=search_query) |
-            Q(tags__name__icontains=search_query)
-        ).distinct()
+        entities_query = search_entities(entities_query, search_query)
     
     # Apply entity type filter if provided
     if entity_type:
@@ -36,47 +38,16 @@ def entity_list(request, workspace_id):
             relationship_type_id = int(relationship_type_id)
             target_entity_id = int(target_entity_id)
             
-            # Get the content type for Entity model
-            entity_content_type = ContentType.objects.get_for_model(Entity)
-            
             # Get relationship type to check if it's directional
             relationship_type = RelationshipType.objects.get(id=relationship_type_id, workspace=workspace)
-            related_entity_ids = []
             
-            # If relationship is directional, only consider the appropriate direction
-            if relationship_type.is_directional:
-                # Find entities where: Entity has the specified relationship with the target entity (entity → target)
-                # For "Reports To", this finds entities who report to the target
-                source_entity_ids = Relationship.objects.filter(
-                    workspace=workspace,
-                    relationship_type_id=relationship_type_id,
-                    source_content_type=entity_content_type,
-                    target_content_type=entity_content_type,
-                    target_object_id=target_entity_id
-                ).values_list('source_object_id', flat=True)
-                
-                related_entity_ids = list(source_entity_ids)
-            else:
-                # For non-directional relationships, consider both directions
-                # 1. Entity has the specified relationship with the target entity (entity → target)
-                source_entity_ids = Relationship.objects.filter(
-                    workspace=workspace,
-                    relationship_type_id=relationship_type_id,
-                    source_content_type=entity_content_type,
-                    target_content_type=entity_content_type,
-                    target_object_id=target_entity_id
-                ).values_list('source_object_id', flat=True)
-                
-                # 2. Target entity has the specified relationship with the entity (target → entity)
-                target_entity_ids = Relationship.objects.filter(
-                    workspace=workspace,
-                    relationship_type_id=relationship_type_id,
-                    source_content_type=entity_content_type,
-                    source_object_id=target_entity_id,
-                    target_content_type=entity_content_type
-                ).values_list('target_object_id', flat=True)
-                
-                related_entity_ids = list(source_entity_ids) + list(target_entity_ids)
+            # Entities with the relationship to the target entity (entity → target);
+            # for "Reports To", the entities who report to the target. Non-directional
+            # relationships also count the other way round (target → entity)
+            related_entity_ids = workspace_adjacency(workspace.id).related_ids(
+                target_entity_id, relationship_type_id,
+                either_direction=not relationship_type.is_directional
+            )
             
             # Filter the main query to include only entities with the relationship
             if related_entity_ids:
@@ -89,10 +60,26 @@ def entity_list(request, workspace_id):
             # Invalid ID format or relationship type not found, ignore filter
             pass
     
-    # Get entity counts by type
-    people = entities_query.filter(type='PERSON').order_by('name')
-    projects = entities_query.filter(type='PROJECT').order_by('name')
-    teams = entities_query.filter(type='TEAM').order_by('name')
+    # One page across all types; ordering by type first keeps each type's
+    # entities together (people, then projects, then teams). Searches list
+    # each type's best matches first
+    ordering = ['type', 'search_rank', 'name', 'id'] if search_query else ['type', 'name', 'id']
+    page = paginate_request(request, entities_query.prefetch_related('tags'), ordering)
+    
+    if wants_json(request):
+        return page_json_response(page, lambda entity: {
+            'id': entity.id,
+            'name': entity.name,
+            'type': entity.type,
+            'details': entity.details[:100],
+            'tags': [tag.name for tag in entity.tags.all()],
+            'url': reverse('notekeeper:entity_detail', kwargs={'workspace_id': workspace.id, 'pk': entity.id}),
+        })
+    
+    # Split the page into its type sections
+    people = [entity for entity in page if entity.type == 'PERSON']
+    projects = [entity for entity in page if entity.type == 'PROJECT']
+    teams = [entity for entity in page if entity.type == 'TEAM']
     
     # Get all relationship types for the dropdown
     relationship_types = RelationshipType.objects.filter(workspace=workspace).order_by('display_name')
@@ -108,6 +95,7 @@ def entity_list(request, workspace_id):
         'people': people,
         'projects': projects,
         'teams': teams,
+        'page': page,
         'entities': workspace.entities.all(),  # Keep for backward compatibility
         'relationship_types': relationship_types,
         'all_entities': all_entities,
@@ -128,24 +116,13 @@ def entity_detail(request, workspace_id, pk):
         referenced_entities=entity
     ).order_by('-timestamp')
     
-    # Get relationships
+    # Get relationships, with the other ends loaded
     entity_relationships = []
-    
-    # Source relationships (entity → other)
-    source_relationships = Relationship.objects.filter(
-        source_content_type=ContentType.objects.get_for_model(Entity),
-        source_object_id=entity.id
-    ).select_related('relationship_type', 'target_content_type')
+    source_relationships, target_relationships = relationships_of(workspace.id, [entity.id])[entity.id]
     
     for rel in source_relationships:
         entity_relationships.append((rel, rel.target, True))
     
-    # Target relationships (other → entity)
-    target_relationships = Relationship.objects.filter(
-        target_content_type=ContentType.objects.get_for_model(Entity),
-        target_object_id=entity.id
-    ).select_related('relationship_type', 'source_content_type')
-    
     for rel in target_relationships:
         entity_relationships.append((rel, rel.source, False))
 
@@ -222,74 +199,44 @@ def entity_delete(request, workspace_id, pk):
     })
 
 def entity_relationships_graph(request, workspace_id, pk):
-    """Generate JSON data for a graph of entity relationships"""
+    """
+    Generate JSON data for a graph of entity relationships.
+    ?depth= hops (up to GRAPH_MAX_DEPTH), ?max_nodes= entities (up to
+    GRAPH_MAX_NODES) and any number of ?relationship_type_id= filters.
+    Responses carry an ETag that changes with the workspace's graph.
+    """
     workspace = get_object_or_404(Workspace, pk=workspace_id)
     entity = get_object_or_404(Entity, pk=pk, workspace=workspace)
     
-    # Get relationships data
-    relationships_data = {
-        'nodes': [],
-        'links': []
-    }
-    
-    # Add the central entity
-    relationships_data['nodes'].append({
-        'id': f'e{entity.id}',
-        'name': entity.name,
-        'type': entity.type,
-        'central': True
-    })
-    
-    # Get both outgoing and incoming relationships
-    outgoing = Relationship.objects.filter(
-        source_content_type=ContentType.objects.get_for_model(entity),
-        source_object_id=entity.id
-    ).select_related('relationship_type', 'target_content_type')
-    
-    incoming = Relationship.objects.filter(
-        target_content_type=ContentType.objects.get_for_model(entity),
-        target_object_id=entity.id
-    ).select_related('relationship_type', 'source_content_type')
-    
-    # Add related entities and links
-    for rel in outgoing:
-        if rel.target:
-            node_id = f'e{rel.target_object_id}'
-            relationships_data['nodes'].append({
-                'id': node_id,
-                'name': str(rel.target),
-                'type': getattr(rel.target, 'type', 'unknown'),
-                'central': False
-            })
-            relationships_data['links'].append({
-                'source': f'e{entity.id}',
-                'target': node_id,
-                'type': rel.relationship_type.display_name
-            })
-    
-    for rel in incoming:
-        if rel.source:
-            node_id = f'e{rel.source_object_id}'
-            relationships_data['nodes'].append({
-                'id': node_id,
-                'name': str(rel.source),
-                'type': getattr(rel.source, 'type', 'unknown'),
-                'central': False
-            })
-            relationships_data['links'].append({
-                'source': node_id,
-                'target': f'e{entity.id}',
-                'type': rel.relationship_type.display_name
-            })
+    try:
+        depth = int(request.GET.get('depth', 1))
+    except ValueError:
+        depth = 1
+    depth = max(1, min(depth, settings.GRAPH_MAX_DEPTH))
     
-    # Remove duplicate nodes
-    seen = set()
-    relationships_data['nodes'] = [
-        node for node in relationships_data['nodes']
-        if not (node['id'] in seen or seen.add(node['id']))
+    try:
+        max_nodes = int(request.GET.get('max_nodes', settings.GRAPH_NODES))
+    except ValueError:
+        max_nodes = settings.GRAPH_NODES
+    max_nodes = max(1, min(max_nodes, settings.GRAPH_MAX_NODES))
+    
+    # Invalid IDs are ignored, as in the relationship list filters
+    relationship_type_ids = [
+        int(type_id) for type_id in request.GET.getlist('relationship_type_id') if type_id.isdigit()
     ]
     
-    return JsonResponse(relationships_data)
+    version = graph_version(workspace.id)
+    etag = quote_etag(version)
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+    
+    graph = cached_entity_graph(entity, version, depth, max_nodes, relationship_type_ids)
+    response = JsonResponse(dict(graph, depth=depth, max_nodes=max_nodes))
+    response['ETag'] = etag
+    # Let browsers keep it, but check back each time (a 304 costs a few aggregate queries)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
 
 def get_relationship_targets(request, workspace_id):
     """API endpoint to get entities that have relationships of a specific type"""
@@ -300,40 +247,16 @@ def get_relationship_targets(request, workspace_id):
         relationship_type_id = int(relationship_type_id)
         relationship_type = RelationshipType.objects.get(id=relationship_type_id, workspace=workspace)
         
-        entity_content_type = ContentType.objects.get_for_model(Entity)
-        
-        if relationship_type.is_directional:
-            # For directional relationships, get only entities that are targets
-            # (i.e., entities that have other entities related to them via this relationship)
-            target_ids = Relationship.objects.filter(
-                workspace=workspace,
-                relationship_type_id=relationship_type_id,
-                target_content_type=entity_content_type
-            ).values_list('target_object_id', flat=True).distinct()
-            
-            target_entities = Entity.objects.filter(
-                workspace=workspace,
-                id__in=target_ids
-            ).order_by('name')
-        else:
-            # For non-directional relationships, get all entities involved in this relationship type
-            source_ids = Relationship.objects.filter(
-                workspace=workspace,
-                relationship_type_id=relationship_type_id,
-                source_content_type=entity_content_type
-            ).values_list('source_object_id', flat=True).distinct()
-            
-            target_ids = Relationship.objects.filter(
-                workspace=workspace,
-                relationship_type_id=relationship_type_id,
-                target_content_type=entity_content_type
-            ).values_list('target_object_id', flat=True).distinct()
-            
-            all_ids = list(source_ids) + list(target_ids)
-            target_entities = Entity.objects.filter(
-                workspace=workspace,
-                id__in=all_ids
-            ).order_by('name').distinct()
+        # For directional relationships, get only entities that are targets
+        # (i.e., entities that have other entities related to them via this relationship);
+        # for non-directional relationships, get all entities involved in this relationship type
+        entity_ids = workspace_adjacency(workspace.id).endpoint_ids(
+            relationship_type_id, sources=not relationship_type.is_directional
+        )
+        target_entities = Entity.objects.filter(
+            workspace=workspace,
+            id__in=entity_ids
+        ).order_by('name')
         
         # Format the entities for JSON response
         entity_data = [{
@@ -2,11 +2,19 @@ from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib import messages
 from ..models import Workspace, Relationship, RelationshipInferenceRule
 from ..forms import RelationshipInferenceRuleForm
-from ..inference import apply_inference_rules
+from ..inference import apply_rule
+
+def _result_summary(result):
+    summary = f"{result.created} created, {result.updated} updated, {result.deleted} removed"
+    if result.capped:
+        summary += "; stopped at the rule's limit of inferred relationships"
+    return summary
 
 def inference_rule_list(request, workspace_id):
     workspace = get_object_or_404(Workspace, pk=workspace_id)
-    rules = workspace.inference_rules.all()
+    rules = workspace.inference_rules.select_related(
+        'source_relationship_type', 'second_relationship_type', 'inferred_relationship_type'
+    )
     
     return render(request, 'notekeeper/inference_rule/list.html', {
         'workspace': workspace,
@@ -27,8 +35,8 @@ def inference_rule_create(request, workspace_id):
             
             # Option to apply rules immediately
             if 'apply_now' in request.POST:
-                apply_inference_rules(workspace, relationship_type=rule.source_relationship_type)
-                messages.info(request, "Rule has been applied to existing relationships.")
+                result = apply_rule(rule)
+                messages.info(request, f"Rule has been applied to existing relationships ({_result_summary(result)}).")
                 
             return redirect('notekeeper:inference_rule_list', workspace_id=workspace_id)
     else:
@@ -52,8 +60,8 @@ def inference_rule_edit(request, workspace_id, pk):
             
             # Option to apply rules immediately
             if 'apply_now' in request.POST:
-                apply_inference_rules(workspace, relationship_type=rule.source_relationship_type)
-                messages.info(request, "Rule has been applied to existing relationships.")
+                result = apply_rule(rule)
+                messages.info(request, f"Rule has been applied to existing relationships ({_result_summary(result)}).")
                 
             return redirect('notekeeper:inference_rule_list', workspace_id=workspace_id)
     else:
@@ -69,21 +77,19 @@ def inference_rule_delete(request, workspace_id, pk):
     workspace = get_object_or_404(Workspace, pk=workspace_id)
     rule = get_object_or_404(RelationshipInferenceRule, pk=pk, workspace=workspace)
     
-    # Count relationships that may have been created by this rule
-    auto_inferred_count = Relationship.objects.filter(
+    # Count relationships inferred by this rule and by no other
+    auto_inferred = Relationship.objects.filter(
         workspace=workspace,
-        relationship_type=rule.inferred_relationship_type,
-        notes__startswith="Auto-inferred:"
-    ).count()
+        provenance__rule=rule
+    ).exclude(
+        provenance__rule__in=workspace.inference_rules.exclude(pk=rule.pk)
+    ).distinct()
+    auto_inferred_count = auto_inferred.count()
     
     if request.method == "POST":
         # Optionally delete inferred relationships
         if 'delete_relationships' in request.POST:
-            Relationship.objects.filter(
-                workspace=workspace,
-                relationship_type=rule.inferred_relationship_type,
-                notes__startswith="Auto-inferred:"
-            ).delete()
+            Relationship.objects.filter(pk__in=list(auto_inferred.values_list('pk', flat=True))).delete()
             messages.info(request, f"Deleted {auto_inferred_count} auto-inferred relationships.")
         
         rule.delete()
@@ -103,7 +109,7 @@ def apply_rule_now(request, workspace_id, pk):
     
     if request.method == "POST":
         # Apply the rule to all entities
-        apply_inference_rules(workspace, relationship_type=rule.source_relationship_type)
-        messages.success(request, "Rule applied successfully to existing relationships.")
+        result = apply_rule(rule)
+        messages.success(request, f"Rule applied successfully to existing relationships ({_result_summary(result)}).")
     
     return redirect('notekeeper:inference_rule_list', workspace_id=workspace_id) 
\ No newline at end of file
@@ -1,15 +1,15 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.utils import timezone
 from django.contrib import messages
-from ..models import Workspace, Note, NoteEmbedding
+from ..models import Workspace, Note, NoteEmbedding, EmbeddingJob
 from ..forms import UrlImportForm, HtmlImportForm, PdfImportForm
 from ..utils.url_import import fetch_url_content
 from ..utils.content_extraction import extract_content_from_html
-from ..utils.embedding import generate_embeddings, count_tokens, generate_chunked_embeddings
+from ..embedding_jobs import enqueue_note_embedding
+from ..utils.embedding_backends import embeddings_available
 from ..utils.pdf_extraction import extract_text_from_pdf
 from ..utils.file_storage import save_imported_file
 import logging
-import time
 from django.conf import settings
 import os
 from django.http import FileResponse, Http404
@@ -189,61 +189,21 @@ def note_import_from_pdf(request, workspace_id):
     })
 
 def _ensure_embedding_created(note):
-    """Helper function to ensure embeddings are created for imported notes"""
-    # Wait a tiny bit to allow signals to process
-    time.sleep(0.5)
-    
+    """Helper function to ensure embeddings are queued for imported notes"""
     try:
-        # Check if embedding exists
+        # The post_save signal normally queues the job already
         embedding_exists = NoteEmbedding.objects.filter(note=note).exists()
+        job_exists = EmbeddingJob.objects.filter(object_type=EmbeddingJob.OBJECT_NOTE, object_id=note.id).exists()
         
-        if not embedding_exists and settings.OPENAI_API_KEY:
-            logger.warning(f"No embedding found for note {note.id} - creating manually")
-            
-            # Combine title and content
-            text_to_embed = f"{note.title}\n\n{note.content}"
-            
-            # Check if text exceeds token limit
-            estimated_tokens = count_tokens(text_to_embed)
-            logger.info(f"Note {note.id} estimated token count: {estimated_tokens}")
-            
-            if estimated_tokens <= 8000:
-                # Standard approach for smaller texts
-                embedding_vector = generate_embeddings(text_to_embed)
-                
-                # Create the embedding
-                NoteEmbedding.objects.create(
-                    note=note,
-                    embedding=embedding_vector,
-                    section_index=0,
-                    section_text=text_to_embed[:1000] if len(text_to_embed) > 1000 else text_to_embed
-                )
-                
-                logger.info(f"Manually created embedding for imported note {note.id}")
-            else:
-                # For large texts, use chunking
-                logger.info(f"Note {note.id} exceeds token limit, using chunking")
-                
-                # Generate embeddings for chunks
-                chunk_results = generate_chunked_embeddings(text_to_embed)
-                
-                # Save each chunk embedding
-                for i, (chunk_text, embedding) in enumerate(chunk_results):
-                    NoteEmbedding.objects.create(
-                        note=note,
-                        embedding=embedding,
-                        section_index=i,
-                        section_text=chunk_text[:1000] if len(chunk_text) > 1000 else chunk_text
-                    )
-                
-                logger.info(f"Created {len(chunk_results)} chunk embeddings for note {note.id}")
-                
-        elif embedding_exists:
-            logger.info(f"Embedding already exists for note {note.id} - no manual creation needed")
+        if not embedding_exists and not job_exists and embeddings_available():
+            logger.warning(f"No embedding found for note {note.id} - queueing an embedding job")
+            enqueue_note_embedding(note.id)
+        elif embedding_exists or job_exists:
+            logger.info(f"Embedding already exists or is queued for note {note.id}")
         else:
-            logger.warning(f"No OpenAI API key configured - skipping embedding creation")
+            logger.warning(f"Embedding backend not available - skipping embedding creation")
     except Exception as e:
-        logger.error(f"Error in manual embedding creation for note {note.id}: {str(e)}", exc_info=True)
+        logger.error(f"Error queueing embedding for note {note.id}: {str(e)}", exc_info=True)
 
 def serve_imported_file(request, workspace_id, note_id):
     """Serve an imported file associated with a note"""
@@ -1,15 +1,21 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from django.db.models import Q
+from django.db.models.functions import Substr
+from django.urls import reverse
 from django.utils import timezone
 from django.contrib import messages
 import re
 from ..models import Workspace, Note, Entity, Tag
 from ..forms import NoteForm
+from ..pagination import page_json_response, paginate_request, wants_json
+from ..search import search_notes
 import logging
 
 # Import at the top
 logger = logging.getLogger(__name__)
 
+# Characters of each note shown in the note list
+NOTE_PREVIEW_LENGTH = 300
+
 def note_list(request, workspace_id):
     workspace = get_object_or_404(Workspace, pk=workspace_id)
     
@@ -48,15 +54,32 @@ def note_list(request, workspace_id):
         # Filter notes by selected tag
         notes = notes.filter(tags__id=tag_filter)
     
+    ordering = ['-timestamp', '-id']
     if search_query:
-        notes = notes.filter(
-            Q(title__icontains=search_query) | 
-            Q(content__icontains=search_query)
-        )
+        # Ranked full-text search (best matches first)
+        notes = search_notes(notes, search_query)
+        ordering = ['search_rank', '-timestamp', '-id']
+    
+    # The list only shows a preview, so don't load whole note bodies
+    notes = notes.distinct().defer('content').annotate(
+        content_preview=Substr('content', 1, NOTE_PREVIEW_LENGTH)
+    ).prefetch_related('tags')
+    page = paginate_request(request, notes, ordering)
+    
+    if wants_json(request):
+        return page_json_response(page, lambda note: {
+            'id': note.id,
+            'title': note.title,
+            'timestamp': note.timestamp.isoformat(),
+            'preview': note.content_preview,
+            'tags': [tag.name for tag in note.tags.all()],
+            'url': reverse('notekeeper:note_detail', kwargs={'workspace_id': workspace.id, 'pk': note.id}),
+        })
     
     return render(request, 'notekeeper/note/list.html', {
         'workspace': workspace,
-        'notes': notes.distinct(),
+        'notes': page,
+        'page': page,
         'entities': entities,
         'tags': tags,
         'entity_types': entity_types,
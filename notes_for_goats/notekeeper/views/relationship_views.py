@@ -4,7 +4,9 @@ from django.contrib import messages
 from django.contrib.contenttypes.models import ContentType
 from ..models import Workspace, Entity, Relationship, RelationshipType
 from ..forms import RelationshipForm
-from ..inference import apply_inference_rules, handle_relationship_deleted
+from ..pagination import page_json_response, paginate_request, wants_json
+from ..inference import dependent_relationship_ids, relationship_added, relationship_removed
+from ..utils.relationships import resolve_relationship_endpoints
 
 def relationship_list(request, workspace_id):
     workspace = get_object_or_404(Workspace, pk=workspace_id)
@@ -64,12 +66,27 @@ def relationship_list(request, workspace_id):
             # Invalid ID format, ignore filter
             pass
     
-    # Order by creation date (newest first)
-    relationships = relationships.order_by('-created_at')
+    # Order by creation date (newest first), one page at a time
+    relationship_count = relationships.count()
+    relationships = relationships.select_related('relationship_type', 'source_content_type', 'target_content_type')
+    page = paginate_request(request, relationships, ['-created_at', '-id'])
+    resolve_relationship_endpoints(page.items)
+    
+    if wants_json(request):
+        return page_json_response(page, lambda rel: {
+            'id': rel.id,
+            'source': str(rel.source),
+            'relationship': rel.relationship_type.display_name,
+            'target': str(rel.target),
+            'details': rel.details,
+            'created_at': rel.created_at.isoformat(),
+        })
     
     return render(request, 'notekeeper/relationship/list.html', {
         'workspace': workspace,
-        'relationships': relationships,
+        'relationships': page,
+        'relationship_count': relationship_count,
+        'page': page,
         'all_entities': all_entities,
         'all_relationship_types': all_relationship_types,
         'selected_entity_id': selected_entity_id,
@@ -97,8 +114,8 @@ def relationship_create(request, workspace_id):
             
             relationship.save()
             
-            # Apply inference rules after creating the relationship
-            apply_inference_rules(workspace, source, relationship.relationship_type)
+            # Infer the relationships this one adds
+            relationship_added(relationship)
             
             messages.success(request, 'Relationship created successfully.')
             return redirect('notekeeper:relationship_list', workspace_id=workspace.id)
@@ -129,6 +146,8 @@ def relationship_edit(request, workspace_id, pk):
         target_entity = get_object_or_404(Entity, pk=relationship.target_object_id)
     
     if request.method == "POST":
+        # The form updates the instance in place, so keep the old endpoints for inference
+        previous = Relationship.objects.get(pk=relationship.pk)
         form = RelationshipForm(request.POST, instance=relationship, workspace=workspace)
         if form.is_valid():
             # Update the relationship
@@ -145,6 +164,13 @@ def relationship_edit(request, workspace_id, pk):
             
             updated_relationship.save()
             
+            # An edit that moves the relationship counts as a delete plus a create
+            edge_fields = ['relationship_type_id', 'source_content_type_id', 'source_object_id',
+                           'target_content_type_id', 'target_object_id']
+            if any(getattr(previous, field) != getattr(updated_relationship, field) for field in edge_fields):
+                relationship_removed(previous, dependent_relationship_ids(previous))
+                relationship_added(updated_relationship)
+            
             messages.success(request, 'Relationship updated successfully.')
             return redirect('notekeeper:relationship_list', workspace_id=workspace_id)
         else:
@@ -174,21 +200,12 @@ def relationship_delete(request, workspace_id, pk):
         from_entity = get_object_or_404(Entity, pk=from_entity_id, workspace=workspace)
     
     if request.method == "POST":
-        # Store relationship data before deleting
-        relationship_data = {
-            'workspace': relationship.workspace,
-            'relationship_type': relationship.relationship_type,
-            'source_content_type': relationship.source_content_type,
-            'source_object_id': relationship.source_object_id,
-            'target_content_type': relationship.target_content_type,
-            'target_object_id': relationship.target_object_id
-        }
-        
-        # Delete the relationship
+        # Delete the relationship, noting first which inferred relationships it supports
+        dependents = dependent_relationship_ids(relationship)
         relationship.delete()
         
-        # Handle updates to inferred relationships
-        handle_relationship_deleted(workspace, type('obj', (object,), relationship_data))
+        # Remove the inferred relationships that depended on it
+        relationship_removed(relationship, dependents)
         
         messages.success(request, "Relationship deleted successfully.")
         
@@ -1,7 +1,10 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib import messages
+from django.db.models import Count
+from django.urls import reverse
 from ..models import Workspace, Tag, Entity
 from ..forms import TagForm
+from ..pagination import page_json_response, paginate_request, wants_json
 
 def tag_list(request, workspace_id):
     """Display all tags for a workspace with optional search"""
@@ -15,12 +18,30 @@ def tag_list(request, workspace_id):
     if search_query:
         tags_queryset = tags_queryset.filter(name__icontains=search_query)
     
-    # Order by name by default
-    tags = tags_queryset.order_by('name')
+    # Count usage in the same query instead of two queries per tag
+    tag_count = tags_queryset.count()
+    tags_queryset = tags_queryset.annotate(
+        entity_count=Count('tagged_entities', distinct=True),
+        note_count=Count('tagged_notes', distinct=True)
+    )
+    
+    # Order by name by default, one page at a time
+    page = paginate_request(request, tags_queryset, ['name', 'id'])
+    
+    if wants_json(request):
+        return page_json_response(page, lambda tag: {
+            'id': tag.id,
+            'name': tag.name,
+            'entity_count': tag.entity_count,
+            'note_count': tag.note_count,
+            'url': reverse('notekeeper:tag_detail', kwargs={'workspace_id': workspace.id, 'pk': tag.id}),
+        })
     
     return render(request, 'notekeeper/tag/list.html', {
         'workspace': workspace,
-        'tags': tags,
+        'tags': page,
+        'tag_count': tag_count,
+        'page': page,
     })
 
 def tag_detail(request, workspace_id, pk):
@@ -105,16 +126,13 @@ def update_tag_relationships(request, workspace_id):
     # Get all tags in this workspace
     tags = Tag.objects.filter(workspace=workspace)
     
-    # For each tag, update relationships
-    for tag in tags:
-        tag.update_relationships()
+    # Link every note and entity sharing one of these tags in a single statement
+    added = tags.update_relationships()
     
-    # Get all entities in this workspace
     entities = Entity.objects.filter(workspace=workspace)
     
-    # For each entity, update relationships
-    for entity in entities:
-        entity.update_relationships_from_tags()
-    
-    messages.success(request, f"Updated relationships for {tags.count()} tags and {entities.count()} entities.")
+    messages.success(
+        request,
+        f"Updated relationships for {tags.count()} tags and {entities.count()} entities ({added} new links)."
+    )
     return redirect('notekeeper:workspace_detail', pk=workspace_id) 
\ No newline at end of file
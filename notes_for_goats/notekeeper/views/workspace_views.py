@@ -7,6 +7,7 @@ from django.core.management import call_command
 from django.http import HttpResponse
 from ..models import Workspace, Tag
 from ..forms import WorkspaceForm
+from ..utils.relationships import resolve_relationship_endpoints
 
 def workspace_list(request):
     workspaces = Workspace.objects.all()
@@ -29,7 +30,9 @@ def workspace_detail(request, pk):
         'current_workspace': workspace,
         'recent_notes': workspace.note_notes.order_by('-timestamp')[:5],
         'entities_by_type': entities_by_type,
-        'recent_relationships': workspace.relationships.select_related('relationship_type').order_by('-created_at')[:5],
+        'recent_relationships': resolve_relationship_endpoints(workspace.relationships.select_related(
+            'relationship_type', 'source_content_type', 'target_content_type'
+        ).order_by('-created_at')[:5]),
         'relationship_types': workspace.relationship_types.all(),
         'workspace_tags': Tag.objects.filter(workspace=workspace).order_by('name'),
     }
@@ -140,4 +140,65 @@ LOCAL_LLM_URL = os.environ.get('LOCAL_LLM_URL', 'http://localhost:11434')
 LOCAL_LLM_MODEL = os.environ.get('LOCAL_LLM_MODEL', 'llama3')
 
 # Add this near other path configurations
-IMPORT_FILES_DIR = os.environ.get('IMPORT_FILES_DIR', os.path.join(BASE_DIR, 'notekeeper', 'imports'))
\ No newline at end of file
+IMPORT_FILES_DIR = os.environ.get('IMPORT_FILES_DIR', os.path.join(BASE_DIR, 'notekeeper', 'imports'))
+
+# Memory-mapped note embedding index files, shared by all worker processes
+VECTOR_INDEX_DIR = os.environ.get('VECTOR_INDEX_DIR', os.path.join(BASE_DIR, 'vector_index'))
+
+# Workspaces with at least this many embedded chunks use approximate (IVF) search
+ANN_THRESHOLD = int(os.environ.get('ANN_THRESHOLD', 50000))
+# Inverted lists scanned per query; higher is slower but closer to exact
+ANN_NPROBE = int(os.environ.get('ANN_NPROBE', 16))
+# Number of inverted lists; 0 picks about sqrt(chunk count)
+ANN_LISTS = int(os.environ.get('ANN_LISTS', 0))
+
+# Embedding request batching: per-request limits and concurrent requests
+EMBEDDING_BATCH_MAX_ITEMS = int(os.environ.get('EMBEDDING_BATCH_MAX_ITEMS', 256))
+EMBEDDING_BATCH_MAX_TOKENS = int(os.environ.get('EMBEDDING_BATCH_MAX_TOKENS', 100000))
+EMBEDDING_MAX_WORKERS = int(os.environ.get('EMBEDDING_MAX_WORKERS', 4))
+
+# Background embedding jobs: attempts before giving up, and retry backoff in seconds
+EMBEDDING_JOB_MAX_ATTEMPTS = int(os.environ.get('EMBEDDING_JOB_MAX_ATTEMPTS', 5))
+EMBEDDING_JOB_BACKOFF = int(os.environ.get('EMBEDDING_JOB_BACKOFF', 30))
+EMBEDDING_JOB_MAX_BACKOFF = int(os.environ.get('EMBEDDING_JOB_MAX_BACKOFF', 3600))
+
+# Text -> embedding cache (mostly Ask AI queries): entries kept per process,
+# lifetime in seconds, and an optional Django cache alias shared by all workers
+EMBEDDING_CACHE_SIZE = int(os.environ.get('EMBEDDING_CACHE_SIZE', 1024))
+EMBEDDING_CACHE_TTL = int(os.environ.get('EMBEDDING_CACHE_TTL', 3600))
+EMBEDDING_CACHE_ALIAS = os.environ.get('EMBEDDING_CACHE_ALIAS', '')
+
+# Embedding provider: OpenAI (needs OPENAI_API_KEY) or the offline hashing
+# vectorizer, 'notekeeper.utils.embedding_backends.HashingEmbeddingBackend'
+EMBEDDING_BACKEND = os.environ.get('EMBEDDING_BACKEND', 'notekeeper.utils.embedding_backends.OpenAIEmbeddingBackend')
+EMBEDDING_HASHING_DIMENSIONS = int(os.environ.get('EMBEDDING_HASHING_DIMENSIONS', 768))
+
+# Keep an int8 copy of each vector index and scan it first in exact searches;
+# the best VECTOR_INDEX_RESCORE chunks are then rescored with the float vectors
+VECTOR_INDEX_QUANTIZE = os.environ.get('VECTOR_INDEX_QUANTIZE', 'False').lower() in ('true', '1', 'yes')
+VECTOR_INDEX_RESCORE = int(os.environ.get('VECTOR_INDEX_RESCORE', 200))
+
+# Ask AI hybrid retrieval: reciprocal rank fusion of bm25 (full-text index) and
+# embedding similarity. Weights scale each ranking (0 disables it), RRF_K damps
+# the advantage of the very top ranks, CANDIDATES is the depth of each ranking
+HYBRID_LEXICAL_WEIGHT = float(os.environ.get('HYBRID_LEXICAL_WEIGHT', 1.0))
+HYBRID_VECTOR_WEIGHT = float(os.environ.get('HYBRID_VECTOR_WEIGHT', 1.0))
+HYBRID_RRF_K = int(os.environ.get('HYBRID_RRF_K', 60))
+HYBRID_CANDIDATES = int(os.environ.get('HYBRID_CANDIDATES', 50))
+
+# Rows per page in the note, entity, relationship and tag lists (?page_size=
+# can ask for up to LIST_MAX_PAGE_SIZE)
+LIST_PAGE_SIZE = int(os.environ.get('LIST_PAGE_SIZE', 50))
+LIST_MAX_PAGE_SIZE = int(os.environ.get('LIST_MAX_PAGE_SIZE', 500))
+
+# Entity relationship graph: entities per graph by default (?max_nodes= can
+# ask for up to GRAPH_MAX_NODES), the most hops (?depth=), and how long, in
+# seconds, a graph stays in the cache (a change to the workspace makes a new
+# key anyway)
+GRAPH_NODES = int(os.environ.get('GRAPH_NODES', 200))
+GRAPH_MAX_NODES = int(os.environ.get('GRAPH_MAX_NODES', 2000))
+GRAPH_MAX_DEPTH = int(os.environ.get('GRAPH_MAX_DEPTH', 5))
+GRAPH_CACHE_TIMEOUT = int(os.environ.get('GRAPH_CACHE_TIMEOUT', 600))
+
+# Workspaces whose relationship adjacency each process keeps in memory
+ADJACENCY_CACHE_SIZE = int(os.environ.get('ADJACENCY_CACHE_SIZE', 8))